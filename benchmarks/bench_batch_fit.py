@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# coding=utf-8
+# Filename: bench_batch_fit.py
+"""
+Compare the Levenberg-Marquardt solver with one Minuit fit per event.
+
+The LM solver is timed per event (solver='lm' in the ROyFitter) and for
+all events in one batch (batch_size).
+
+Usage: python benchmarks/bench_batch_fit.py [n_events]
+
+"""
+from __future__ import division, absolute_import, print_function
+import sys
+import time
+
+import numpy as np
+import iminuit as minuit
+
+from royfit.minimiser import QualityFunction, BatchQualityFunction
+from royfit.solvers import levenberg_marquardt
+
+
+def make_events(n_events, seed=42):
+    """Generate single line events with 4-18 hits from the T_gamma model"""
+    random = np.random.RandomState(seed)
+    events = []
+    for _ in range(n_events):
+        n_hits = random.randint(4, 19)
+        z = np.sort(random.choice(np.arange(18) * 9., n_hits, replace=False))
+        truth = (random.uniform(-0.9, 0.9), random.uniform(20, 130),
+                 random.uniform(5, 60), random.uniform(0, 100))
+        string = QualityFunction(np.zeros(n_hits), z, np.ones(n_hits))
+        t = string.T_gamma(*truth) + random.normal(0, 3, n_hits)
+        events.append((t, z, random.randint(1, 4, n_hits)))
+    return events
+
+
+def fit_minuit(events):
+    results = []
+    for t, z, counts in events:
+        quality_function = QualityFunction(t, z, counts,
+                                           sigma_t=8, d0=50, d1=5)
+        fitter = minuit.Minuit(quality_function,
+                               grad=quality_function.grad,
+                               zc=(min(z) + max(z)) / 2, tc=min(t),
+                               dc=20., uz=-0.75,
+                               error_dc=1.0, error_uz=0.01,
+                               error_tc=1.0, error_zc=1.0,
+                               limit_zc=(min(z), max(z)),
+                               limit_uz=(-1.0, 1.0),
+                               limit_dc=(2., 100.),
+                               errordef=1, print_level=0)
+        fitter.tol = 1
+        fitter.migrad()
+        results.append(([fitter.values[p] for p in ('uz', 'zc', 'dc', 'tc')],
+                        fitter.fval))
+    return results
+
+
+def fit_batch(events):
+    t, z, counts = zip(*events)
+    quality_function = BatchQualityFunction(t, z, counts,
+                                            sigma_t=8, d0=50, d1=5)
+    z_min = np.array([min(hits) for hits in z])
+    z_max = np.array([max(hits) for hits in z])
+    n_events = len(events)
+    p0 = np.column_stack((np.full(n_events, -0.75), (z_min + z_max) / 2,
+                          np.full(n_events, 20.),
+                          [min(hits) for hits in t]))
+    lower = np.column_stack((np.full(n_events, -1.), z_min,
+                             np.full(n_events, 2.),
+                             np.full(n_events, -np.inf)))
+    upper = np.column_stack((np.full(n_events, 1.), z_max,
+                             np.full(n_events, 100.),
+                             np.full(n_events, np.inf)))
+    return levenberg_marquardt(quality_function.residuals_and_jacobian,
+                               p0, lower, upper, tol=1)
+
+
+def main():
+    n_events = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    events = make_events(n_events)
+
+    start = time.time()
+    minuit_results = fit_minuit(events)
+    minuit_time = time.time() - start
+
+    start = time.time()
+    for event in events:
+        fit_batch([event])
+    single_time = time.time() - start
+
+    start = time.time()
+    batch_result = fit_batch(events)
+    batch_time = time.time() - start
+
+    minuit_fval = np.array([fval for _, fval in minuit_results])
+    minuit_uz = np.array([values[0] for values, _ in minuit_results])
+    same_minimum = np.abs(batch_result.cost - minuit_fval) < 0.1
+    delta_uz = np.abs(batch_result.params[:, 0] - minuit_uz)[same_minimum]
+
+    print("Events:                   {0}".format(n_events))
+    print("Minuit:                   {0:9.1f} fits/s"
+          .format(n_events / minuit_time))
+    print("LM per event:             {0:9.1f} fits/s"
+          .format(n_events / single_time))
+    print("Batch LM:                 {0:9.1f} fits/s"
+          .format(n_events / batch_time))
+    print("Converged (batch LM):     {0}".format(batch_result.converged.sum()))
+    print("Same minimum (dQ < 0.1):  {0}".format(same_minimum.sum()))
+    print("  median |delta uz|:      {0:.2e}".format(np.median(delta_uz)))
+    print("  95% |delta uz|:         {0:.2e}"
+          .format(np.percentile(delta_uz, 95)))
+    print("Batch LM lower Q:         {0}"
+          .format(np.sum(batch_result.cost < minuit_fval - 0.1)))
+    print("Minuit lower Q:           {0}"
+          .format(np.sum(minuit_fval < batch_result.cost - 0.1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# coding=utf-8
+# Filename: bench_filters.py
+"""
+Benchmark TOTFilter and FirstOMHitFilter on large noisy events.
+
+Usage: python benchmarks/bench_filters.py
+
+"""
+from __future__ import division, absolute_import, print_function
+import time
+
+from royfit.core import TOTFilter, FirstOMHitFilter
+from royfit.geometry import get_pmt_table
+from royfit.hits import HitSeries
+
+from synthetic import FakeDetector, make_raw_hits
+
+
+def legacy_tot_filter(hits, min_tot):
+    return [hit for hit in hits if hit.tot >= min_tot]
+
+
+def legacy_first_om_hits(hits, detector):
+    first_hits = []
+    skip_oms = []
+    for hit in sorted(hits, key=lambda x: x.time):
+        om = detector.pmtid2omkey(hit.pmt_id)[:2]
+        if om in skip_oms:
+            continue
+        first_hits.append(hit)
+        skip_oms.append(om)
+    return first_hits
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def main():
+    detector = FakeDetector(n_lines=20)
+    tot_filter = TOTFilter(input_hits='Hits', output_hits='LongToTHits',
+                           min_tot=20)
+    first_om_hit_filter = FirstOMHitFilter(input_hits='Hits',
+                                           output_hits='FirstOMHits')
+    tot_filter.detector = first_om_hit_filter.detector = detector
+    pmt_table = get_pmt_table(detector)
+
+    for n_hits in (1000, 10000, 100000):
+        hits = make_raw_hits(n_hits, n_lines=20)
+
+        legacy_tot, long_tot_hits = timed(legacy_tot_filter, hits, 20)
+        legacy_first, first_hits = timed(legacy_first_om_hits, hits,
+                                         detector)
+
+        conversion, hit_series = timed(HitSeries.from_hits, hits, pmt_table)
+        blob = {'Hits': hit_series}
+        new_tot, blob = timed(tot_filter.process, blob)
+        new_first, blob = timed(first_om_hit_filter.process, blob)
+
+        assert list(blob['LongToTHits'].id) == [h.id for h in long_tot_hits]
+        assert list(blob['FirstOMHits'].id) == [h.id for h in first_hits]
+
+        print("{0:6d} hits".format(n_hits))
+        print("  TOTFilter:        legacy {0:8.2f} ms, array {1:8.2f} ms"
+              .format(legacy_tot * 1e3, new_tot * 1e3))
+        print("  FirstOMHitFilter: legacy {0:8.2f} ms, array {1:8.2f} ms"
+              .format(legacy_first * 1e3, new_first * 1e3))
+        print("  (conversion of the hit objects: {0:.2f} ms)"
+              .format(conversion * 1e3))
+
+
+if __name__ == '__main__':
+    main()
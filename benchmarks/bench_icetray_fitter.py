@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# coding=utf-8
+# Filename: bench_icetray_fitter.py
+"""
+Frame throughput of the fit in the icetray ROyFitter.Physics, without
+icetray: the pulses are (omkey, pulse) lists like from the PulseAssistant.
+
+The former per line loop (pulses of each line, DOM deduplication with a
+list, a detector lookup for every z-coordinate and one solver call per
+line) is compared to royfit.fitting.fit_lines(). Both use the batched LM
+solver, the old module used one Minuit fit per line.
+
+Usage: python benchmarks/bench_icetray_fitter.py [n_frames]
+
+"""
+from __future__ import division, absolute_import, print_function
+import sys
+from collections import namedtuple
+from timeit import default_timer as timer
+
+import numpy as np
+
+from royfit.fitting import fit_events, fit_lines
+
+from synthetic import FakeDetector, make_multi_line_event
+
+FIT_PARAMETERS = dict(sigma_t=1, dc_limits=(2., 80.), amplitude=False)
+
+
+class Pulse(object):
+    def __init__(self, time):
+        self.time = time
+
+    def GetTime(self):
+        return self.time
+
+
+class I3Detector(object):
+    """pmt_pos() like the i3kit Detector"""
+    Position = namedtuple('Position', 'X Y Z')
+
+    def __init__(self, detector):
+        self.lines = list(range(1, detector.n_lines + 1))
+        self.positions = dict((detector.pmtid2omkey(pmt.id),
+                               self.Position(*pmt.pos))
+                              for pmt in detector.pmts)
+
+    def pmt_pos(self, omkey):
+        return self.positions[omkey]
+
+
+def make_frames(n_lines, n_frames):
+    detector = FakeDetector(n_lines)
+    frames = []
+    for seed in range(n_frames):
+        hits, _, _ = make_multi_line_event(n_lines, noise_rate=1e3,
+                                           seed=seed)
+        frames.append([(detector.pmtid2omkey(hit.pmt_id), Pulse(hit.time))
+                       for hit in hits])
+    return I3Detector(detector), frames
+
+
+def fit_per_line(detector, pulses):
+    """The loop of the former ROyFitter.Physics"""
+    n_fits = 0
+    for line in detector.lines:
+        line_pulses = [(omkey, pulse) for omkey, pulse in pulses
+                       if omkey[0] == line]
+        used_doms = []
+        selected_pulses = []
+        for omkey, pulse in line_pulses:
+            if omkey[1] not in used_doms:
+                used_doms.append(omkey[1])
+                selected_pulses.append((omkey, pulse))
+        if len(selected_pulses) > 4:
+            pulse_times = [p.GetTime() for _, p in selected_pulses]
+            z_coordinates = [detector.pmt_pos(omkey).Z
+                             for omkey, _ in selected_pulses]
+            seed = (0., z_coordinates[0], 20., pulse_times[0])
+            fit_events([pulse_times], [z_coordinates],
+                       [np.ones(len(pulse_times))], [[seed]],
+                       **FIT_PARAMETERS)
+            n_fits += 1
+    return n_fits
+
+
+def fit_arrays(detector, pulses, z_cache):
+    """The array based ROyFitter.Physics"""
+    omkeys = [omkey for omkey, _ in pulses]
+    lines = np.array([omkey[0] for omkey in omkeys], dtype=int)
+    oms = np.array([omkey[1] for omkey in omkeys], dtype=int)
+    times = np.array([pulse.GetTime() for _, pulse in pulses])
+    for omkey in set(omkeys).difference(z_cache):
+        z_cache[omkey] = detector.pmt_pos(omkey).Z
+    z = np.array([z_cache[omkey] for omkey in omkeys])
+    fitted_lines, _ = fit_lines(lines, oms, times, z, min_hits=5,
+                                **FIT_PARAMETERS)
+    return len(fitted_lines)
+
+
+def main():
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print("{0:>5} {1:>8} {2:>14} {3:>14}"
+          .format('lines', 'fits', 'per line', 'arrays'))
+    print("{0:>5} {1:>8} {2:>14} {2:>14}".format('', '', '[frames/s]'))
+    for n_lines in (1, 4, 16, 64):
+        detector, frames = make_frames(n_lines, n_frames)
+        start = timer()
+        n_fits = sum(fit_per_line(detector, pulses) for pulses in frames)
+        per_line_time = timer() - start
+        z_cache = {}
+        start = timer()
+        n_array_fits = sum(fit_arrays(detector, pulses, z_cache)
+                           for pulses in frames)
+        array_time = timer() - start
+        assert n_fits == n_array_fits
+        print("{0:5d} {1:8d} {2:14.1f} {3:14.1f}"
+              .format(n_lines, n_fits, n_frames / per_line_time,
+                      n_frames / array_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# coding=utf-8
+# Filename: bench_import.py
+"""
+Import time of the royfit package and its modules in a fresh interpreter.
+
+Usage: python benchmarks/bench_import.py [n_repeat]
+
+"""
+from __future__ import division, absolute_import, print_function
+import os
+import subprocess
+import sys
+
+STATEMENTS = ['import royfit',
+              'from royfit.minimiser import QualityFunction',
+              'from royfit.solvers import levenberg_marquardt',
+              'from royfit.fitting import fit_events',
+              'from royfit import ROyFitter']
+
+TIMER = """
+import time
+start = time.time()
+try:
+    {0}
+except ImportError as error:
+    print('ImportError: {{0}}'.format(error))
+else:
+    print(time.time() - start)
+"""
+
+
+def import_time(statement, n_repeat):
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    timings = []
+    for _ in range(n_repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', TIMER.format(statement)], cwd=root,
+            stderr=subprocess.STDOUT).decode().strip().splitlines()[-1]
+        if output.startswith('ImportError'):
+            return output
+        timings.append(float(output))
+    return "{0:8.1f} ms".format(min(timings) * 1e3)
+
+
+def main():
+    n_repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for statement in STATEMENTS:
+        print("{0:>50}: {1}".format(statement,
+                                    import_time(statement, n_repeat)))
+
+
+if __name__ == '__main__':
+    main()
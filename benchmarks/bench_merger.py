@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# coding=utf-8
+# Filename: bench_merger.py
+"""
+Throughput of the OM hit merging for 10^5 to 10^6 hits per event.
+
+Usage: python benchmarks/bench_merger.py
+
+"""
+from __future__ import division, absolute_import, print_function
+import time
+
+import numpy as np
+
+from royfit.geometry import get_pmt_table
+from royfit.hits import HitSeries, merge_om_hits
+
+from synthetic import FakeDetector, OMS_PER_LINE, PMTS_PER_OM
+
+
+def make_hit_series(n_hits, pmt_table, n_lines, seed=1):
+    random = np.random.RandomState(seed)
+    pmt_ids = random.randint(1, n_lines * OMS_PER_LINE * PMTS_PER_OM + 1,
+                             n_hits)
+    times = np.round(random.uniform(0, 1e6, n_hits))
+    tots = random.randint(1, 60, n_hits)
+    return HitSeries.from_arrays(np.arange(n_hits), pmt_ids, times, tots,
+                                 pmt_table)
+
+
+def main():
+    n_lines = 20
+    pmt_table = get_pmt_table(FakeDetector(n_lines=n_lines))
+    for n_hits in (100000, 300000, 1000000):
+        hits = make_hit_series(n_hits, pmt_table, n_lines)
+        for keep_singletons in (True, False):
+            start = time.time()
+            merged_hits = merge_om_hits(hits, 10, keep_singletons)
+            elapsed = time.time() - start
+            print("{0:8d} hits, keep_singletons={1!s:5}: {2:8.2f} ms, "
+                  "{3:6.1f} Mhits/s, {4} merged hits"
+                  .format(n_hits, keep_singletons, elapsed * 1e3,
+                          n_hits / elapsed / 1e6, len(merged_hits)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding=utf-8
+# Filename: bench_multi_line.py
+"""
+Scaling of the multi_line mode of the ROyFitter with the number of lines.
+
+For each detector size, the hit selection of the default chain is run on
+synthetic events and the ROyFitter (multi_line=True) is timed with one
+solver call per event and with batches of 100 events. For comparison,
+the same line fits are done with one solver call per line, like the
+serial loop over the lines in the icetray module. The median zenith error
+of the combined fits is compared to the one of the single line fits.
+
+Usage: python benchmarks/bench_multi_line.py [n_events]
+
+"""
+from __future__ import division, absolute_import, print_function
+import os
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+from royfit.fitting import fit_events
+from royfit.parallel import default_chain
+
+from synthetic import FakeDetector, make_multi_line_event
+
+
+def selected_blobs(n_lines, n_events):
+    """The blobs after the hit selection of the default chain"""
+    detector = FakeDetector(n_lines)
+    modules = [module_class(verbose=False, instrument=False,
+                            **dict(parameters))
+               for module_class, parameters
+               in default_chain(dump_stats=False)[:-1]]
+    blobs = []
+    for seed in range(n_events):
+        hits, track, _ = make_multi_line_event(n_lines, seed=seed)
+        blob = {'EvtRawHits': hits, 'TrackIns': [track]}
+        for module in modules:
+            module.detector = detector
+            blob = module.process(blob)
+        blobs.append(blob)
+    return detector, blobs
+
+
+def make_fitter(detector, batch_size):
+    from royfit.core import ROyFitter
+    fitter = ROyFitter(input_hits='FirstT3Hits', multi_line=True,
+                       batch_size=batch_size, dump_stats=False,
+                       verbose=False, instrument=False)
+    fitter.detector = detector
+    return fitter
+
+
+def time_fitter(detector, blobs, batch_size):
+    """Seconds for all events and the stats of the fitter"""
+    fitter = make_fitter(detector, batch_size)
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        start = timer()
+        for blob in blobs:
+            fitter.process(blob)
+        fitter.finish()
+        elapsed = timer() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return elapsed, fitter.stats
+
+
+def time_serial(detector, blobs):
+    """Seconds for one fit_events call per line and the number of lines"""
+    fitter = make_fitter(detector, len(blobs) + 1)
+    for blob in blobs:
+        fitter.process(blob)
+    lines = fitter._batch
+    start = timer()
+    for _, _, _, t, z, counts, seeds in lines:
+        fit_events([t], [z], [counts], [seeds])
+    return timer() - start, len(lines)
+
+
+def median_error(stats, combined):
+    line = np.array(stats.get('line', []))
+    error = np.abs(np.array(stats.get('angular_error', [])))
+    selected = error[(line == -1) == combined]
+    return np.median(selected) if len(selected) else float('nan')
+
+
+def main():
+    n_events = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    print("{0:>5} {1:>6} {2:>12} {3:>12} {4:>12} {5:>9} {6:>9}"
+          .format('lines', 'fits', 'serial', 'per event', 'batch 100',
+                  'err line', 'err comb'))
+    print("{0:>5} {1:>6} {2:>12} {2:>12} {2:>12} {3:>9} {3:>9}"
+          .format('', '', '[ms/event]', '[deg]'))
+    for n_lines in (1, 2, 4, 8, 16):
+        detector, blobs = selected_blobs(n_lines, n_events)
+        serial_time, n_fits = time_serial(detector, blobs)
+        event_time, _ = time_fitter(detector, blobs, 1)
+        batch_time, stats = time_fitter(detector, blobs, 100)
+        print("{0:5d} {1:6d} {2:12.2f} {3:12.2f} {4:12.2f} {5:9.1f} {6:9.1f}"
+              .format(n_lines, n_fits,
+                      serial_time / n_events * 1e3,
+                      event_time / n_events * 1e3,
+                      batch_time / n_events * 1e3,
+                      median_error(stats, False),
+                      median_error(stats, True)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# coding=utf-8
+# Filename: bench_parallel.py
+"""
+Scaling of the event parallel ROyFit chain with 1, 2, 4 and 8 workers.
+
+Each worker runs the default chain on synthetic events, the seeds of the
+noise are the event indices, so every worker count processes the same
+events and has to give the same merged stats.
+
+Usage: python benchmarks/bench_parallel.py [n_events] [n_raw_hits]
+
+"""
+from __future__ import division, absolute_import, print_function
+from collections import namedtuple
+from functools import partial
+import os
+import sys
+import time
+
+import numpy as np
+
+from royfit.parallel import default_chain, run_shards
+
+from synthetic import FakeDetector, make_raw_hits
+
+Direction = namedtuple('Direction', 'zenith')
+Track = namedtuple('Track', 'dir')
+
+
+def process_shard(shard, n_raw_hits):
+    """Run the default chain on the synthetic events of the shard"""
+    detector = FakeDetector()
+    modules = [module_class(**dict(parameters))
+               for module_class, parameters
+               in default_chain(batch_size=100, dump_stats=False)]
+    for module in modules:
+        module.detector = detector
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        for index in range(*shard):
+            blob = {'EvtRawHits': make_raw_hits(n_raw_hits, duration=3000,
+                                                seed=index),
+                    'TrackIns': [Track(Direction(np.pi / 3))]}
+            for module in modules:
+                blob = module.process(blob)
+        modules[-1].finish()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return modules[-1].stats
+
+
+def main():
+    n_events = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    n_raw_hits = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    worker = partial(process_shard, n_raw_hits=n_raw_hits)
+    print("{0} events with {1} raw hits, {2} CPUs"
+          .format(n_events, n_raw_hits, os.cpu_count()
+                  if hasattr(os, 'cpu_count') else '?'))
+    reference = None
+    for n_workers in (1, 2, 4, 8):
+        start = time.time()
+        stats = run_shards(worker, 0, n_events, n_workers)
+        elapsed = time.time() - start
+        if reference is None:
+            reference, serial_time = stats, elapsed
+        same = stats['reco_zenith'] == reference['reco_zenith']
+        print("{0} workers: {1:7.2f} s, {2:7.1f} events/s, speedup {3:4.2f}, "
+              "same stats: {4}".format(n_workers, elapsed, n_events / elapsed,
+                                       serial_time / elapsed, same))
+
+
+if __name__ == '__main__':
+    main()
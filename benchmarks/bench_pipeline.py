@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding=utf-8
+# Filename: bench_pipeline.py
+"""
+Per event timing and memory of the hit selection chain and the fit.
+
+The chain gets hit objects as input, like from the EvtPump. The memory
+includes the raw hit objects and everything the modules keep in the blob.
+Running this script on an older revision gives the numbers to compare with.
+Timings are written to stderr, since the modules print to stdout.
+
+Usage: python benchmarks/bench_pipeline.py [n_raw_hits] [n_events]
+
+"""
+from __future__ import division, absolute_import, print_function
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from royfit.core import (OMRawHitMerger, TOTFilter, FirstOMHitFilter,
+                         T3HitSelector)
+
+from synthetic import FakeDetector, make_raw_hits
+
+
+def make_chain(detector):
+    modules = [OMRawHitMerger(time_window=30),
+               TOTFilter(input_hits='MergedEvtRawHits',
+                         output_hits='LongToTHits', min_tot=45),
+               FirstOMHitFilter(input_hits='LongToTHits',
+                                output_hits='FirstOMHits'),
+               T3HitSelector(adjacent_t=200, next_to_adjacent_t=400,
+                             input_hits='FirstOMHits',
+                             candidate_hits='EvtRawHits',
+                             output_hits='T3Hits'),
+               FirstOMHitFilter(input_hits='T3Hits',
+                                output_hits='FirstT3Hits')]
+    for module in modules:
+        module.detector = detector
+    return modules
+
+
+def main():
+    n_raw_hits = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_events = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    detector = FakeDetector()
+    modules = make_chain(detector)
+
+    timings = dict((module.__class__.__name__, 0.) for module in modules)
+    blob_memory = 0
+    peak_memory = 0
+    for seed in range(n_events):
+        if tracemalloc:
+            tracemalloc.start()
+        blob = {'EvtRawHits': make_raw_hits(n_raw_hits, duration=3000,
+                                            seed=seed)}
+        for module in modules:
+            start = time.time()
+            blob = module.process(blob)
+            timings[module.__class__.__name__] += time.time() - start
+        if tracemalloc:
+            current, peak = tracemalloc.get_traced_memory()
+            blob_memory = max(blob_memory, current)
+            peak_memory = max(peak_memory, peak)
+            tracemalloc.stop()
+
+    print("Raw hits per event: {0}".format(n_raw_hits), file=sys.stderr)
+    for name, total in sorted(timings.items()):
+        print("{0:>20}: {1:9.3f} ms/event".format(name,
+                                                  total / n_events * 1e3),
+              file=sys.stderr)
+    print("{0:>20}: {1:9.3f} ms/event".format(
+        "Total", sum(timings.values()) / n_events * 1e3), file=sys.stderr)
+    if tracemalloc:
+        print("{0:>20}: {1:9.1f} kB".format("Blob memory/event",
+                                            blob_memory / 1024.),
+              file=sys.stderr)
+        print("{0:>20}: {1:9.1f} kB".format("Peak memory/event",
+                                            peak_memory / 1024.),
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding=utf-8
+# Filename: bench_pmt_hit_counts.py
+"""
+Benchmark the OM hit counting of ROyFitter for 1k, 10k and 100k raw hits.
+
+Usage: python benchmarks/bench_pmt_hit_counts.py
+
+"""
+from __future__ import division, absolute_import, print_function
+import time
+
+from royfit.core import om_sorted_times, count_hits_in_window
+from royfit.geometry import get_pmt_table
+from royfit.hits import HitSeries
+
+from synthetic import FakeDetector, make_raw_hits
+
+
+def legacy_counts(hits, raw_hits, detector, time_window=15):
+    pmt_hit_counts = []
+    for hit in hits:
+        _, om, _ = detector.pmtid2omkey(hit.pmt_id)
+        pmt_hit_count = 0
+        for raw_hit in raw_hits:
+            _, the_om, _ = detector.pmtid2omkey(raw_hit.pmt_id)
+            if the_om == om and (hit.time + time_window > raw_hit.time
+                                 >= hit.time):
+                pmt_hit_count += 1
+        pmt_hit_counts.append(pmt_hit_count)
+    return pmt_hit_counts
+
+
+def indexed_counts(hits, raw_hits, detector, time_window=15):
+    pmt_table = get_pmt_table(detector)
+    hits = HitSeries.from_hits(hits, pmt_table)
+    om_times = om_sorted_times(HitSeries.from_hits(raw_hits, pmt_table))
+    return [count_hits_in_window(om_times, om_id, time, time_window)
+            for om_id, time in zip(hits.om_id, hits.time)]
+
+
+def main():
+    detector = FakeDetector()
+    for n_raw_hits in (1000, 10000, 100000):
+        raw_hits = make_raw_hits(n_raw_hits)
+        hits = raw_hits[:18]
+        results = []
+        for func in (legacy_counts, indexed_counts):
+            start = time.time()
+            counts = func(hits, raw_hits, detector)
+            results.append((time.time() - start, counts))
+        (legacy_time, legacy), (indexed_time, indexed) = results
+        assert legacy == indexed
+        print("{0:7d} raw hits: legacy {1:9.2f} ms, indexed {2:8.2f} ms "
+              "({3:.0f}x)".format(n_raw_hits, legacy_time * 1e3,
+                                  indexed_time * 1e3,
+                                  legacy_time / indexed_time))
+
+
+if __name__ == '__main__':
+    main()
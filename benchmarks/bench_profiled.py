@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# coding=utf-8
+# Filename: bench_profiled.py
+"""
+Minuit with the full quality function versus tc (and zc) profiled out.
+
+Usage: python benchmarks/bench_profiled.py [n_events]
+
+"""
+from __future__ import division, absolute_import, print_function
+import sys
+import time
+
+import numpy as np
+import iminuit as minuit
+
+from royfit.minimiser import (QualityFunction, ProfiledQualityFunction,
+                              ZcScanQualityFunction)
+
+from bench_seeding import make_events, zenith_error
+
+
+def fit(events, profile):
+    uz, n_calls, n_valid = [], 0, 0
+    for t, z, counts, _ in events:
+        parameters = dict(uz=-0.75, zc=(min(z) + max(z)) / 2, dc=20.,
+                          tc=min(t),
+                          error_uz=0.01, error_zc=1.0, error_dc=1.0,
+                          error_tc=1.0,
+                          limit_uz=(-1.0, 1.0), limit_zc=(min(z), max(z)),
+                          limit_dc=(2., 100.))
+        if profile is None:
+            quality_function = QualityFunction(t, z, counts,
+                                               sigma_t=8, d0=50, d1=5)
+        elif profile == 'tc':
+            quality_function = ProfiledQualityFunction(t, z, counts,
+                                                       sigma_t=8, d0=50, d1=5)
+        else:
+            quality_function = ZcScanQualityFunction(t, z, counts,
+                                                     sigma_t=8, d0=50, d1=5)
+        for name in {None: (), 'tc': ('tc',), 'zc': ('tc', 'zc')}[profile]:
+            for key in (name, 'error_' + name, 'limit_' + name):
+                parameters.pop(key, None)
+        fitter = minuit.Minuit(quality_function, grad=quality_function.grad,
+                               errordef=1, print_level=0, **parameters)
+        fitter.tol = 1
+        fitter.migrad()
+        n_calls += fitter.get_fmin().nfcn
+        n_valid += fitter.get_fmin().is_valid
+        uz.append(fitter.values['uz'])
+    return np.array(uz), n_calls, n_valid
+
+
+def main():
+    n_events = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    events = make_events(n_events)
+    true_uz = np.array([event[3] for event in events])
+    for profile in (None, 'tc', 'zc'):
+        start = time.time()
+        uz, n_calls, n_valid = fit(events, profile)
+        elapsed = time.time() - start
+        error = zenith_error(uz, true_uz)
+        print("profile={0!s:4}: {1:6.1f} calls/event, {2:5.1f}% valid, "
+              "median zenith error {3:5.2f} deg, {4:7.1f} events/s"
+              .format(profile, n_calls / n_events, 100. * n_valid / n_events,
+                      np.median(error), n_events / elapsed))
+
+
+if __name__ == '__main__':
+    main()
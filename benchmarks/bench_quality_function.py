@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# coding=utf-8
+# Filename: bench_quality_function.py
+"""
+Micro-benchmark of the fused QualityFunction against the old implementation.
+
+Usage: python benchmarks/bench_quality_function.py [n_hits]
+
+"""
+from __future__ import division, absolute_import, print_function
+import sys
+import timeit
+
+import numpy as np
+
+from royfit.minimiser import QualityFunction
+
+
+def legacy_quality_function(qf, uz, zc, dc, tc):
+    """The quality function as it was computed before the fused evaluator"""
+    aip = 2.*qf.c/(qf.Cos_theta(uz, zc, dc) + 1.)
+    avg_aip = sum(aip)/len(aip)
+    D = np.sqrt(qf.d1**2 + qf.D_gamma(uz, zc, dc)**2)
+    return sum((qf.T_gamma(uz, zc, dc, tc) - qf.t)**2 / qf.sigma_t**2 +
+               aip*D/(avg_aip*qf.d0))
+
+
+def main():
+    n_hits = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    z = np.linspace(-100, 100, n_hits)
+    t = np.random.uniform(0, 500, n_hits)
+    counts = np.random.randint(1, 5, n_hits)
+    qf = QualityFunction(t, z, counts, sigma_t=8, d0=50, d1=5)
+    params = (-0.5, 5., 25., 95.)
+
+    assert np.isclose(qf(*params), legacy_quality_function(qf, *params))
+
+    number = 20000
+    legacy = min(timeit.repeat(lambda: legacy_quality_function(qf, *params),
+                               number=number, repeat=3)) / number
+    fused = min(timeit.repeat(lambda: qf(*params),
+                              number=number, repeat=3)) / number
+    print("Number of hits:  {0}".format(n_hits))
+    print("Legacy:          {0:9.3f} us/call".format(legacy * 1e6))
+    print("Fused:           {0:9.3f} us/call".format(fused * 1e6))
+    print("Speedup:         {0:9.2f}x".format(legacy / fused))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# coding=utf-8
+# Filename: bench_seeding.py
+"""
+Fixed start values versus seeds from a (uz, dc) grid scan.
+
+For Minuit and the batched Levenberg-Marquardt fit, the quality function
+calls per event and the zenith resolution are compared for the fixed seed
+(uz=-0.75, dc=20) and the best n_seeds points of an n_uz x n_dc grid.
+
+Usage: python benchmarks/bench_seeding.py [n_events] [n_uz] [n_dc] [n_seeds]
+
+"""
+from __future__ import division, absolute_import, print_function
+import sys
+import time
+
+import numpy as np
+import iminuit as minuit
+
+from royfit.minimiser import QualityFunction, BatchQualityFunction, grid_seeds
+from royfit.solvers import levenberg_marquardt
+
+
+def make_events(n_events, seed=42):
+    """Single line events from the T_gamma model, with the true uz"""
+    random = np.random.RandomState(seed)
+    events = []
+    for _ in range(n_events):
+        n_hits = random.randint(4, 19)
+        z = np.sort(random.choice(np.arange(18) * 9., n_hits, replace=False))
+        truth = (random.uniform(-0.9, 0.9), random.uniform(20, 130),
+                 random.uniform(5, 60), random.uniform(0, 100))
+        string = QualityFunction(np.zeros(n_hits), z, np.ones(n_hits))
+        t = string.T_gamma(*truth) + random.normal(0, 3, n_hits)
+        events.append((t, z, random.randint(1, 4, n_hits), truth[0]))
+    return events
+
+
+def seeds(events, grid):
+    """The start values for each event, fixed ones if grid is None"""
+    all_seeds = []
+    for t, z, counts, _ in events:
+        zc = (min(z) + max(z)) / 2
+        if grid is None:
+            all_seeds.append([(-0.75, zc, 20., min(t))])
+            continue
+        n_uz, n_dc, n_seeds = grid
+        quality_function = QualityFunction(t, z, counts,
+                                           sigma_t=8, d0=50, d1=5)
+        all_seeds.append(grid_seeds(quality_function, zc,
+                                    np.linspace(-0.95, 0.95, n_uz),
+                                    np.linspace(5., 95., n_dc), n_seeds))
+    return all_seeds
+
+
+def fit_minuit(events, all_seeds):
+    """Returns the best uz of each event and the number of calls"""
+    uz, n_calls = [], 0
+    for (t, z, counts, _), event_seeds in zip(events, all_seeds):
+        quality_function = QualityFunction(t, z, counts,
+                                           sigma_t=8, d0=50, d1=5)
+        best = None
+        for uz_ini, zc_ini, dc_ini, tc_ini in event_seeds:
+            fitter = minuit.Minuit(quality_function,
+                                   grad=quality_function.grad,
+                                   zc=zc_ini, tc=tc_ini,
+                                   dc=dc_ini, uz=uz_ini,
+                                   error_dc=1.0, error_uz=0.01,
+                                   error_tc=1.0, error_zc=1.0,
+                                   limit_zc=(min(z), max(z)),
+                                   limit_uz=(-1.0, 1.0),
+                                   limit_dc=(2., 100.),
+                                   errordef=1, print_level=0)
+            fitter.tol = 1
+            fitter.migrad()
+            n_calls += fitter.get_fmin().nfcn
+            if best is None or fitter.fval < best[1]:
+                best = (fitter.values['uz'], fitter.fval)
+        uz.append(best[0])
+    return np.array(uz), n_calls
+
+
+def fit_batch(events, all_seeds):
+    """Returns the best uz of each event and the number of calls"""
+    owner = np.repeat(np.arange(len(events)),
+                      [len(event_seeds) for event_seeds in all_seeds])
+    t, z, counts, _ = zip(*[events[i] for i in owner])
+    quality_function = BatchQualityFunction(t, z, counts,
+                                            sigma_t=8, d0=50, d1=5)
+    n_fits = len(owner)
+    p0 = np.array([seed for event_seeds in all_seeds
+                   for seed in event_seeds], dtype=float)
+    lower = np.column_stack((np.full(n_fits, -1.), [min(h) for h in z],
+                             np.full(n_fits, 2.), np.full(n_fits, -np.inf)))
+    upper = np.column_stack((np.full(n_fits, 1.), [max(h) for h in z],
+                             np.full(n_fits, 100.), np.full(n_fits, np.inf)))
+    result = levenberg_marquardt(quality_function.residuals_and_jacobian,
+                                 p0, lower, upper, tol=1)
+    order = np.lexsort((result.cost, owner))
+    _, first = np.unique(owner[order], return_index=True)
+    return result.params[order[first], 0], np.sum(result.n_calls)
+
+
+def zenith_error(uz, true_uz):
+    return np.degrees(np.abs(np.arccos(uz) - np.arccos(true_uz)))
+
+
+def main():
+    n_events = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    grid = tuple(int(arg) for arg in sys.argv[2:5]) or (9, 4, 1)
+    events = make_events(n_events)
+    true_uz = np.array([event[3] for event in events])
+    print("{0} events, grid n_uz x n_dc = {1} x {2}, {3} seeds"
+          .format(n_events, *grid))
+    for solver, fit in (('Minuit', fit_minuit), ('LM', fit_batch)):
+        for name, seed_grid in (('fixed seed', None), ('grid seeds', grid)):
+            start = time.time()
+            uz, n_calls = fit(events, seeds(events, seed_grid))
+            elapsed = time.time() - start
+            error = zenith_error(uz, true_uz)
+            print("{0:>6} {1:>10}: {2:6.1f} calls/event, "
+                  "median zenith error {3:5.2f} deg, "
+                  "{4:5.1f}% above 10 deg, {5:7.1f} events/s"
+                  .format(solver, name, n_calls / n_events, np.median(error),
+                          100. * np.mean(error > 10), n_events / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# coding=utf-8
+# Filename: suite.py
+"""
+Timing of the QualityFunction and every royfit.core module on synthetic
+single line events, separately and end to end.
+
+The results are written as JSON and can be compared to a stored baseline,
+timings which are slower than tolerance * baseline are reported as
+regressions and make the script exit with 1.
+
+Usage: python benchmarks/suite.py [--events N] [--noise-rate HZ]
+                                  [--repeat N] [--output FILE]
+                                  [--baseline FILE] [--tolerance FACTOR]
+
+ZTPlotter is not timed, since it opens a plot window for every event.
+
+"""
+from __future__ import division, absolute_import, print_function
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from timeit import default_timer as timer
+
+import numpy as np
+
+from royfit.minimiser import QualityFunction
+from royfit.parallel import default_chain
+
+from synthetic import FakeDetector, make_event
+
+
+def time_quality_function(hits, number=2000):
+    """us per call of the quality function and its gradient"""
+    t, z = hits.time, hits.z
+    quality_function = QualityFunction(t, z, np.ones(len(t)),
+                                       sigma_t=8, d0=50, d1=5)
+    params = (-0.5, np.mean(z), 25., np.min(t))
+    results = {}
+    for name, function in (('QualityFunction.__call__', quality_function),
+                           ('QualityFunction.grad', quality_function.grad)):
+        start = timer()
+        for _ in range(number):
+            function(*params)
+        results[name] = {'value': (timer() - start) / number * 1e6,
+                         'unit': 'us/call'}
+    return results
+
+
+def time_modules(modules, blobs, labels):
+    """ms per event of each module, the blobs are processed in place"""
+    timings = np.zeros(len(modules))
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        for blob in blobs:
+            for i, module in enumerate(modules):
+                start = timer()
+                module.process(blob)
+                timings[i] += timer() - start
+        for i, module in enumerate(modules):
+            if hasattr(module, 'finish'):
+                start = timer()
+                module.finish()
+                timings[i] += timer() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    timings *= 1e3 / len(blobs)
+    return dict((label, {'value': value, 'unit': 'ms/event'})
+                for label, value in zip(labels, timings))
+
+
+def make_modules(detector, **fit_parameters):
+    modules = [module_class(**dict(parameters))
+               for module_class, parameters
+               in default_chain(dump_stats=False, **fit_parameters)]
+    for module in modules:
+        module.detector = detector
+    return modules
+
+
+def run(args):
+    """Time everything args.repeat times and keep the fastest run"""
+    detector = FakeDetector()
+    events = [make_event(noise_rate=args.noise_rate, seed=seed)
+              for seed in range(args.events)]
+    results = {}
+    for _ in range(args.repeat):
+        for name, result in time_all(events, detector).items():
+            if name not in results or result['value'] < results[name]['value']:
+                results[name] = result
+    return {'meta': {'events': args.events,
+                     'noise_rate': args.noise_rate,
+                     'repeat': args.repeat,
+                     'python': platform.python_version(),
+                     'numpy': np.__version__,
+                     'machine': platform.machine(),
+                     'date': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': results}
+
+
+def time_all(events, detector):
+    blobs = [{'EvtRawHits': hits, 'TrackIns': [track]}
+             for hits, track, _ in events]
+
+    # the hit selection modules are the same for all fitters
+    modules = make_modules(detector)[:-1]
+    labels = ["{0}[{1}]".format(module.__class__.__name__, i)
+              for i, module in enumerate(modules)]
+    results = time_modules(modules, blobs, labels)
+    selection_time = sum(result['value'] for result in results.values())
+
+    results.update(time_quality_function(blobs[0]['FirstT3Hits']))
+    for solver, parameters in (('minuit', {}),
+                               ('lm', {'solver': 'lm', 'batch_size': 100})):
+        name = 'ROyFitter({0})'.format(solver)
+        fitter = make_modules(detector, **parameters)[-1]
+        results.update(time_modules([fitter], blobs, [name]))
+        results['End to end ({0})'.format(solver)] = {
+            'value': selection_time + results[name]['value'],
+            'unit': 'ms/event'}
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the ratios to the baseline, return the names of regressions"""
+    regressions = []
+    for name in sorted(results):
+        value = results[name]['value']
+        reference = baseline.get(name, {}).get('value')
+        if reference is None:
+            print("{0:>40}: {1:10.3f} {2:<9} (new)"
+                  .format(name, value, results[name]['unit']))
+            continue
+        ratio = value / reference
+        flag = ''
+        if ratio > tolerance:
+            regressions.append(name)
+            flag = '  <-- regression'
+        print("{0:>40}: {1:10.3f} {2:<9} {3:6.2f}x baseline{4}"
+              .format(name, value, results[name]['unit'], ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--noise-rate', type=float, default=10e3,
+                        help="K40 rate per PMT in Hz")
+    parser.add_argument('--output', help="write the results to this file")
+    parser.add_argument('--baseline', help="compare with this result file")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=1.2)
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    regressions = compare(report['results'], baseline, args.tolerance)
+    if regressions:
+        print("{0} regressions".format(len(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+# coding=utf-8
+# Filename: synthetic.py
+"""
+Fake detector and hits for the benchmarks, no data files needed.
+
+"""
+from __future__ import division, absolute_import, print_function
+from collections import namedtuple
+
+import numpy as np
+
+PMT = namedtuple('PMT', 'id pos')
+Position = namedtuple('Position', 'x y z')
+
+OMS_PER_LINE = 18
+PMTS_PER_OM = 31
+OM_SPACING = 9.
+
+
+class Hit(object):
+    """A hit object like the ones from the EvtPump"""
+    def __init__(self, id, pmt_id, time, tot):
+        self.id = id
+        self.pmt_id = pmt_id
+        self.time = time
+        self.tot = tot
+
+    def __add__(self, other):
+        return Hit(self.id, self.pmt_id, self.time, self.tot + other.tot)
+
+
+class FakeDetector(object):
+    """A detector with 18 OMs per line and 31 PMTs per OM"""
+    def __init__(self, n_lines=1):
+        self.n_lines = n_lines
+        n_pmts = n_lines * OMS_PER_LINE * PMTS_PER_OM
+        self.pmts = [PMT(pmt_id, Position(0, 0, self.om_z(pmt_id)))
+                     for pmt_id in range(1, n_pmts + 1)]
+
+    def pmtid2omkey(self, pmt_id):
+        pmt_id -= 1
+        return (pmt_id // (OMS_PER_LINE * PMTS_PER_OM) + 1,
+                OMS_PER_LINE - pmt_id // PMTS_PER_OM % OMS_PER_LINE,
+                PMTS_PER_OM - pmt_id % PMTS_PER_OM)
+
+    def om_z(self, pmt_id):
+        return OM_SPACING * self.pmtid2omkey(pmt_id)[1]
+
+
+def make_raw_hits(n_hits, n_lines=1, duration=100000, seed=1):
+    """Uniformly distributed noise hits"""
+    random = np.random.RandomState(seed)
+    pmt_ids = random.randint(1, n_lines * OMS_PER_LINE * PMTS_PER_OM + 1,
+                             n_hits)
+    times = np.round(random.uniform(0, duration, n_hits))
+    tots = random.randint(1, 60, n_hits)
+    return [Hit(i, int(pmt_id), float(t), float(tot)) for i, (pmt_id, t, tot)
+            in enumerate(zip(pmt_ids, times, tots))]
+
+
+Direction = namedtuple('Direction', 'zenith')
+Track = namedtuple('Track', 'dir')
+
+
+def make_muon_hits(uz, zc, dc, tc, line=1, photons=30., attenuation=30.,
+                   sigma_t=3., random=None):
+    """Cherenkov hits on the OMs of a line, following the T_gamma hyperbola.
+
+    The expected number of hits on an OM drops exponentially with the
+    photon path D_gamma, the hit times are smeared with a Gaussian and a
+    (scattering) exponential delay.
+
+    """
+    from royfit.minimiser import SingleStringParameters
+
+    random = random or np.random.RandomState()
+    oms = np.arange(1, OMS_PER_LINE + 1)
+    z = OM_SPACING * oms
+    string = SingleStringParameters(np.zeros(len(z)), z, np.ones(len(z)))
+    n_hits = random.poisson(photons * np.exp(-string.D_gamma(uz, zc, dc)
+                                             / attenuation))
+    om_of_hit = np.repeat(oms, n_hits)
+    times = np.repeat(string.T_gamma(uz, zc, dc, tc), n_hits)
+    times += random.normal(0, sigma_t, len(times)) \
+        + random.exponential(sigma_t, len(times))
+    pmt_ids = pmt_id(line, om_of_hit, random.randint(1, PMTS_PER_OM + 1,
+                                                     len(times)))
+    tots = random.randint(20, 100, len(times))
+    return pmt_ids, np.round(times), tots
+
+
+def make_noise_hits(rate, coincidence_rate, duration, n_lines=1,
+                    random=None):
+    """K40 noise with rate [Hz] per PMT and coincidence_rate [Hz] per OM.
+
+    A coincidence puts two hits within a few ns on different PMTs of the
+    same OM.
+
+    """
+    random = random or np.random.RandomState()
+    n_pmts = n_lines * OMS_PER_LINE * PMTS_PER_OM
+    n_single = random.poisson(rate * n_pmts * duration * 1e-9)
+    pmt_ids = random.randint(1, n_pmts + 1, n_single)
+    times = random.uniform(0, duration, n_single)
+
+    n_oms = n_lines * OMS_PER_LINE
+    n_double = random.poisson(coincidence_rate * n_oms * duration * 1e-9)
+    om_index = random.randint(0, n_oms, n_double)
+    first_pmt = random.randint(0, PMTS_PER_OM, n_double)
+    second_pmt = (first_pmt + random.randint(1, PMTS_PER_OM, n_double)) \
+        % PMTS_PER_OM
+    double_times = random.uniform(0, duration, n_double)
+    pmt_ids = np.concatenate((pmt_ids,
+                              om_index * PMTS_PER_OM + first_pmt + 1,
+                              om_index * PMTS_PER_OM + second_pmt + 1))
+    times = np.concatenate((times, double_times,
+                            double_times + random.normal(0, 3, n_double)))
+    tots = np.clip(random.normal(25, 8, len(times)), 1, None).round()
+    return pmt_ids, np.round(times), tots
+
+
+def make_event(noise_rate=10e3, coincidence_rate=500., duration=3000.,
+               seed=1):
+    """A single line muon event with K40 noise.
+
+    Returns the hits (sorted by time, like from the EvtPump), the MC track
+    for the ROyFitter and the true (uz, zc, dc, tc). The zenith follows
+    the convention of the ROyFitter, uz = -cos(zenith).
+
+    """
+    random = np.random.RandomState(seed)
+    zenith = np.arccos(random.uniform(-0.9, 0.9))
+    truth = (-np.cos(zenith),
+             random.uniform(20, OM_SPACING * OMS_PER_LINE - 20),
+             random.uniform(5, 60),
+             random.uniform(0.3, 0.7) * duration)
+    muon = make_muon_hits(*truth, random=random)
+    noise = make_noise_hits(noise_rate, coincidence_rate, duration,
+                            random=random)
+    pmt_ids, times, tots = [np.concatenate(values)
+                            for values in zip(muon, noise)]
+    order = np.argsort(times, kind='mergesort')
+    hits = [Hit(i, int(pmt_id), float(t), float(tot))
+            for i, (pmt_id, t, tot) in enumerate(zip(pmt_ids[order],
+                                                     times[order],
+                                                     tots[order]))]
+    return hits, Track(Direction(zenith)), truth
+
+
+def make_multi_line_event(n_lines, noise_rate=10e3, coincidence_rate=500.,
+                          duration=3000., seed=1):
+    """A muon event with the same uz on every line of the FakeDetector.
+
+    The lines have no horizontal positions, so (zc, dc, tc) are drawn
+    independently for each line, dc up to 100 m, so that not every line
+    sees enough light. Returns the hits, the MC track and the true
+    (uz, zc, dc, tc) of each line.
+
+    """
+    random = np.random.RandomState(seed)
+    zenith = np.arccos(random.uniform(-0.9, 0.9))
+    truths = [(-np.cos(zenith),
+               random.uniform(20, OM_SPACING * OMS_PER_LINE - 20),
+               random.uniform(5, 100),
+               random.uniform(0.3, 0.7) * duration)
+              for _ in range(n_lines)]
+    parts = [make_muon_hits(*truth, line=line, random=random)
+             for line, truth in enumerate(truths, 1)]
+    parts.append(make_noise_hits(noise_rate, coincidence_rate, duration,
+                                 n_lines=n_lines, random=random))
+    pmt_ids, times, tots = [np.concatenate(values) for values in zip(*parts)]
+    order = np.argsort(times, kind='mergesort')
+    hits = [Hit(i, int(pmt_id), float(t), float(tot))
+            for i, (pmt_id, t, tot) in enumerate(zip(pmt_ids[order],
+                                                     times[order],
+                                                     tots[order]))]
+    return hits, Track(Direction(zenith)), truths
+
+
+def pmt_id(line, om, pmt):
+    """The inverse of FakeDetector.pmtid2omkey"""
+    return (line - 1) * OMS_PER_LINE * PMTS_PER_OM \
+        + (OMS_PER_LINE - om) * PMTS_PER_OM + PMTS_PER_OM - pmt + 1
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+"""
+Fit the events of examples/run_royfit.py with one process per CPU.
+
+Usage: run_royfit_parallel.py [n_workers]
+
+"""
+import os
+import sys
+
+from royfit.parallel import default_chain, run_royfit
+
+DATA_PATH='/Users/tamasgal/Data/KM3NeT'
+EVT_FILE='single_line_prod/jte/km3net_jul13_90m_muatm10T'
+GEO_FILE='Detector/km3net_single_line.detx'
+
+
+def main():
+    n_workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    chain = default_chain(output_track='ROyMuonTrack',
+                          sigma_t=8,
+                          d0=50,
+                          d1=0.15)
+    stats = run_royfit({'basename': os.path.join(DATA_PATH, EVT_FILE)},
+                       os.path.join(DATA_PATH, GEO_FILE),
+                       index_start=1, index_stop=100,
+                       n_workers=n_workers,
+                       chain=chain,
+                       stats_file='royfit_stats.pickle')
+    print("Processed {0} events".format(stats['number_of_events']))
+
+
+if __name__ == '__main__':
+    main()
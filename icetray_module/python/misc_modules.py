@@ -4,27 +4,35 @@
 Some SeaTray modules to visualise data and other stuff.
 
 """
+from __future__ import absolute_import
+
 __author__ = "Tamas Gal"
 __maintainer__ = "Tamas Gal"
 __email__ = "tamas.gal@physik.uni-erlangen.de"
-__all__ = ('ROyMonitor', 'ZTPlot', 'PrintFrameIndex', 'PrintLineHits',
-           'Sleeper')
-
-import datetime as dt
-import socket
-import json
+__all__ = ('ROyMonitor', 'ZTPlot', 'FrameProfiler', 'ProfilerMark',
+           'PrintFrameIndex', 'PrintLineHits', 'Sleeper')
 
 from time import sleep
 
 from icecube import icetray, dataclasses
 
-import royfit
-
 from i3kit.geometry import Detector
+from i3kit.mctools import icy_muon_from_tree
 from i3kit.utilities import PulseAssistant
+from royfit.geometry import geometry_cache, omgeo_key
+from royfit.instrumentation import frame_profile
+from royfit.monitoring import DatagramSender
 
 class ROyMonitor(icetray.I3Module):
-    """Find and send any ROy parameters to ROyWeb via UDP."""
+    """Find and send any ROy parameters to ROyWeb via UDP.
+
+    The parameters of a frame are sent together in one datagram (as JSON
+    list) by a background thread, see royfit.monitoring.DatagramSender.
+    With batch_interval > 0, the parameters of all frames within that
+    time are combined. If the sender cannot keep up, the parameters are
+    dropped instead of blocking the tray.
+
+    """
 
     def __init__(self, context): # pylint: disable=E1002
         super(self.__class__, self).__init__(context)
@@ -34,33 +42,47 @@ class ROyMonitor(icetray.I3Module):
         self.AddParameter("port",
                           "UDP Port of the ROyWeb server",
                           9999)
+        self.AddParameter("batch_interval",
+                          "Seconds to collect parameters for one datagram",
+                          0)
+        self.AddParameter("max_queue",
+                          "Maximum number of frames waiting to be sent",
+                          1000)
         self.AddOutBox("OutBox")
+        self.sender = None
 
     def Configure(self): # pylint: disable=C0103,C0111
         self.ip = self.GetParameter("ip")
         self.port = self.GetParameter("port")
         self.event_number = 0
+        self.sender = DatagramSender((self.ip, self.port),
+                                     self.GetParameter("max_queue"),
+                                     self.GetParameter("batch_interval"))
 
     def Physics(self, frame): # pylint: disable=C0103,C0111
         self.event_number += 1
 
-        for frame_key in frame.keys():
-            if frame_key.startswith("ROy"):
-                self.send_parameter(frame, frame_key)
+        messages = [self.parameter_message(frame, frame_key)
+                    for frame_key in frame.keys()
+                    if frame_key.startswith("ROy")]
+        if messages:
+            self.sender.send(messages)
         self.PushFrame(frame)
 
-    def send_parameter(self, frame, frame_key):
-        parameter_name = frame_key[3:]
-        print("Sending: {0}".format(frame_key))
-        message = json.dumps(
-            {'kind': 'parameter',
-             'type': parameter_name,
-             'description': '',
-             'value': frame[frame_key].value,
-             'time': '',
-             'event_number': self.event_number})
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.sendto(message, (self.ip, self.port))
+    def parameter_message(self, frame, frame_key):
+        return {'kind': 'parameter',
+                'type': frame_key[3:],
+                'description': '',
+                'value': frame[frame_key].value,
+                'time': '',
+                'event_number': self.event_number}
+
+    def Finish(self): # pylint: disable=C0103,C0111
+        self.sender.close()
+        print("ROyMonitor: sent {0} parameters in {1} datagrams, "
+              "{2} dropped, {3} failed"
+              .format(self.sender.sent, self.sender.datagrams,
+                      self.sender.dropped, self.sender.errors))
 
 
 class ConePlot(icetray.I3Module):
@@ -79,7 +101,8 @@ class ConePlot(icetray.I3Module):
 
     def Geometry(self, frame): # pylint: disable=C0103,C0111
         geometry = frame['I3Geometry']
-        self.detector = Detector(geometry)
+        self.detector = geometry_cache(geometry, omgeo_key(geometry)).get(
+            'detector', Detector)
         self.PushFrame(frame)
 
     def Physics(self, frame): # pylint: disable=C0103,C0111
@@ -110,7 +133,7 @@ class ConePlot(icetray.I3Module):
         ax.plot_wireframe([0, summed_x], [0, summed_y], [0, summed_z], color='red')
 
         mctree = frame["AntMCTree"]
-        muon = royfit.icy_muon_from_tree(mctree)
+        muon = icy_muon_from_tree(mctree)
         muon_dir = muon.GetDir()
         x = muon_dir.GetX()
         y = muon_dir.GetY()
@@ -140,7 +163,8 @@ class ZTPlot(icetray.I3Module):
 
     def Geometry(self, frame): # pylint: disable=C0103,C0111
         geometry = frame['I3Geometry']
-        self.detector = Detector(geometry)
+        self.detector = geometry_cache(geometry, omgeo_key(geometry)).get(
+            'detector', Detector)
         self.PushFrame(frame)
 
     def scatter(self, pulse_info):
@@ -210,42 +234,74 @@ class ZTPlot(icetray.I3Module):
 
 
 
-class PrintFrameIndex(icetray.I3Module):
-    """Print frame index and time needed to process an event."""
+class FrameProfiler(icetray.I3Module):
+    """Profile the latency of the frames by frame type (P, Q, G, D, C).
+
+    Put it at the top of the tray and a ProfilerMark with last=True at the
+    end, where the frame ends. Without it (or for frames which are dropped
+    before it), a frame ends when the next frame arrives here, so its
+    latency also includes the upstream time (reader, filters) of the next
+    frame. Add a ProfilerMark after each module whose time should be
+    reported separately. Nothing is printed per frame, the summary
+    (p50/p95/p99) is printed in Finish.
+
+    """
 
     def __init__(self, context): # pylint: disable=E1002
         super(self.__class__, self).__init__(context)
         self.AddOutBox("OutBox")
-        self.timestamp = dt.datetime.now()
-        self.frame_index = 1
+        self.AddParameter("profile",
+                          "The name of the profile, shared with the marks",
+                          "tray")
+        self.profile = None
 
     def Configure(self): # pylint: disable=C0103,C0111
-        pass
+        self.profile = frame_profile(self.GetParameter("profile"))
 
     def Process(self): # pylint: disable=C0103,C0111
-        new_timestamp = dt.datetime.now()
-        delta_t = (new_timestamp - self.timestamp).microseconds / 1e3
-        print ("-- Frame:%7u ------ %9.3f ms ----------" %
-               (self.frame_index, delta_t))
-        self.timestamp = new_timestamp
-
         frame = self.PopFrame()
+        self.profile.start(frame.Stop.id)
+        self.PushFrame(frame)
 
-        tag = frame.Stop.id
-        if tag is "I":
-            self.PushFrame(frame)
-        elif tag is 'D':
-            self.DetectorStatus(frame)
-        elif tag is 'G':
-            self.Geometry(frame)
-        elif tag is 'C':
-            self.Calibration(frame)
-        elif tag in 'PQ':
-            self.PushFrame(frame)
-        else:
-            self.PushFrame(frame)
+    def Finish(self): # pylint: disable=C0103,C0111
+        self.profile.stop()
+        print self.profile.summary()
+
+
+PrintFrameIndex = FrameProfiler  # the former name
 
-        self.frame_index += 1
+
+class ProfilerMark(icetray.I3Module):
+    """Attribute the time since the previous mark to the stage.
+
+    With last=True the frame ends here, the stage is optional then.
+
+    """
+
+    def __init__(self, context): # pylint: disable=E1002
+        super(self.__class__, self).__init__(context)
+        self.AddOutBox("OutBox")
+        self.AddParameter("profile", "The name of the profile", "tray")
+        self.AddParameter("stage", "The name of the module(s) before", None)
+        self.AddParameter("last", "End the frame at this mark", False)
+        self.profile = None
+        self.stage = None
+        self.last = False
+
+    def Configure(self): # pylint: disable=C0103,C0111
+        self.profile = frame_profile(self.GetParameter("profile"))
+        self.stage = self.GetParameter("stage")
+        self.last = bool(self.GetParameter("last"))
+        if self.stage is None and not self.last:
+            raise ValueError("ProfilerMark needs a stage name.")
+
+    def Process(self): # pylint: disable=C0103,C0111
+        frame = self.PopFrame()
+        if self.stage is None:
+            self.profile.stop()
+        else:
+            self.profile.mark(self.stage, self.last)
+        self.PushFrame(frame)
 
 
 class PrintLineHits(icetray.I3Module):
@@ -262,7 +318,8 @@ class PrintLineHits(icetray.I3Module):
 
     def Geometry(self, frame): # pylint: disable=C0103,C0111
         geometry = frame['I3Geometry']
-        self.detector = Detector(geometry)
+        self.detector = geometry_cache(geometry, omgeo_key(geometry)).get(
+            'detector', Detector)
         print self.detector
         self.PushFrame(frame)
 
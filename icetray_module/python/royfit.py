@@ -1,6 +1,7 @@
 # coding=utf-8
 # Filename: royfit.py
 """Main data structures and classes for the ROyFit module."""
+from __future__ import absolute_import
 
 __author__ = "Tamas Gal"
 __maintainer__ = "Tamas Gal"
@@ -13,10 +14,24 @@ from icecube import icetray, dataclasses
 from i3kit.utilities import PulseAssistant
 from i3kit.geometry import Detector
 from i3kit.mctools import icy_muon_from_tree
+from royfit.fitting import fit_lines
+from royfit.geometry import geometry_cache, omgeo_key
+from royfit.results import ZenithResolution
 
 class ROyFitter(icetray.I3Module):
 
-    """The main fitter."""
+    """The main fitter.
+
+    The merged pulses are put into arrays and the first pulse on each DOM
+    is selected. All lines with more than four of them are fitted at once
+    with the batched Levenberg-Marquardt solver of royfit.fitting, using
+    only the time residuals.
+
+    The MC and reco zeniths of the line fits are filled into fixed-bin
+    histograms (see royfit.results.ZenithResolution), which are written to
+    resolution_file at the end if given.
+
+    """
 
     def __init__(self, context): # pylint: disable=E1002
         super(self.__class__, self).__init__(context)
@@ -24,17 +39,33 @@ class ROyFitter(icetray.I3Module):
         self.AddParameter("pulse_map_name",
                           "The pulses map",
                           'MultiOMRecoPulseSeries')
+        self.AddParameter("resolution_file",
+                          "The .npz file for the zenith histograms",
+                          None)
         self.detector = None
         self.pulse_map_name = None
+        self.resolution_file = None
+        self.resolution = None
+        self.z_coordinates = None
 
     def Geometry(self, frame): # pylint: disable=C0103,C0111
         geometry = frame['I3Geometry']
-        self.detector = Detector(geometry)
+        cache = geometry_cache(geometry, omgeo_key(geometry))
+        self.detector = cache.get('detector', Detector)
+        self.z_coordinates = cache.get('pmt_z', lambda geometry: {})
         self.PushFrame(frame)
 
+    def pmt_z(self, omkeys):
+        """The z-coordinates of the PMTs, looked up once per geometry"""
+        z_coordinates = self.z_coordinates
+        for omkey in set(omkeys).difference(z_coordinates):
+            z_coordinates[omkey] = self.detector.pmt_pos(omkey).Z
+        return np.array([z_coordinates[omkey] for omkey in omkeys])
+
     def Configure(self): # pylint: disable=C0103,C0111
         self.pulse_map_name = self.GetParameter("pulse_map_name")
-        self.zeniths = []
+        self.resolution_file = self.GetParameter("resolution_file")
+        self.resolution = ZenithResolution()
 
     def Physics(self, frame): # pylint: disable=C0103,C0111
         pulse_map = frame[self.pulse_map_name]
@@ -55,82 +86,46 @@ class ROyFitter(icetray.I3Module):
         print(69*"#")
         print("Let's try to fit!")
 
-        from minimiser import QualityFunction
-        import minuit
-
-        for line in self.detector.lines:
-            pulses = pulse_assistant.get_merged_pulses_for_line(line)
-
-            used_doms = []
-            selected_pulses = []
-            for omkey, pulse in pulses:
-                if omkey[1] not in used_doms:
-                    used_doms.append(omkey[1])
-                    selected_pulses.append((omkey, pulse))
-
-            if len(selected_pulses) > 4:
-                print "Trying to perform single track fit on line:", line
-
-                pulse_times = [p.GetTime() for _, p in selected_pulses]
-                #print "Pulse times:", pulse_times
-                z_coordinates = [self.detector.pmt_pos(omkey).Z for omkey, _ in selected_pulses]
-                #print "z-coordinates:", z_coordinates
-
-
-                zc_ini = z_coordinates[0]
-                tc_ini = pulse_times[0]
-                dc_ini = 20.
-
-                dc_lowlimit = 2.
-                dc_highlimit = 80.
-
-                quality_function = QualityFunction(pulse_times, z_coordinates)
-                fitter = minuit.Minuit(quality_function, zc=zc_ini, tc=tc_ini, dc=dc_ini)
-
-                fitter.limits["uz"] = (-0.999,0.999)
-                fitter.limits["dc"] = (dc_lowlimit,dc_highlimit)
-
-                fitter.errors["uz"] = 0.01#0.02
-                fitter.errors["zc"] = 1#0.5
-                fitter.errors["dc"] = 1#0.5
-                fitter.errors["tc"] = 3.#5.
-
-                fitter.tol = 1
-                fitter.up = 1
-                fitter.maxcalls = 500
-
-                #fitter.printMode = 1
-                try:
-                    fitter.migrad()
-                except minuit.MinuitError:
-                    print("Fitting error!!!")
-                else:
-                    print fitter.values
-                    print fitter.errors
-                    reco_zenith = 180 - (np.arccos(fitter.values["uz"]) / icetray.I3Units.deg)
-                    print "Reconstructed zenith:", reco_zenith
-                    self.zeniths.append((zenith, reco_zenith))
+        omkeys = [omkey for omkey, _ in merged_pulses]
+        lines = np.array([omkey[0] for omkey in omkeys], dtype=int)
+        oms = np.array([omkey[1] for omkey in omkeys], dtype=int)
+        pulse_times = np.array([pulse.GetTime() for _, pulse in merged_pulses])
+        z_coordinates = self.pmt_z(omkeys)
+
+        fitted_lines, result = fit_lines(lines, oms, pulse_times,
+                                         z_coordinates,
+                                         min_hits=5,
+                                         sigma_t=1,
+                                         dc_limits=(2., 80.),
+                                         amplitude=False)
+        for i, line in enumerate(fitted_lines):
+            print "Single track fit on line:", line
+            if not result.converged[i]:
+                print("Fitting error!!!")
+                continue
+            print dict(zip(('uz', 'zc', 'dc', 'tc'), result.params[i]))
+            print dict(zip(('uz', 'zc', 'dc', 'tc'), result.errors[i]))
+            reco_zenith = 180 - (np.arccos(result.params[i, 0]) / icetray.I3Units.deg)
+            print "Reconstructed zenith:", reco_zenith
+            self.resolution.fill(zenith, reco_zenith)
 
         self.PushFrame(frame)
 
-    def Finish(self):
-
-        import numpy as np
-        import matplotlib as mpl
+    def Finish(self): # pylint: disable=C0103,C0111
         import matplotlib.pyplot as plt
 
-        x = [item[0] for item in self.zeniths]
-        y = [item[1] for item in self.zeniths]
-        H, xedges, yedges = np.histogram2d(y, x, bins=90)
-        fig = plt.figure(figsize=(7, 7))
-        ax = fig.add_subplot(111)
-        im = plt.imshow(H, interpolation=None, origin='low',
-                        extent=[xedges[0], xedges[-1], yedges[0], yedges[-1]])
+        resolution = self.resolution
+        print "Zenith histograms filled with", len(resolution), "fits"
+        if self.resolution_file:
+            resolution.save(self.resolution_file)
+        bins = resolution.zenith_bins
+        plt.figure(figsize=(7, 7))
+        plt.imshow(resolution.counts.T, interpolation=None, origin='lower',
+                   extent=[bins[0], bins[-1], bins[0], bins[-1]])
         plt.xlabel("MC zenith [deg]")
         plt.ylabel("reco zenith [deg]")
         plt.show()
 
 
-
 if __name__ == '__main__':
     pass
@@ -37,8 +37,8 @@ def main():
     tray.AddModule(NeutrinoEnergyFilter, "energyfilter",
                    MinEnergy=3000, MaxEnergy=1000000)
 
-    from royfit.misc_modules import PrintFrameIndex
-    tray.AddModule(PrintFrameIndex, "PrintFrameIndex")
+    from royfit.misc_modules import FrameProfiler, ProfilerMark
+    tray.AddModule(FrameProfiler, "FrameProfiler")
 
 
 
@@ -47,9 +47,12 @@ def main():
 
     from royfit.misc_modules import ZTPlot
     tray.AddModule(ZTPlot, "ZTPlot")
+    tray.AddModule(ProfilerMark, "ZTPlotMark", stage="ZTPlot")
 
     from royfit.royfit import ROyFitter
     tray.AddModule(ROyFitter, "ROyFitter")
+    tray.AddModule(ProfilerMark, "ROyFitterMark", stage="ROyFitter",
+                   last=True)
 
     #from royfit.misc_modules import ROyMonitor
     #tray.AddModule(ROyMonitor, "ROyMonitor")
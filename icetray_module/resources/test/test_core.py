@@ -0,0 +1,126 @@
+# coding=utf-8
+# Filename: test_core.py
+"""
+Description.
+
+"""
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+import json
+import socket
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+from royfit.minimiser import SingleStringParameters
+
+try:
+    from royfit import core
+except ImportError as e:  # km3pipe is missing or incompatible
+    pytest.skip(str(e), allow_module_level=True)
+
+Position = namedtuple('Position', 'x y z')
+PMT = namedtuple('PMT', 'id pos')
+Hit = namedtuple('Hit', 'id pmt_id time tot')
+Direction = namedtuple('Direction', 'zenith')
+Track = namedtuple('Track', 'dir')
+
+N_LINES = 3
+N_OMS = 10
+
+
+class FakeDetector(object):
+    """N_LINES lines with N_OMS OMs and one PMT each, 15 m apart"""
+    def __init__(self):
+        self.pmts = []
+        for pmt_id in range(1, N_LINES * N_OMS + 1):
+            line, om, _ = self.pmtid2omkey(pmt_id)
+            self.pmts.append(PMT(pmt_id, Position(20. * line, 0., 15. * om)))
+
+    def pmtid2omkey(self, pmt_id):
+        return ((pmt_id - 1) // N_OMS + 1, (pmt_id - 1) % N_OMS + 1, 1)
+
+
+def make_blob(seed):
+    """One hit per OM from a track with uz=-0.5 (60 deg zenith)"""
+    random = np.random.RandomState(seed)
+    z = 15. * np.arange(1, N_OMS + 1)
+    string = SingleStringParameters(np.zeros(N_OMS), z, np.ones(N_OMS))
+    hits = []
+    for line in range(1, N_LINES + 1):
+        times = string.T_gamma(-0.5, 60., 10. + 15. * line, 100.) + \
+            random.normal(0, 1, N_OMS)
+        for om, time in enumerate(times):
+            pmt_id = (line - 1) * N_OMS + om + 1
+            hits.append(Hit(len(hits), pmt_id, float(time), 30.))
+    return {'EvtRawHits': hits, 'LongToTHits': list(hits),
+            'TrackIns': [Track(Direction(np.radians(60.)))]}
+
+
+class TestMultiLineROyFitter(object):
+    def setup_method(self, method):
+        self.fitter = core.ROyFitter(multi_line=True, batch_size=2,
+                                     dump_stats=False, verbose=False)
+        self.fitter.detector = FakeDetector()
+        self.blobs = [self.fitter.process(make_blob(seed))
+                      for seed in range(5)]
+
+    def test_last_batch_is_fitted_in_finish(self):
+        assert [] == self.blobs[-1]['ROyFits']
+        self.fitter.finish()
+        fits = self.blobs[-1]['ROyFits']
+        assert [5] * (N_LINES + 1) == [fit['event'] for fit in fits]
+        assert [1, 2, 3, -1] == [fit['line'] for fit in fits]
+
+    def test_event_and_line_fits_are_counted_apart(self):
+        self.fitter.finish()
+        stats, counters = self.fitter.stats, self.fitter.stage.counters
+        assert 5 == stats['number_of_vaild_fits']
+        assert 5 == counters['valid_fits'] + counters.get('failed_fits', 0)
+        assert 5 * N_LINES == counters['valid_line_fits'] + \
+            counters.get('failed_line_fits', 0)
+        lines = np.array(stats['line'])
+        assert 5 == np.count_nonzero(lines == -1)
+        assert 5 == len(stats['zenith_resolution'])
+
+    def test_combined_zenith_is_the_median_of_the_lines(self):
+        self.fitter.finish()
+        fits = [fit for blob in self.blobs for fit in blob['ROyFits']]
+        assert 5 * (N_LINES + 1) == len(fits)
+        for event in range(1, 6):
+            line_zeniths = [fit['reco_zenith'] for fit in fits
+                            if fit['event'] == event and fit['line'] != -1]
+            combined, = [fit for fit in fits
+                         if fit['event'] == event and fit['line'] == -1]
+            assert N_LINES == len(line_zeniths)
+            assert np.median(line_zeniths) == \
+                pytest.approx(combined['reco_zenith'], abs=0.5)
+
+
+class TestLiveMonitor(object):
+    def test_fits_of_the_last_batch_are_published(self):
+        pytest.importorskip('asyncio')
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.settimeout(2)
+        host, port = listener.getsockname()
+        fitter = core.ROyFitter(multi_line=True, batch_size=2,
+                                dump_stats=False, verbose=False)
+        fitter.detector = FakeDetector()
+        monitor = core.LiveMonitor(host=host, port=port, interval=1000,
+                                   verbose=False)
+        try:
+            for seed in range(5):
+                monitor.process(fitter.process(make_blob(seed)))
+            fitter.finish()
+            monitor.finish()
+            message = json.loads(listener.recvfrom(65536)[0].decode('utf-8'))
+        finally:
+            listener.close()
+        assert {'events': 5, 'fits': 5 * (N_LINES + 1),
+                'valid_fits': 5 * (N_LINES + 1)} == message['counters']
+        assert 5 == sum(message['histograms']['reco_zenith']['counts'])
+        assert 5 == message['latest_fit']['event']
+        assert message['latest_fit']['dc'] is None
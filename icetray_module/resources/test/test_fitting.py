@@ -0,0 +1,152 @@
+# coding=utf-8
+# Filename: test_fitting.py
+"""
+Description.
+
+"""
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from royfit import minimiser
+from royfit.fitting import (default_seed, fit_events, combine_lines,
+                            fit_lines)
+
+
+def make_events(truths, n_hits=12):
+    z = np.linspace(0, 150, n_hits)
+    string = minimiser.SingleStringParameters(np.zeros(n_hits), z,
+                                              np.ones(n_hits))
+    random = np.random.RandomState(3)
+    hit_times = [string.T_gamma(*truth) + random.normal(0, 1, n_hits)
+                 for truth in truths]
+    return hit_times, [z] * len(truths), [np.ones(n_hits)] * len(truths)
+
+
+class TestFitEvents(object):
+    def test_default_seed(self):
+        assert (-0.75, 15., 20., 3.) == default_seed([5., 3.], [10., 20.])
+
+    def test_finds_true_parameters(self):
+        truths = [(-0.5, 60., 30., 100.), (0.3, 90., 15., 50.)]
+        seeds = [[truth] for truth in truths]
+        result = fit_events(*make_events(truths), seeds=seeds, tol=1e-6)
+        assert (2, 4) == result.params.shape
+        assert np.all(result.converged)
+        hit_times, z, counts = make_events(truths)
+        for i, truth in enumerate(truths):
+            quality_function = minimiser.QualityFunction(
+                hit_times[i], z[i], counts[i], sigma_t=8, d0=50, d1=5)
+            assert np.isclose(quality_function(*result.params[i]),
+                              result.cost[i])
+            assert result.cost[i] <= quality_function(*truth)
+            assert abs(truth[0] - result.params[i, 0]) < 0.1
+
+    def test_best_seed_is_kept(self):
+        truth = (-0.5, 60., 30., 100.)
+        hit_times, z, counts = make_events([truth])
+        single = fit_events(hit_times, z, counts, seeds=[[truth]])
+        multi = fit_events(hit_times, z, counts,
+                           seeds=[[(0.9, 10., 90., 0.), truth]])
+        assert 1 == len(multi.cost)
+        assert multi.cost[0] <= single.cost[0] + 1e-9
+        assert multi.n_calls[0] > single.n_calls[0]
+
+    def test_limits(self):
+        result = fit_events(*make_events([(-0.5, 60., 30., 100.)]),
+                            dc_limits=(40., 100.))
+        assert 40. <= result.params[0, 2] <= 100.
+        assert -1 <= result.params[0, 0] <= 1
+
+
+class TestCombineLines(object):
+    def test_weighted_median(self):
+        uz, uz_err, n_lines = combine_lines([0.2, 0.5, -0.4], [0.1, 0.2, 1.],
+                                            [True, True, True], [0, 0, 1])
+        assert np.allclose([0.2, -0.4], uz)
+        assert np.allclose([1 / np.sqrt(125), 1], uz_err)
+        assert [2, 1] == n_lines.tolist()
+
+    def test_outlier_line(self):
+        uz, _, _ = combine_lines([0.3, 0.32, 0.34, -0.9], [0.05] * 4,
+                                 [True] * 4, [0, 0, 0, 0])
+        assert np.isclose(0.31, uz[0])
+
+    def test_fit_on_the_limit_is_not_used(self):
+        uz, _, n_lines = combine_lines([0.3, 0.35, 0.4, 1.],
+                                       [0.05, 0.04, 0.05, 1e-4],
+                                       [True] * 4, [0, 0, 0, 0])
+        assert np.isclose(0.35, uz[0])
+        assert 4 == n_lines[0]
+
+    def test_only_fits_on_the_limit(self):
+        uz, _, n_lines = combine_lines([1., 1.], [1e-4, 1e-3], [True, True],
+                                       [0, 0])
+        assert np.isclose(1, uz[0])
+        assert 2 == n_lines[0]
+
+    def test_failed_fits_are_ignored(self):
+        uz, _, n_lines = combine_lines([0.2, 0.9, 0.1], [0.1, 0.1, 0.1],
+                                       [True, False, False], [0, 0, 1], 3)
+        assert np.isclose(0.2, uz[0])
+        assert np.isnan(uz[1]) and np.isnan(uz[2])
+        assert [1, 0, 0] == n_lines.tolist()
+
+    def test_fits_without_error(self):
+        uz, _, _ = combine_lines([0.2, 0.4], [np.nan, 0.1], [True, True],
+                                 [0, 0])
+        assert np.isclose(0.3, uz[0])
+
+
+class TestFitLines(object):
+    def make_pulses(self):
+        """Two lines with 12 OMs and one with 3, a late pulse on each OM"""
+        truths = [(-0.5, 60., 30., 100.), (0.3, 90., 15., 50.)]
+        hit_times, z, _ = make_events(truths)
+        lines = np.repeat([2, 5], 12)
+        oms = np.tile(np.arange(1, 13), 2)
+        times = np.concatenate(hit_times)
+        z = np.concatenate(z)
+        lines = np.r_[lines, lines, 7, 7, 7]
+        oms = np.r_[oms, oms, 1, 2, 3]
+        times = np.r_[times, times + 500, 0, 1, 2]
+        z = np.r_[z, z, 0, 10, 20]
+        order = np.random.RandomState(1).permutation(len(times))
+        order = order[np.argsort(times[order], kind='mergesort')]
+        return truths, lines[order], oms[order], times[order], z[order]
+
+    def test_lines_are_fitted_with_the_first_pulses(self):
+        truths, lines, oms, times, z = self.make_pulses()
+        fitted_lines, result = fit_lines(lines, oms, times, z, min_hits=5,
+                                         sigma_t=1, amplitude=False)
+        assert [2, 5] == fitted_lines.tolist()
+        assert np.all(result.converged)
+        for i, truth in enumerate(truths):
+            assert abs(truth[0] - result.params[i, 0]) < 0.05
+
+    def test_no_line_with_enough_pulses(self):
+        _, lines, oms, times, z = self.make_pulses()
+        fitted_lines, result = fit_lines(lines, oms, times, z, min_hits=13)
+        assert 0 == len(fitted_lines)
+        assert result is None
+        assert fit_lines([], [], [], [])[1] is None
+
+
+class TestLazyImport(object):
+    def test_package_import_does_not_load_core(self):
+        import royfit
+        assert 'fit_events' in dir(royfit)
+        assert royfit.fit_events is fit_events
+        package_path = os.path.dirname(os.path.dirname(royfit.__file__))
+        environment = dict(os.environ, PYTHONPATH=package_path)
+        subprocess.check_call(
+            [sys.executable, '-c',
+             "import sys, royfit; "
+             "assert 'royfit.core' not in sys.modules; "
+             "assert 'km3pipe' not in sys.modules"],
+            env=environment)
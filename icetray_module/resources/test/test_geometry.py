@@ -0,0 +1,129 @@
+# coding=utf-8
+# Filename: test_geometry.py
+"""
+Description.
+
+"""
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+from collections import namedtuple
+
+import numpy as np
+from royfit.geometry import (MAX_GEOMETRIES, PMTTable, GeometryCache,
+                             geometry_cache, get_pmt_table, line_positions,
+                             floor_z, neighbour_floors, omgeo_key)
+
+Position = namedtuple('Position', 'x y z')
+PMT = namedtuple('PMT', 'id pos')
+
+
+class FakeDetector(object):
+    """Two lines with three OMs and two PMTs each"""
+    def __init__(self):
+        self.pmts = [PMT(pmt_id, Position(pmt_id, -pmt_id, 10 * pmt_id))
+                     for pmt_id in range(1, 13)]
+
+    def pmtid2omkey(self, pmt_id):
+        return ((pmt_id - 1) // 6 + 1, (pmt_id - 1) // 2 % 3 + 1,
+                (pmt_id - 1) % 2 + 1)
+
+
+class TestPMTTable(object):
+    def test_lookup(self):
+        detector = FakeDetector()
+        table = PMTTable.from_detector(detector)
+        pmt_ids = np.array([1, 4, 12, 7])
+        assert list(table.z[pmt_ids]) == [10, 40, 120, 70]
+        assert table.omkeys(pmt_ids) == [detector.pmtid2omkey(i)[:2]
+                                         for i in pmt_ids]
+        assert list(table.pmt[pmt_ids]) == [1, 2, 2, 1]
+
+    def test_unknown_pmt_id(self):
+        table = PMTTable.from_detector(FakeDetector())
+        assert table.line[0] == -1
+        assert table.om_id[0] == -1
+        assert np.isnan(table.z[0])
+
+    def test_om_ids_are_unique_per_om(self):
+        detector = FakeDetector()
+        table = PMTTable.from_detector(detector)
+        om_ids = table.om_id[1:]
+        omkeys = table.omkeys(np.arange(1, 13))
+        assert len(set(om_ids)) == len(set(omkeys)) == 6
+
+    def test_table_is_shared(self):
+        detector = FakeDetector()
+        assert get_pmt_table(detector) is get_pmt_table(detector)
+        assert get_pmt_table(FakeDetector()) is not get_pmt_table(detector)
+
+
+class TestGeometryCache(object):
+    def test_line_positions(self):
+        positions = line_positions(PMTTable.from_detector(FakeDetector()))
+        assert [1, 2] == sorted(positions)
+        assert np.allclose((3.5, -3.5), positions[1])
+        assert np.allclose((9.5, -9.5), positions[2])
+
+    def test_floor_z(self):
+        floors = floor_z(PMTTable.from_detector(FakeDetector()))
+        assert np.isnan(floors[1][0])
+        assert [15, 35, 55] == floors[1][1:].tolist()
+        assert [75, 95, 115] == floors[2][1:].tolist()
+
+    def test_neighbour_floors(self):
+        table = PMTTable.from_detector(FakeDetector())
+        neighbours = neighbour_floors(table, 2)
+        om_id = table.om_id[1]  # line 1, OM 1
+        assert [(1, om_id + 1), (2, om_id + 2)] == neighbours[om_id]
+        assert [(1, om_id + 2), (1, om_id)] == neighbours[om_id + 1]
+        assert 6 == len(neighbours)
+
+    def test_values_are_computed_once(self):
+        cache = GeometryCache(FakeDetector())
+        calls = []
+        cache.get('answer', lambda geometry: calls.append(geometry) or 42)
+        assert 42 == cache.get('answer', lambda geometry: 0)
+        assert 1 == len(calls)
+        assert cache.neighbour_floors(1) is cache.neighbour_floors(1)
+
+    def test_alternating_geometries_keep_their_caches(self):
+        first, second = FakeDetector(), FakeDetector()
+        first_table = geometry_cache(first).pmt_table
+        second_table = geometry_cache(second).pmt_table
+        assert first_table is not second_table
+        for _ in range(3):
+            assert geometry_cache(first).pmt_table is first_table
+            assert geometry_cache(second).pmt_table is second_table
+
+    def test_key_for_recreated_geometry_objects(self):
+        table = geometry_cache(FakeDetector(), key='run 1').pmt_table
+        assert geometry_cache(FakeDetector(), key='run 1').pmt_table is table
+        assert geometry_cache(FakeDetector(), key='run 2').pmt_table \
+            is not table
+
+    def test_old_geometries_are_dropped(self):
+        detector = FakeDetector()
+        cache = geometry_cache(detector)
+        for i in range(MAX_GEOMETRIES):
+            geometry_cache(FakeDetector(), key=('other', i))
+        assert geometry_cache(detector) is not cache
+
+
+class FakeOMGeo(object):
+    def __init__(self, z):
+        self.position = Position(0., 0., z)
+
+
+class FakeI3Geometry(object):
+    def __init__(self, z_coordinates):
+        self.omgeo = dict(((1, om), FakeOMGeo(z))
+                          for om, z in enumerate(z_coordinates))
+
+
+class TestOMGeoKey(object):
+    def test_same_positions_same_key(self):
+        assert omgeo_key(FakeI3Geometry([1, 2])) == \
+            omgeo_key(FakeI3Geometry([1, 2]))
+        assert omgeo_key(FakeI3Geometry([1, 2])) != \
+            omgeo_key(FakeI3Geometry([1, 3]))
@@ -0,0 +1,194 @@
+# coding=utf-8
+# Filename: test_hits.py
+"""
+Description.
+
+"""
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+from collections import namedtuple
+
+import numpy as np
+from royfit.geometry import PMTTable, neighbour_floors
+from royfit.hits import (HitSeries, as_hit_series, first_om_hits, t3_hits,
+                         merge_om_hits, split_by_line)
+
+Hit = namedtuple('Hit', 'id pmt_id time tot')
+
+
+def make_pmt_table():
+    pmt_ids = range(1, 7)
+    omkeys = [(1, (pmt_id - 1) // 2 + 1, (pmt_id - 1) % 2 + 1)
+              for pmt_id in pmt_ids]
+    positions = [(0, 0, 10. * om) for _, om, _ in omkeys]
+    return PMTTable(pmt_ids, omkeys, positions)
+
+
+def make_hits():
+    return [Hit(0, 3, 20., 25.), Hit(1, 1, 10., 10.), Hit(2, 6, 5., 40.)]
+
+
+class TestHitSeries(object):
+    def test_from_hits(self):
+        hits = HitSeries.from_hits(make_hits(), make_pmt_table())
+        assert len(hits) == 3
+        assert list(hits.time) == [20, 10, 5]
+        assert list(hits.om) == [2, 1, 3]
+        assert list(hits.z) == [20, 10, 30]
+
+    def test_selection_shares_data(self):
+        hits = HitSeries.from_hits(make_hits(), make_pmt_table())
+        selected = hits[hits.tot > 20]
+        assert selected.data is hits.data
+        assert list(selected.id) == [0, 2]
+        assert list(selected[np.argsort(selected.time)].id) == [2, 0]
+
+    def test_iteration_gives_records_with_attributes(self):
+        hits = HitSeries.from_hits(make_hits(), make_pmt_table())
+        assert [hit.pmt_id for hit in hits] == [3, 1, 6]
+        assert hits[1].time == 10
+
+    def test_from_records(self):
+        hits = HitSeries.from_hits(make_hits(), make_pmt_table())
+        copied = HitSeries.from_records([hits[2], hits[0]])
+        assert copied.data is not hits.data
+        assert list(copied.id) == [2, 0]
+        assert len(HitSeries.from_records([])) == 0
+
+    def test_as_hit_series(self):
+        pmt_table = make_pmt_table()
+        hits = as_hit_series(make_hits(), pmt_table)
+        assert isinstance(hits, HitSeries)
+        assert as_hit_series(hits, pmt_table) is hits
+
+
+class TestFirstOMHits(object):
+    def test_matches_loop_over_time_sorted_hits(self):
+        pmt_table = make_pmt_table()
+        random = np.random.RandomState(3)
+        for _ in range(20):
+            n_hits = random.randint(0, 30)
+            hits = [Hit(i, random.randint(1, 7), random.randint(0, 20), 30)
+                    for i in range(n_hits)]
+            expected = []
+            skip_oms = []
+            for hit in sorted(hits, key=lambda x: x.time):
+                om = pmt_table.omkeys([hit.pmt_id])[0]
+                if om not in skip_oms:
+                    expected.append(hit.id)
+                    skip_oms.append(om)
+            first_hits = first_om_hits(HitSeries.from_hits(hits, pmt_table))
+            assert list(first_hits.id) == expected
+
+
+def reference_t3_hits(hits, candidates, pmt_table, time_windows):
+    """The original T3HitSelector loop, extended to len(time_windows)"""
+    def by_om(hits):
+        om_hits = {}
+        for hit in hits:
+            om_hits.setdefault(pmt_table.omkeys([hit.pmt_id])[0],
+                               []).append(hit)
+        return om_hits
+    om_hits = by_om(hits)
+    om_candidate_hits = by_om(sorted(candidates, key=lambda x: x.time))
+    selected_hits = []
+    skip_pmtids = []
+    for om in sorted(om_hits, key=lambda om: hits.index(om_hits[om][0])):
+        hit = om_hits[om][0]
+        for distance, window in enumerate(time_windows, 1):
+            adjacent_hits = om_candidate_hits.get((om[0], om[1]+distance),
+                                                  []) + \
+                om_candidate_hits.get((om[0], om[1]-distance), [])
+            for adjacent_hit in adjacent_hits:
+                if 0 <= adjacent_hit.time - hit.time <= window:
+                    if adjacent_hit.pmt_id not in skip_pmtids:
+                        selected_hits.append(adjacent_hit)
+                        skip_pmtids.append(adjacent_hit.pmt_id)
+                    if hit.pmt_id not in skip_pmtids:
+                        selected_hits.append(hit)
+                        skip_pmtids.append(hit.pmt_id)
+    return selected_hits
+
+
+class TestT3Hits(object):
+    def test_matches_reference_loop(self):
+        pmt_table = make_pmt_table()
+        random = np.random.RandomState(7)
+        for time_windows in ([2., 4.], [2., 4., 6.5], [0.3]):
+            for _ in range(20):
+                candidates = [Hit(i, random.randint(1, 7),
+                                  round(random.uniform(0, 10), 1), 30)
+                              for i in range(random.randint(0, 40))]
+                hits = [Hit(100 + i, random.randint(1, 7),
+                            round(random.uniform(0, 10), 1), 30)
+                        for i in range(random.randint(0, 8))]
+                expected = reference_t3_hits(hits, candidates, pmt_table,
+                                             time_windows)
+                hits = HitSeries.from_hits(hits, pmt_table)
+                candidates = HitSeries.from_hits(candidates, pmt_table)
+                selected = t3_hits(hits, candidates, time_windows)
+                assert list(selected.id) == [hit.id for hit in expected]
+                neighbours = neighbour_floors(pmt_table, len(time_windows))
+                selected = t3_hits(hits, candidates, time_windows,
+                                   neighbours)
+                assert list(selected.id) == [hit.id for hit in expected]
+
+
+class TestMergeOMHits(object):
+    def merge(self, hits, time_window=10, keep_singletons=True):
+        hits = HitSeries.from_hits(hits, make_pmt_table())
+        return merge_om_hits(hits, time_window, keep_singletons)
+
+    def test_chained_cluster(self):
+        # PMTs 1 and 2 are on the same OM, each gap is within the window
+        merged = self.merge([Hit(0, 1, 0., 10.), Hit(1, 2, 8., 20.),
+                             Hit(2, 1, 16., 30.)])
+        assert list(merged.id) == [0]
+        assert list(merged.tot) == [60]
+
+    def test_earliest_hit_defines_id_pmt_and_time(self):
+        merged = self.merge([Hit(0, 2, 5., 10.), Hit(1, 1, 1., 20.)])
+        assert (merged[0].id, merged[0].pmt_id, merged[0].time) == (1, 1, 1)
+
+    def test_last_cluster_is_kept(self):
+        merged = self.merge([Hit(0, 1, 0., 10.), Hit(1, 1, 5., 10.),
+                             Hit(2, 1, 50., 10.), Hit(3, 1, 55., 10.)])
+        assert list(merged.id) == [0, 2]
+        assert list(merged.tot) == [20, 20]
+
+    def test_gap_larger_than_window_splits(self):
+        merged = self.merge([Hit(0, 1, 0., 10.), Hit(1, 1, 10., 10.),
+                             Hit(2, 1, 20.5, 10.)])
+        assert list(merged.id) == [0, 2]
+        assert list(merged.tot) == [20, 10]
+
+    def test_different_oms_are_not_merged(self):
+        merged = self.merge([Hit(0, 1, 0., 10.), Hit(1, 3, 1., 10.)])
+        assert list(merged.id) == [0, 1]
+
+    def test_singletons(self):
+        hits = [Hit(0, 1, 0., 10.), Hit(1, 1, 5., 10.), Hit(2, 3, 0., 10.)]
+        assert list(self.merge(hits).id) == [0, 2]
+        assert list(self.merge(hits, keep_singletons=False).id) == [0]
+
+    def test_no_hits(self):
+        assert len(self.merge([])) == 0
+
+
+class TestSplitByLine(object):
+    def test_hits_are_partitioned_by_line(self):
+        pmt_table = PMTTable(range(1, 5), [(2, 1, 1), (1, 1, 1), (2, 2, 1),
+                                           (1, 2, 1)], np.zeros((4, 3)))
+        hits = HitSeries.from_hits([Hit(0, 1, 1., 10.), Hit(1, 2, 2., 10.),
+                                    Hit(2, 3, 3., 10.), Hit(3, 4, 4., 10.)],
+                                   pmt_table)
+        lines = split_by_line(hits)
+        assert [line for line, _ in lines] == [1, 2]
+        assert list(lines[0][1].id) == [1, 3]
+        assert list(lines[1][1].id) == [0, 2]
+        assert lines[0][1].data is hits.data
+
+    def test_no_hits(self):
+        hits = HitSeries.from_hits([], make_pmt_table())
+        assert split_by_line(hits) == []
@@ -0,0 +1,211 @@
+# coding=utf-8
+# Filename: test_instrumentation.py
+"""
+Description.
+
+"""
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+import numpy as np
+import pytest
+
+import royfit.instrumentation
+from royfit.instrumentation import (FrameProfile, LogHistogram, StageStats,
+                                    frame_profile, instrumented)
+
+
+class TestLogHistogram(object):
+    def test_quantiles_are_within_a_bin(self):
+        values = np.random.RandomState(1).lognormal(0, 2, 10000)
+        histogram = LogHistogram()
+        for value in values:
+            histogram.fill(value)
+        for q in (0.1, 0.5, 0.95):
+            expected = np.percentile(values, q * 100)
+            assert expected == pytest.approx(histogram.quantile(q), rel=0.13)
+
+    def test_mean_min_max(self):
+        histogram = LogHistogram()
+        for value in (1., 2., 6.):
+            histogram.fill(value)
+        assert 3 == histogram.mean
+        assert 1 == histogram.min
+        assert 6 == histogram.max
+
+    def test_underflow_and_overflow(self):
+        histogram = LogHistogram(low=1, high=100)
+        for value in (0, 0.5, 1000):
+            histogram.fill(value)
+        assert 2 == histogram.counts[0]
+        assert 1 == histogram.counts[-1]
+        assert 0 == histogram.quantile(0.1)
+        assert 1000 == histogram.quantile(1)
+
+    def test_empty_histogram(self):
+        histogram = LogHistogram()
+        assert np.isnan(histogram.mean)
+        assert np.isnan(histogram.quantile(0.5))
+
+    def test_merge(self):
+        first, second, both = LogHistogram(), LogHistogram(), LogHistogram()
+        for value in range(1, 50):
+            first.fill(value)
+            both.fill(value)
+        for value in range(50, 100):
+            second.fill(value)
+            both.fill(value)
+        first.merge(second)
+        assert both.counts == first.counts
+        assert both.n == first.n
+        assert both.max == first.max
+
+    def test_merge_different_binning_raises(self):
+        with pytest.raises(ValueError):
+            LogHistogram(low=1).merge(LogHistogram(low=10))
+
+
+class FakeModule(object):
+    input_hits = 'Hits'
+    output_hits = 'SelectedHits'
+
+    def __init__(self, instrument=True):
+        self.stage = StageStats('FakeModule') if instrument else None
+
+    @instrumented()
+    def process(self, blob):
+        blob[self.output_hits] = blob[self.input_hits][:2]
+        return blob
+
+
+class TestInstrumented(object):
+    def test_time_and_hit_counts_are_recorded(self):
+        module = FakeModule()
+        for n_hits in (3, 5, 10):
+            module.process({'Hits': list(range(n_hits))})
+        assert 3 == module.stage.time.n
+        assert 6 == module.stage.hits_in.mean
+        assert 2 == module.stage.hits_out.max
+
+    def test_blob_is_returned(self):
+        blob = FakeModule().process({'Hits': [1, 2, 3]})
+        assert [1, 2] == blob['SelectedHits']
+        assert ['FakeModule'] == list(blob['StageTimes'])
+
+    def test_no_stage(self):
+        module = FakeModule(instrument=False)
+        blob = module.process({'Hits': [1, 2, 3]})
+        assert [1, 2] == blob['SelectedHits']
+
+
+class TestStageStats(object):
+    def test_counters_and_histograms_are_merged(self):
+        first, second = StageStats('fit'), StageStats('fit')
+        first.count('valid_fits', 2)
+        second.count('valid_fits')
+        second.count('failed_fits')
+        first.fill('nfcn', 100)
+        second.fill('nfcn', 50)
+        second.record(0.1, 10, 5)
+        first.merge(second)
+        assert {'valid_fits': 3, 'failed_fits': 1} == first.counters
+        assert 2 == first.histograms['nfcn'].n
+        assert 1 == first.time.n
+
+    def test_summary(self):
+        stage = StageStats('fit')
+        stage.record(0.002, 10)
+        stage.fill('nfcn', 100)
+        stage.count('valid_fits')
+        summary = stage.summary()
+        assert summary.startswith('fit: 1 calls')
+        assert 'nfcn' in summary
+        assert 'valid_fits: 1' in summary
+        assert 'hits out' not in summary
+
+
+class FakeClock(object):
+    """timer_ns() which advances by the given ms"""
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, ms):
+        self.now += int(ms * 1e6)
+
+
+class TestFrameProfile(object):
+    def setup_method(self, method):
+        self.clock = FakeClock()
+        self.timer_ns = royfit.instrumentation.timer_ns
+        royfit.instrumentation.timer_ns = self.clock
+
+    def teardown_method(self, method):
+        royfit.instrumentation.timer_ns = self.timer_ns
+
+    def test_frames_end_with_the_next_frame(self):
+        profile = FrameProfile()
+        for frame_type, ms in (('G', 5), ('P', 2), ('P', 3000), ('Q', 1)):
+            profile.start(frame_type)
+            self.clock.advance(ms)
+        profile.stop()
+        assert 2 == profile.frames['P'].n
+        assert 3002 == pytest.approx(profile.frames['P'].total)
+        assert 3000 == profile.frames['P'].max
+        assert 1 == profile.frames['Q'].n
+        assert {} == profile.stages
+
+    def test_stages(self):
+        profile = FrameProfile()
+        for _ in range(10):
+            profile.start('P')
+            self.clock.advance(1)
+            profile.mark('ZTPlot')
+            self.clock.advance(9)
+            profile.mark('ROyFitter')
+            self.clock.advance(0.5)
+        profile.stop()
+        stages = profile.stages['P']
+        assert 10 == stages['ROyFitter'].n
+        assert 9 == pytest.approx(stages['ROyFitter'].quantile(0.99),
+                                  rel=0.13)
+        assert 5 == pytest.approx(stages['other'].total)
+        summary = profile.summary().splitlines()
+        assert summary[1].startswith('  P: 10 frames')
+        assert 'p99' in summary[1]
+        assert summary[2].startswith('    ZTPlot: 9.5% of the time')
+        assert summary[4].startswith('    other')
+
+    def test_upstream_time_after_the_last_mark_is_not_counted(self):
+        profile = FrameProfile()
+        for _ in range(3):
+            self.clock.advance(100)  # reader
+            profile.start('P')
+            self.clock.advance(2)
+            profile.mark('ROyFitter', last=True)
+        profile.stop()
+        assert 3 == profile.frames['P'].n
+        assert 6 == pytest.approx(profile.frames['P'].total)
+        assert 'other' not in profile.stages['P']
+
+    def test_stop_ends_the_frame(self):
+        profile = FrameProfile()
+        profile.start('Q')
+        self.clock.advance(1)
+        profile.stop()
+        self.clock.advance(100)
+        profile.start('P')
+        assert 1 == pytest.approx(profile.frames['Q'].total)
+
+    def test_stop_without_frame(self):
+        profile = FrameProfile()
+        profile.mark('ZTPlot')
+        profile.stop()
+        assert {} == profile.frames
+        assert 'Frame latencies [ms]:' == profile.summary()
+
+    def test_shared_by_name(self):
+        assert frame_profile('test') is frame_profile('test')
+        assert frame_profile('test') is not frame_profile('other test')
@@ -0,0 +1,167 @@
+# coding=utf-8
+# Filename: test_live.py
+"""
+Description.
+
+"""
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+import json
+import socket
+
+import pytest
+
+asyncio = pytest.importorskip('asyncio')
+
+from royfit.live import AsyncPublisher, FitFeed, RollingHistogram, json_safe
+
+
+class TestRollingHistogram(object):
+    def test_fill(self):
+        histogram = RollingHistogram([0, 1, 2, 3])
+        histogram.fill([0.5, 1.5, 1.7, -1, 10, float('nan')])
+        assert [2, 2, 1] == histogram.counts.tolist()
+
+    def test_old_periods_are_forgotten(self):
+        histogram = RollingHistogram([0, 1, 2], n_periods=2)
+        histogram.fill(0.5)
+        histogram.roll()
+        histogram.fill(1.5)
+        assert [1, 1] == histogram.counts.tolist()
+        histogram.roll()
+        assert [0, 1] == histogram.counts.tolist()
+
+
+def fit(reco_zenith, valid=True, line=-1):
+    return {'event': 1, 'line': line, 'valid': valid, 'mc_zenith': 90.,
+            'reco_zenith': reco_zenith, 'quality_parameter': 1.,
+            'dc': 20., 'nfcn': 100}
+
+
+class TestFitFeed(object):
+    def test_messages_are_rate_limited(self):
+        feed = FitFeed(interval=1000)
+        assert feed.add([fit(10.)], {'ROyFitter': 0.01}) is None
+        feed.add([fit(20., valid=False)])
+        message = feed.message()
+        assert {'events': 2, 'fits': 2, 'valid_fits': 1} == \
+            message['counters']
+        assert 1 == sum(message['histograms']['reco_zenith']['counts'])
+        assert 1 == sum(message['latency_ms']['ROyFitter']['counts'])
+        assert 10. == message['latest_fit']['reco_zenith']
+        json.dumps(message)
+
+    def test_line_fits_are_not_histogrammed(self):
+        feed = FitFeed(interval=1000)
+        feed.add([fit(10., line=1), fit(30., line=2), fit(20.)])
+        message = feed.message()
+        assert 3 == message['counters']['valid_fits']
+        assert 1 == sum(message['histograms']['reco_zenith']['counts'])
+        assert 20. == message['latest_fit']['reco_zenith']
+
+    def test_add_fits_does_not_count_an_event(self):
+        feed = FitFeed(interval=1000)
+        feed.add_fits([fit(10.)])
+        assert {'events': 0, 'fits': 1, 'valid_fits': 1} == \
+            feed.message()['counters']
+
+    def test_message_after_interval(self):
+        feed = FitFeed(interval=0)
+        assert feed.add([fit(10.)]) is not None
+
+
+class UDPListener(object):
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.settimeout(2)
+        self.address = self.socket.getsockname()
+
+    def receive(self):
+        return json.loads(self.socket.recvfrom(65536)[0].decode('utf-8'))
+
+    def close(self):
+        self.socket.close()
+
+
+class TCPListener(object):
+    def __init__(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.server.settimeout(2)
+        self.address = self.server.getsockname()
+        self.file = None
+
+    def receive(self):
+        if self.file is None:
+            connection, _ = self.server.accept()
+            connection.settimeout(2)
+            self.file = connection.makefile('rb')
+        return json.loads(self.file.readline().decode('utf-8'))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.server.close()
+
+
+class TestJsonSafe(object):
+    def test_nested_values(self):
+        value = {'a': [1, float('nan'), {'b': float('-inf')}], 'c': 'd'}
+        assert {'a': [1, None, {'b': None}], 'c': 'd'} == json_safe(value)
+
+
+class TestAsyncPublisher(object):
+    @pytest.mark.parametrize('protocol, listener_class',
+                             [('udp', UDPListener), ('tcp', TCPListener)])
+    def test_messages_arrive_in_order(self, protocol, listener_class):
+        listener = listener_class()
+        publisher = AsyncPublisher(listener.address, protocol)
+        try:
+            for i in range(3):
+                assert publisher.publish({'message': i})
+            assert [{'message': i} for i in range(3)] == \
+                [listener.receive() for _ in range(3)]
+        finally:
+            publisher.close()
+            listener.close()
+        assert 3 == publisher.published
+        assert not publisher.publish({'message': 4})
+
+    def test_non_finite_values_are_sent_as_null(self):
+        listener = UDPListener()
+        publisher = AsyncPublisher(listener.address)
+        try:
+            publisher.publish({'latest_fit': {'dc': float('nan'),
+                                              'uz': [float('inf'), 0.5]}})
+            message = listener.receive()
+        finally:
+            publisher.close()
+            listener.close()
+        assert {'latest_fit': {'dc': None, 'uz': [None, 0.5]}} == message
+        assert 0 == publisher.errors
+
+    def test_full_queue_drops_messages(self):
+        listener = UDPListener()
+        publisher = AsyncPublisher(listener.address, max_queue=1)
+        for i in range(1000):
+            publisher.publish({'message': i})
+        publisher.close()
+        listener.close()
+        assert publisher.dropped > 0
+        assert 1000 == publisher.published + publisher.dropped
+
+    def test_connection_errors_are_counted(self):
+        listener = TCPListener()
+        address = listener.address
+        listener.close()
+        publisher = AsyncPublisher(address, 'tcp')
+        publisher.publish({'message': 1})
+        publisher.close()
+        assert 1 == publisher.errors
+
+    def test_unknown_protocol(self):
+        with pytest.raises(ValueError):
+            AsyncPublisher(('127.0.0.1', 9999), 'smoke signals')
@@ -7,8 +7,190 @@ Description.
 __author__ = 'Tamas Gal'
 __email__ = 'tamas.gal@physik.uni-erlangen.de'
 
+import numpy as np
 import pytest
 from royfit import minimiser
 
+
+def make_quality_function(n_hits=12, truth=(-0.6, 10., 30., 100.)):
+    z = np.linspace(-100, 100, n_hits)
+    string = minimiser.SingleStringParameters(np.zeros(n_hits), z,
+                                              np.ones(n_hits))
+    t = string.T_gamma(*truth)
+    t += np.random.RandomState(23).normal(0, 3, n_hits)
+    counts = np.random.RandomState(5).randint(1, 5, n_hits)
+    return minimiser.QualityFunction(t, z, counts, sigma_t=8, d0=50, d1=5)
+
+
+def numerical_grad(func, params, h=1e-6):
+    params = np.array(params, dtype=float)
+    return [(func(*(params + h*e)) - func(*(params - h*e))) / (2*h)
+            for e in np.eye(len(params))]
+
+
 class TestQualityFunction(object):
-    pass
+    @pytest.mark.parametrize('params', [(-0.5, 5., 25., 95.),
+                                        (0.3, -40., 10., 120.)])
+    def test_call_matches_component_methods(self, params):
+        qf = make_quality_function()
+        aip = 2. * qf.c / (qf.Cos_theta(*params[:3]) + 1.)
+        D = np.sqrt(qf.d1**2 + qf.D_gamma(*params[:3])**2)
+        expected = np.sum((qf.T_gamma(*params) - qf.t)**2 / qf.sigma_t**2
+                          + aip * D / (np.mean(aip) * qf.d0))
+        assert np.isclose(qf(*params), expected)
+
+    @pytest.mark.parametrize('params', [(-0.5, 5., 25., 95.),
+                                        (0.3, -40., 10., 120.),
+                                        (-0.9, 80., 60., 50.)])
+    def test_grad_matches_finite_differences(self, params):
+        quality_function = make_quality_function()
+        grad = quality_function.grad(*params)
+        expected = numerical_grad(quality_function, params)
+        assert np.allclose(grad, expected, rtol=1e-5, atol=1e-5)
+
+    def test_grad_vanishes_at_minimum_in_tc(self):
+        quality_function = make_quality_function()
+        uz, zc, dc, tc = -0.6, 10., 30., 100.
+        residuals = quality_function.T_gamma(uz, zc, dc, tc) \
+            - quality_function.t
+        tc_best = tc - np.mean(residuals)
+        assert abs(quality_function.grad(uz, zc, dc, tc_best)[3]) < 1e-8
+
+
+class TestScan(object):
+    def test_scan_matches_call(self):
+        qf = make_quality_function()
+        uz = np.array([-0.5, 0.3, 0.9])
+        dc = np.array([25., 10., 60.])
+        quality, tc = qf.scan(uz, 5., dc, np.array([95., 120., 100.]))
+        for i in range(3):
+            assert np.isclose(qf(uz[i], 5., dc[i], tc[i]), quality[i])
+
+    def test_tc_minimises_the_time_residuals(self):
+        qf = make_quality_function()
+        quality, tc = qf.scan(-0.5, 5., 25.)
+        assert np.isclose(0, qf.grad(-0.5, 5., 25., tc)[3])
+        assert quality <= qf(-0.5, 5., 25., tc + 1)
+
+    def test_grid_seeds(self):
+        qf = make_quality_function()
+        uz_values, dc_values = np.linspace(-0.9, 0.9, 7), [10., 30., 50.]
+        seeds = minimiser.grid_seeds(qf, 10., uz_values, dc_values, 3)
+        assert 3 == len(seeds)
+        quality = [qf(*seed) for seed in seeds]
+        assert quality == sorted(quality)
+        grid_quality = [qf.scan(uz, 10., dc)[0]
+                        for uz in uz_values for dc in dc_values]
+        assert np.isclose(min(grid_quality), quality[0])
+        assert all(seed[1] == 10. for seed in seeds)
+
+
+class TestProfiledQualityFunction(object):
+    def make_profiled(self, cls=minimiser.ProfiledQualityFunction, **kwargs):
+        qf = make_quality_function()
+        return qf, cls(qf.t, qf.z, qf.c, sigma_t=8, d0=50, d1=5, **kwargs)
+
+    def test_is_minimum_in_tc(self):
+        qf, profiled = self.make_profiled()
+        tc = profiled.best_tc(-0.5, 5., 25.)
+        assert np.isclose(qf(-0.5, 5., 25., tc), profiled(-0.5, 5., 25.))
+        assert profiled(-0.5, 5., 25.) < qf(-0.5, 5., 25., tc + 0.5)
+        assert profiled(-0.5, 5., 25.) < qf(-0.5, 5., 25., tc - 0.5)
+
+    @pytest.mark.parametrize('params', [(-0.5, 5., 25.),
+                                        (0.3, -40., 10.)])
+    def test_grad_matches_finite_differences(self, params):
+        _, profiled = self.make_profiled()
+        assert np.allclose(profiled.grad(*params),
+                           numerical_grad(profiled, params), rtol=1e-4)
+
+    def test_complete(self):
+        _, profiled = self.make_profiled()
+        values, errors = profiled.complete(dict(uz=-0.5, zc=5., dc=25.),
+                                           dict(uz=0.1, zc=1., dc=2.))
+        assert np.isclose(profiled.best_tc(-0.5, 5., 25.), values['tc'])
+        assert np.isclose(8 / np.sqrt(12), errors['tc'])
+        assert 0.1 == errors['uz']
+
+    def test_zc_scan(self):
+        zc_values = np.linspace(-50, 50, 21)
+        qf, profiled = self.make_profiled(minimiser.ZcScanQualityFunction,
+                                          zc_values=zc_values)
+        expected = min(qf.scan(-0.5, zc, 25.)[0] for zc in zc_values)
+        assert np.isclose(expected, profiled(-0.5, 25.))
+        zc = profiled.best_zc(-0.5, 25.)
+        assert np.isclose(expected, qf.scan(-0.5, zc, 25.)[0])
+        values, errors = profiled.complete(dict(uz=-0.5, dc=25.),
+                                           dict(uz=0.1, dc=2.))
+        assert zc == values['zc']
+        assert np.isnan(errors['zc'])
+        assert 'tc' in values
+
+    def test_zc_scan_grad(self):
+        _, profiled = self.make_profiled(minimiser.ZcScanQualityFunction,
+                                         zc_values=[0., 5., 10.])
+        # away from a switch of the best zc the gradient is smooth
+        assert np.allclose(profiled.grad(-0.5, 25.),
+                           numerical_grad(profiled, (-0.5, 25.)), rtol=1e-4)
+
+
+class TestBatchQualityFunction(object):
+    def setup_method(self, method):
+        self.events = []
+        for n_hits, seed in ((5, 1), (9, 2), (14, 3)):
+            z = np.linspace(-80, 80, n_hits)
+            string = minimiser.SingleStringParameters(np.zeros(n_hits), z,
+                                                      np.ones(n_hits))
+            t = string.T_gamma(-0.4, 0., 20., 50.)
+            t += np.random.RandomState(seed).normal(0, 3, n_hits)
+            counts = np.random.RandomState(seed).randint(1, 4, n_hits)
+            self.events.append((t, z, counts))
+        self.params = np.array([[-0.5, 5., 25., 45.],
+                                [0.2, -3., 30., 60.],
+                                [-0.1, 10., 10., 40.]])
+        t, z, counts = zip(*self.events)
+        self.batch = minimiser.BatchQualityFunction(t, z, counts, sigma_t=8,
+                                                    d0=50, d1=5)
+
+    def single(self, i):
+        return minimiser.QualityFunction(*self.events[i], sigma_t=8,
+                                         d0=50, d1=5)
+
+    def test_padding(self):
+        assert self.batch.t.shape == (3, 14)
+        assert list(self.batch.n_hits) == [5, 9, 14]
+        assert list(self.batch.mask.sum(axis=1)) == [5, 9, 14]
+
+    def test_call_matches_quality_function(self):
+        values = self.batch(*self.params.T)
+        for i, params in enumerate(self.params):
+            assert np.isclose(values[i], self.single(i)(*params))
+
+    def test_jacobian_matches_grad(self):
+        r, jac = self.batch.residuals_and_jacobian(self.params)
+        grad = 2 * np.einsum('nmi,nm->ni', jac, r)
+        for i, params in enumerate(self.params):
+            assert np.allclose(grad[i], self.single(i).grad(*params))
+
+    def test_subset(self):
+        r, jac = self.batch.residuals_and_jacobian(self.params)
+        r_sub, jac_sub = self.batch.residuals_and_jacobian(self.params[[2]],
+                                                           np.array([2]))
+        assert np.allclose(r[2], r_sub[0])
+        assert np.allclose(jac[2], jac_sub[0])
+
+    def test_time_residuals_only(self):
+        t, z, counts = zip(*self.events)
+        batch = minimiser.BatchQualityFunction(t, z, counts, sigma_t=1,
+                                               amplitude=False)
+        r, jac = batch.residuals_and_jacobian(self.params)
+        full_r, full_jac = self.batch.residuals_and_jacobian(self.params)
+        n_max = batch.t.shape[1]
+        assert r.shape == (3, n_max)
+        assert np.allclose(8 * full_r[:, :n_max], r)
+        assert np.allclose(8 * full_jac[:, :n_max], jac)
+        values = batch(*self.params.T)
+        for i, params in enumerate(self.params):
+            string = minimiser.SingleStringParameters(*self.events[i])
+            expected = np.sum((string.T_gamma(*params) - self.events[i][0])**2)
+            assert np.isclose(expected, values[i])
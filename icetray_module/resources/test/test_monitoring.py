@@ -0,0 +1,91 @@
+# coding=utf-8
+# Filename: test_monitoring.py
+"""
+Description.
+
+"""
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+import json
+import socket
+
+from royfit.monitoring import DatagramSender
+
+
+class UDPServer(object):
+    """A local stand-in for the ROyWeb server"""
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.settimeout(2)
+        self.address = self.socket.getsockname()
+
+    def receive(self, n_messages):
+        """Return the datagrams until n_messages were received"""
+        datagrams = []
+        while sum(len(datagram) for datagram in datagrams) < n_messages:
+            data, _ = self.socket.recvfrom(65536)
+            datagrams.append(json.loads(data.decode('utf-8')))
+        return datagrams
+
+    def close(self):
+        self.socket.close()
+
+
+def parameters(event_number, n_parameters=3):
+    return [{'kind': 'parameter', 'type': 'Zenith{0}'.format(i),
+             'value': i * 0.5, 'event_number': event_number}
+            for i in range(n_parameters)]
+
+
+class TestDatagramSender(object):
+    def setup_method(self, method):
+        self.server = UDPServer()
+
+    def teardown_method(self, method):
+        self.server.close()
+
+    def test_frame_parameters_are_sent_in_one_datagram(self):
+        sender = DatagramSender(self.server.address)
+        sender.send(parameters(1))
+        datagrams = self.server.receive(3)
+        sender.close()
+        assert parameters(1) == datagrams[0]
+        assert 3 == sender.sent
+
+    def test_batch_interval_combines_frames(self):
+        sender = DatagramSender(self.server.address, batch_interval=0.3)
+        for event_number in range(5):
+            sender.send(parameters(event_number))
+        datagrams = self.server.receive(15)
+        sender.close()
+        assert 1 == len(datagrams)
+        assert 1 == sender.datagrams
+        assert [4] * 3 == [p['event_number'] for p in datagrams[0][-3:]]
+
+    def test_datagram_size_is_limited(self):
+        sender = DatagramSender(self.server.address, batch_interval=0.3,
+                                max_datagram_size=500)
+        sender.send(parameters(1, n_parameters=20))
+        datagrams = self.server.receive(20)
+        sender.close()
+        assert len(datagrams) > 1
+        assert parameters(1, n_parameters=20) == sum(datagrams, [])
+
+    def test_full_queue_drops_messages(self):
+        sender = DatagramSender(self.server.address, max_queue=2,
+                                batch_interval=0.5)
+        results = [sender.send(parameters(event_number))
+                   for event_number in range(1000)]
+        sender.close()
+        assert not all(results)
+        assert 3 * results.count(False) == sender.dropped
+        assert 3000 == sender.sent + sender.dropped
+
+    def test_close_sends_queued_messages(self):
+        sender = DatagramSender(self.server.address, batch_interval=10)
+        sender.send(parameters(1))
+        sender.close()
+        assert 3 == sender.sent
+        assert 1 == len(self.server.receive(3))
@@ -0,0 +1,87 @@
+# coding=utf-8
+# Filename: test_output.py
+"""
+Description.
+
+"""
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+
+from royfit.output import FIT_DTYPE, FitWriter, read_fits
+
+
+class TestFitWriter(object):
+    def setup_method(self, method):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'fits.npy')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_events(self, writer, events):
+        for event in events:
+            writer.write(event=event, valid=event % 2, reco_zenith=event / 2.)
+
+    def test_rows_are_written_in_chunks(self):
+        writer = FitWriter(self.filename, flush_every=3)
+        self.write_events(writer, range(5))
+        assert 3 == len(read_fits(self.filename))
+        writer.close()
+        fits = read_fits(self.filename)
+        assert 5 == len(fits)
+        assert list(range(5)) == fits['event'].tolist()
+        assert [False, True, False, True, False] == fits['valid'].tolist()
+        assert np.allclose(np.arange(5) / 2., fits['reco_zenith'])
+
+    def test_missing_fields_are_nan(self):
+        with FitWriter(self.filename) as writer:
+            writer.write(event=1)
+        assert np.isnan(read_fits(self.filename)['dc'][0])
+
+    def test_file_can_be_loaded_by_numpy(self):
+        with FitWriter(self.filename, flush_every=2) as writer:
+            self.write_events(writer, range(7))
+        fits = np.load(self.filename, mmap_mode='r')
+        assert FIT_DTYPE == fits.dtype
+        assert list(range(7)) == fits['event'].tolist()
+
+    def test_empty_file(self):
+        FitWriter(self.filename).close()
+        fits = read_fits(self.filename)
+        assert 0 == len(fits)
+        assert FIT_DTYPE == fits.dtype
+
+    def test_read_without_mmap(self):
+        with FitWriter(self.filename) as writer:
+            self.write_events(writer, range(4))
+        fits = read_fits(self.filename, mmap=False)
+        assert not isinstance(fits, np.memmap)
+        assert list(range(4)) == fits['event'].tolist()
+
+    def test_append(self):
+        with FitWriter(self.filename) as writer:
+            self.write_events(writer, range(3))
+        with FitWriter(self.filename, append=True) as writer:
+            self.write_events(writer, range(3, 5))
+        assert list(range(5)) == read_fits(self.filename)['event'].tolist()
+
+    def test_append_drops_incomplete_chunk(self):
+        with FitWriter(self.filename) as writer:
+            self.write_events(writer, range(3))
+        with open(self.filename, 'ab') as file:
+            file.write(b'\x00' * 5)
+        with FitWriter(self.filename, append=True) as writer:
+            self.write_events(writer, [3])
+        assert list(range(4)) == read_fits(self.filename)['event'].tolist()
+
+    def test_append_to_foreign_file_raises(self):
+        np.save(self.filename, np.zeros(3, dtype=FIT_DTYPE))
+        with pytest.raises(ValueError):
+            FitWriter(self.filename, append=True)
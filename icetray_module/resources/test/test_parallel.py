@@ -0,0 +1,75 @@
+# coding=utf-8
+# Filename: test_parallel.py
+"""
+Description.
+
+"""
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+from royfit.parallel import shard_ranges, merge_stats, run_shards
+from royfit.results import ZenithResolution
+
+
+def fake_worker(shard):
+    """Stats like the ROyFitter would collect for the events in the shard"""
+    start, stop = shard
+    events = list(range(start, stop))
+    return {'fit_parameters': {'d0': 50},
+            'mc_zenith': [float(i) for i in events if i % 2],
+            'number_of_events': len(events),
+            'number_of_vaild_fits': len([i for i in events if i % 2])}
+
+
+class TestShardRanges(object):
+    def test_ranges_cover_the_index_range(self):
+        shards = shard_ranges(1, 100, 4)
+        assert 4 == len(shards)
+        assert 1 == shards[0][0]
+        assert 100 == shards[-1][1]
+        for (_, stop), (start, _) in zip(shards[:-1], shards[1:]):
+            assert stop == start
+
+    def test_shards_are_balanced(self):
+        sizes = [stop - start for start, stop in shard_ranges(0, 10, 3)]
+        assert 10 == sum(sizes)
+        assert max(sizes) - min(sizes) <= 1
+
+    def test_no_empty_shards(self):
+        assert [(0, 1), (1, 2)] == shard_ranges(0, 2, 8)
+
+
+class TestMergeStats(object):
+    def test_lists_are_concatenated_in_shard_order(self):
+        stats = merge_stats([{'mc_zenith': [1, 2]}, {'mc_zenith': [3]}])
+        assert [1, 2, 3] == stats['mc_zenith']
+
+    def test_counters_are_added(self):
+        stats = merge_stats([{'number_of_events': 2},
+                             {'number_of_events': 3}])
+        assert 5 == stats['number_of_events']
+
+    def test_fit_parameters_from_first_shard(self):
+        stats = merge_stats([{'fit_parameters': {'d0': 1}},
+                             {'fit_parameters': {'d0': 2}}])
+        assert {'d0': 1} == stats['fit_parameters']
+
+    def test_histograms_are_merged(self):
+        shards = [{'zenith_resolution': ZenithResolution()}
+                  for _ in range(2)]
+        shards[0]['zenith_resolution'].fill(10, 12)
+        shards[1]['zenith_resolution'].fill([20, 30], [21, 29])
+        stats = merge_stats(shards)
+        assert 3 == len(stats['zenith_resolution'])
+        assert 1 == len(shards[0]['zenith_resolution'])
+
+
+class TestRunShards(object):
+    def test_result_does_not_depend_on_the_number_of_workers(self):
+        serial = fake_worker((1, 100))
+        for n_workers in (1, 2, 3):
+            assert serial == run_shards(fake_worker, 1, 100, n_workers)
+
+    def test_more_shards_than_workers(self):
+        stats = run_shards(fake_worker, 0, 50, n_workers=2, n_shards=7)
+        assert fake_worker((0, 50)) == stats
@@ -0,0 +1,221 @@
+# coding=utf-8
+# Filename: test_results.py
+"""
+Description.
+
+"""
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+
+from royfit.output import FitWriter
+from royfit.results import Results, ZenithResolution, binned_percentiles
+
+
+def write_fits(filename, mc_zenith, reco_zenith, quality, dc, valid):
+    with FitWriter(filename, flush_every=4) as writer:
+        for i, row in enumerate(zip(mc_zenith, reco_zenith, quality, dc,
+                                    valid)):
+            writer.write(event=i, mc_zenith=row[0], reco_zenith=row[1],
+                         quality_parameter=row[2], dc=row[3], valid=row[4])
+
+
+class TestResults(object):
+    def setup_method(self, method):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filenames = [os.path.join(self.tmp_dir, 'run_{0}.npy'.format(i))
+                          for i in range(2)]
+        write_fits(self.filenames[0], [10, 20, 30], [12, 19, 30],
+                   [1, 2, 3], [10, 50, 90], [True, True, False])
+        write_fits(self.filenames[1], [100, 110], [95, 111],
+                   [5, 0.5], [20, 30], [True, True])
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_open_concatenates_runs(self):
+        results = Results.open(self.filenames)
+        assert 5 == len(results)
+        assert 2 == len(results.chunks)
+        assert isinstance(results.chunks[0], np.memmap)
+        assert [10, 20, 30, 100, 110] == results['mc_zenith'].tolist()
+
+    def test_angular_error(self):
+        results = Results.open(self.filenames[0])
+        assert [-2, 1, 0] == results.column('angular_error').tolist()
+
+    def test_add(self):
+        results = Results.open(self.filenames[0]) + \
+            Results.open(self.filenames[1]).cut(max_quality=2)
+        assert [10, 20, 30, 110] == results['mc_zenith'].tolist()
+
+    def test_line_cut(self):
+        with FitWriter(self.filenames[0]) as writer:
+            for line, zenith in ((1, 10), (2, 20), (-1, 15)):
+                writer.write(event=0, line=line, valid=True,
+                             mc_zenith=zenith)
+        results = Results.open(self.filenames[0])
+        assert [15] == results.cut(line=-1)['mc_zenith'].tolist()
+        assert [20] == results.cut(line=2)['mc_zenith'].tolist()
+
+    def test_cuts(self):
+        results = Results.open(self.filenames)
+        assert 4 == len(results.cut())
+        assert 5 == len(results.cut(valid=None))
+        assert [10, 20, 110] == \
+            results.cut(max_quality=3)['mc_zenith'].tolist()
+        assert [20, 110] == \
+            results.cut(min_dc=25, max_dc=60)['mc_zenith'].tolist()
+
+    def test_cuts_are_combined(self):
+        results = Results.open(self.filenames).cut(max_quality=3)
+        assert [20, 110] == results.cut(min_dc=15)['mc_zenith'].tolist()
+
+    def test_select(self):
+        results = Results.open(self.filenames)
+        selected = results.select(lambda fits: fits['mc_zenith'] > 25)
+        assert [30, 100, 110] == selected['mc_zenith'].tolist()
+
+    def test_zenith_resolution(self):
+        results = Results.open(self.filenames).cut(valid=None)
+        counts, resolution = results.zenith_resolution([0, 50, 90, 180],
+                                                       percentiles=(50,))
+        assert [3, 0, 2] == counts.tolist()
+        assert 0 == resolution[0, 0]
+        assert np.isnan(resolution[1, 0])
+        assert 2 == resolution[2, 0]
+
+    def test_binned_zenith_resolution(self):
+        random = np.random.RandomState(1)
+        mc_zenith = random.uniform(0, 180, 10000)
+        results = Results.from_stats({
+            'mc_zenith': mc_zenith,
+            'reco_zenith': mc_zenith + random.normal(0, 5, 10000)})
+        counts, resolution = results.zenith_resolution(
+            [0, 50, 90, 180], error_bins=3600)
+        exact_counts, exact = results.zenith_resolution([0, 50, 90, 180])
+        assert exact_counts.tolist() == counts.tolist()
+        assert np.allclose(exact, resolution, atol=0.1)
+
+    def test_histogram_in_blocks(self):
+        results = Results.open(self.filenames).cut(max_dc=1000)
+        histogram = results.histogram(block_size=2)
+        assert len(results) == len(histogram)
+        counts, _, _ = np.histogram2d(results['mc_zenith'],
+                                      results['reco_zenith'],
+                                      bins=histogram.zenith_bins)
+        assert counts.tolist() == histogram.counts.tolist()
+
+    def test_from_stats(self):
+        stats = {'mc_zenith': [1., 2.], 'reco_zenith': [1.5, 2.5],
+                 'dc': [3., 4.], 'angular_error': [-0.5, -0.5],
+                 'number_of_events': 10}
+        results = Results.from_stats(stats)
+        assert 2 == len(results)
+        assert [-0.5, -0.5] == results['angular_error'].tolist()
+        assert all(results['valid'])
+
+
+class TestBinnedPercentiles(object):
+    def test_same_as_numpy(self):
+        random = np.random.RandomState(1)
+        bin_index = random.randint(0, 5, 1000)
+        values = random.normal(size=1000)
+        percentiles = (5, 16, 50, 84, 95)
+        counts, result = binned_percentiles(bin_index, values, 6,
+                                            percentiles)
+        assert np.bincount(bin_index, minlength=6).tolist() == \
+            counts.tolist()
+        for i in range(5):
+            assert np.allclose(np.percentile(values[bin_index == i],
+                                             percentiles), result[i])
+        assert np.all(np.isnan(result[5]))
+
+
+class TestZenithResolution(object):
+    def setup_method(self, method):
+        random = np.random.RandomState(1)
+        self.mc_zenith = random.uniform(0, 180, 10000)
+        self.reco_zenith = np.clip(self.mc_zenith +
+                                   random.normal(0, 3, 10000), 0, 180)
+
+    def test_percentiles_are_close_to_numpy(self):
+        resolution = ZenithResolution(zenith_bins=[0, 90, 180])
+        resolution.fill(self.mc_zenith, self.reco_zenith)
+        counts, result = resolution.percentiles((16, 50, 84))
+        error = self.mc_zenith - self.reco_zenith
+        for i, selection in enumerate((self.mc_zenith < 90,
+                                       self.mc_zenith >= 90)):
+            assert np.count_nonzero(selection) == counts[i]
+            assert np.allclose(np.percentile(error[selection], (16, 50, 84)),
+                               result[i], atol=0.1)
+
+    def test_absolute_percentiles(self):
+        resolution = ZenithResolution(zenith_bins=[0, 180])
+        resolution.fill(self.mc_zenith, self.reco_zenith)
+        _, result = resolution.percentiles((50,), absolute=True)
+        error = np.abs(self.mc_zenith - self.reco_zenith)
+        assert np.percentile(error, 50) == pytest.approx(result[0, 0],
+                                                         abs=0.1)
+
+    def test_counts_match_histogram2d(self):
+        resolution = ZenithResolution()
+        for mc_zenith, reco_zenith in zip(self.mc_zenith[:100],
+                                          self.reco_zenith[:100]):
+            resolution.fill(mc_zenith, reco_zenith)
+        counts, _, _ = np.histogram2d(self.mc_zenith[:100],
+                                      self.reco_zenith[:100],
+                                      bins=resolution.zenith_bins)
+        assert counts.tolist() == resolution.counts.tolist()
+        assert 100 == len(resolution)
+
+    def test_values_outside_the_bins_are_ignored(self):
+        resolution = ZenithResolution()
+        resolution.fill([-1, 190, np.nan, 180], [10, 10, 10, 180])
+        assert 1 == len(resolution)
+        assert 1 == resolution.counts[-1, -1]
+        _, result = resolution.percentiles((50,))
+        assert np.isnan(result[0, 0])
+
+    def test_single_fills_match_array_fill(self):
+        mc_zenith = np.r_[self.mc_zenith[:200], -1, 180, 190, np.nan, 90]
+        reco_zenith = np.r_[self.reco_zenith[:200], 10, 180, 10, 10, np.nan]
+        single, array = ZenithResolution(), ZenithResolution()
+        for mc, reco in zip(mc_zenith, reco_zenith):
+            single.fill(mc, reco)
+        array.fill(mc_zenith, reco_zenith)
+        assert array.counts.tolist() == single.counts.tolist()
+        assert array.error_counts.tolist() == single.error_counts.tolist()
+
+    def test_merge(self):
+        first, second, both = (ZenithResolution() for _ in range(3))
+        first.fill(self.mc_zenith[:500], self.reco_zenith[:500])
+        second.fill(self.mc_zenith[500:], self.reco_zenith[500:])
+        both.fill(self.mc_zenith, self.reco_zenith)
+        merged = first + second
+        assert 500 == len(first)
+        assert both.counts.tolist() == merged.counts.tolist()
+        assert both.error_counts.tolist() == merged.error_counts.tolist()
+
+    def test_merge_different_bins_raises(self):
+        with pytest.raises(ValueError):
+            ZenithResolution(90).merge(ZenithResolution(18))
+
+    def test_save_and_load(self):
+        resolution = ZenithResolution(18)
+        resolution.fill(self.mc_zenith, self.reco_zenith)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp_dir, 'resolution.npz')
+            resolution.save(filename)
+            loaded = ZenithResolution.load(filename)
+        finally:
+            shutil.rmtree(tmp_dir)
+        assert resolution.zenith_bins.tolist() == loaded.zenith_bins.tolist()
+        assert resolution.counts.tolist() == loaded.counts.tolist()
@@ -0,0 +1,128 @@
+# coding=utf-8
+# Filename: test_solvers.py
+"""
+Description.
+
+"""
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+import numpy as np
+import pytest
+
+from royfit import minimiser
+from royfit.solvers import levenberg_marquardt
+
+
+def linear_residuals(x, y):
+    """Residuals and Jacobians for fitting y = a*x + b to each event"""
+    def func(params, index):
+        a, b = params[:, :1], params[:, 1:]
+        residuals = a * x[index] + b - y[index]
+        jac = np.stack((x[index], np.ones_like(x[index])), axis=-1)
+        return residuals, jac
+    return func
+
+
+def quality_function_events(n_events, sigma=2.):
+    """Hit times (with Gaussian noise), z and hit counts of single lines"""
+    events = []
+    for seed in range(n_events):
+        random = np.random.RandomState(seed)
+        z = np.linspace(0, 150, 12)
+        string = minimiser.SingleStringParameters(np.zeros(12), z,
+                                                  np.ones(12))
+        t = string.T_gamma(-0.5, 60., 25., 100.)
+        events.append((t + random.normal(0, sigma, 12), z,
+                       random.randint(1, 4, 12)))
+    return events
+
+
+def minuit_fit(quality_function, p0, lower, upper):
+    """MIGRAD minimum (fval, values, is_valid) with iminuit 1.x or 2.x"""
+    iminuit = pytest.importorskip('iminuit')
+    names = ('uz', 'zc', 'dc', 'tc')
+    if hasattr(iminuit.Minuit, 'from_array_func'):
+        kwargs = dict(zip(names, p0))
+        kwargs.update(('limit_' + name, (low, high))
+                      for name, low, high in zip(names, lower, upper))
+        fitter = iminuit.Minuit(quality_function, errordef=1, print_level=0,
+                                **kwargs)
+        fitter.migrad()
+        is_valid = fitter.get_fmin().is_valid
+    else:
+        fitter = iminuit.Minuit(quality_function, *p0, name=names)
+        fitter.errordef = 1
+        fitter.limits = list(zip(lower, upper))
+        fitter.migrad()
+        is_valid = fitter.valid
+    return fitter.fval, [fitter.values[name] for name in names], is_valid
+
+
+class TestLevenbergMarquardt(object):
+    def test_linear_problems(self):
+        x = np.tile(np.arange(10.), (3, 1))
+        y = np.array([[2.], [-1.], [0.5]]) * x + np.array([[1.], [3.], [0.]])
+        result = levenberg_marquardt(linear_residuals(x, y), np.zeros((3, 2)),
+                                     tol=1e-9)
+        assert np.all(result.converged)
+        assert np.allclose(result.params, [[2, 1], [-1, 3], [0.5, 0]],
+                           atol=1e-4)
+
+    def test_limits(self):
+        x = np.arange(10.)[np.newaxis, :]
+        y = 2 * x + 1
+        result = levenberg_marquardt(linear_residuals(x, y), [[0., 0.]],
+                                     lower=[-10, -10], upper=[1.5, 10],
+                                     tol=1e-9)
+        assert result.converged[0]
+        assert result.params[0, 0] == 1.5
+        assert np.isclose(result.params[0, 1], 1 + 0.5 * np.mean(x))
+
+    def test_no_improvement_is_stuck_not_converged(self):
+        x = np.arange(10.)[np.newaxis, :]
+        y = 2 * x + 1
+
+        def wrong_jacobian(params, index):
+            residuals, jac = linear_residuals(x, y)(params, index)
+            return residuals, -jac
+
+        result = levenberg_marquardt(wrong_jacobian, [[0., 0.]])
+        assert result.stuck[0]
+        assert not result.converged[0]
+
+    def test_quality_function_batch_matches_single_fits(self):
+        events = quality_function_events(4)
+        t, z, counts = zip(*events)
+        batch = minimiser.BatchQualityFunction(t, z, counts, sigma_t=8)
+        p0 = np.tile([-0.75, 75., 20., 90.], (4, 1))
+        lower, upper = [-1, 0, 2, -np.inf], [1, 150, 100, np.inf]
+        result = levenberg_marquardt(batch.residuals_and_jacobian, p0,
+                                     lower, upper, tol=1e-6)
+        assert np.all(result.converged)
+        for i, event in enumerate(events):
+            single = minimiser.BatchQualityFunction(*[[e] for e in event],
+                                                    sigma_t=8)
+            single_result = levenberg_marquardt(single.residuals_and_jacobian,
+                                                p0[:1], lower, upper,
+                                                tol=1e-6)
+            assert np.allclose(result.params[i], single_result.params[0])
+            quality_function = minimiser.QualityFunction(*event, sigma_t=8)
+            grad = quality_function.grad(*result.params[i])
+            assert np.allclose(grad, 0, atol=1e-2)
+
+    def test_same_minimum_as_minuit(self):
+        events = quality_function_events(10, sigma=4.)
+        t, z, counts = zip(*events)
+        batch = minimiser.BatchQualityFunction(t, z, counts, sigma_t=8)
+        p0 = np.tile([-0.75, 75., 20., 90.], (len(events), 1))
+        lower, upper = [-1, 0, 2, -np.inf], [1, 150, 100, np.inf]
+        result = levenberg_marquardt(batch.residuals_and_jacobian, p0,
+                                     lower, upper)
+        for i, event in enumerate(events):
+            quality_function = minimiser.QualityFunction(*event, sigma_t=8)
+            fval, values, is_valid = minuit_fit(quality_function, p0[i],
+                                                lower, upper)
+            assert is_valid == result.converged[i]
+            assert fval == pytest.approx(result.cost[i], abs=0.01)
+            assert values[0] == pytest.approx(result.params[i, 0], abs=0.01)
@@ -5,6 +5,9 @@ Restless Oyster Fit: Fast muon reconstruction for KM3NeT.
 
 """
 from __future__ import division, absolute_import, print_function
+import importlib
+import sys
+
 from royfit.__version__ import version, version_info
 
 __author__ = "Tamas Gal"
@@ -17,10 +20,46 @@ __maintainer__ = "Tamas Gal"
 __email__ = "tgal@km3net.de"
 __status__ = "Development"
 
+# The public names are imported on first access, so importing the package
+# (e.g. in every worker process) does not pull in km3pipe, iminuit and
+# matplotlib. Missing dependencies raise when the name is accessed.
+# Python < 3.7 has no module __getattr__ (PEP 562), there the names are
+# imported eagerly and import errors are only printed, as before.
+_LAZY_ATTRIBUTES = {'ZTPlotter': 'royfit.core',
+                    'T3HitSelector': 'royfit.core',
+                    'TOTFilter': 'royfit.core',
+                    'OMRawHitMerger': 'royfit.core',
+                    'FirstOMHitFilter': 'royfit.core',
+                    'ROyFitter': 'royfit.core',
+                    'LiveMonitor': 'royfit.core',
+                    'QualityFunction': 'royfit.minimiser',
+                    'fit_events': 'royfit.fitting'}
+
+__all__ = sorted(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    try:
+        module_name = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError("module 'royfit' has no attribute '{0}'"
+                             .format(name))
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
 
-try:
-    from royfit.core import (ZTPlotter, T3HitSelector, TOTFilter,
-                             OMRawHitMerger, FirstOMHitFilter, ROyFitter)
-    from royfit.minimiser import QualityFunction
-except ImportError as e:
-    print(e)
+if sys.version_info < (3, 7):
+    for _module_name in sorted(set(_LAZY_ATTRIBUTES.values())):
+        try:
+            _module = importlib.import_module(_module_name)
+        except ImportError as e:
+            print(e)
+            continue
+        for _name, _attribute_module in _LAZY_ATTRIBUTES.items():
+            if _attribute_module == _module_name:
+                globals()[_name] = getattr(_module, _name)
@@ -7,32 +7,71 @@ The core of the  Restless Oyster (Muon) Fit.
 """
 from __future__ import division, absolute_import, print_function
 import math
-import operator
 import pickle
 
 import numpy as np
-import matplotlib.pyplot as plt
 
 from km3pipe import Module
 from km3pipe.dataclasses import Position
 from km3pipe.tools import unit_vector, angle_between
-from km3pipe import constants
 from km3pipe.logger import logging
 
 log = logging.getLogger(__name__)  # pylint: disable=C0103
 
-from .minimiser import QualityFunction
+from .fitting import default_seed, fit_events, combine_lines
+from .geometry import geometry_cache, get_pmt_table
+from .instrumentation import StageStats, instrumented
+from .hits import (HitSeries, as_hit_series, first_om_hits, t3_hits,
+                   merge_om_hits, split_by_line)
+from .minimiser import (QualityFunction, ProfiledQualityFunction,
+                        ZcScanQualityFunction, grid_seeds, n, c)
+from .output import FitWriter
+from .results import ZenithResolution
 
 import iminuit as minuit
 
 
-n = 1.3797
-c = constants.c / 1e9
+# parameters which are not fitted by Minuit, for the profile option
+PROFILED_PARAMETERS = {None: (), 'tc': ('tc',), 'zc': ('tc', 'zc')}
 
-class ZTPlotter(Module):
+class RoyfitModule(Module):
+    """Base class of the royfit modules.
+
+    Each module records the timing and hit counts of process() in
+    self.stage (a StageStats) and prints a summary at finish(). Set
+    instrument=False to switch this off and verbose=False to suppress the
+    printing in process().
+
+    """
+    def __init__(self, **context):
+        super(RoyfitModule, self).__init__(**context)
+        self.verbose = self.get('verbose') is not False
+        self.stage = None
+        if self.get('instrument') is not False:
+            name = getattr(self, 'name', None) or self.__class__.__name__
+            self.stage = StageStats(name)
+
+    def finish(self):
+        if self.stage is not None:
+            print(self.stage.summary())
+
+    def _fill(self, name, value):
+        """Fill a histogram of the stage, if instrumented"""
+        if self.stage is not None:
+            self.stage.fill(name, value)
+
+    def _count(self, name, n=1):
+        """Increment a counter of the stage, if instrumented"""
+        if self.stage is not None:
+            self.stage.count(name, n)
+
+
+class ZTPlotter(RoyfitModule):
     """A z-t-plotter"""
     #TODO: rewrite me, I'm hard coded!
+    @instrumented(input_key=None, output_key=None)
     def process(self, blob):
+        import matplotlib.pyplot as plt
         mc_track = blob['TrackIns'][0]
         self.plot_hyperbola(mc_track)
 
@@ -61,123 +100,102 @@ class ZTPlotter(Module):
         return blob
 
     def scatter(self, hits, color='blue', size=10, alpha=1.0, marker='o', label=None):
+        import matplotlib.pyplot as plt
         times, zs = self.get_zt_points(hits)
         plt.scatter(times, zs, s=size, c=color, alpha=alpha, marker=marker, label=label)
 
     def get_zt_points(self, hits):
-        times = [hit.time for hit in hits]
-        zs = []
-        for hit in hits:
-            pmt = self.detector.pmt_with_id(hit.pmt_id)
-            zs.append(pmt.pos.z)
-        return times, zs
+        hits = as_hit_series(hits, get_pmt_table(self.detector))
+        return hits.time, hits.z
 
     def plot_hyperbola(self, particle):
-        Lx, Ly, _ = self.detector.dom_positions[0]
-        ux, uy, uz = particle.dir
-        t0 = particle.time
-        zc = self.point_of_closest_approach(particle)
-        tc = t0 + 1/c * (Lx*ux + Ly*uy + zc*uz - particle.pos.dot(particle.dir))
-        dc = self.distance_to_line(particle, tc)
-
-        print("MC truth: zc={0}, dc={1}, tc={2}, uz={3}".format(zc, dc, tc, uz))
-
+        import matplotlib.pyplot as plt
+        zc, dc, tc = self.closest_approach(particle)
+        uz = particle.dir[2]
 
+        if self.verbose:
+            print("MC truth: zc={0}, dc={1}, tc={2}, uz={3}".format(zc, dc, tc, uz))
 
-        zs = range(-200, 1000)
-        Lx, Ly, _ = self.detector.dom_positions[0]
-        tgamma = self.cherenkov_time_for_particle
-        tgammas = [tgamma(particle, Lx, Ly, z) for z in zs]
+        zs = np.arange(-200, 1000)
+        Lx, Ly = self.line_position()
+        tgammas = self.cherenkov_time_for_particle(particle, Lx, Ly, zs)
         plt.scatter(tgammas, zs, s=0.3)
 
+    def line_position(self):
+        """(Lx, Ly) of the first line, from the shared geometry cache"""
+        cache = geometry_cache(self.detector)
+        return cache.line_positions[cache.lines[0]]
 
-
-    def cherenkov_time_for_particle(self, particle, x, y, z):
-        Lx, Ly, _ = self.detector.dom_positions[0]
+    def closest_approach(self, particle):
+        """(zc, dc, tc) of the particle with respect to the line"""
+        Lx, Ly = self.line_position()
         ux, uy, uz = particle.dir
         t0 = particle.time
         zc = self.point_of_closest_approach(particle)
         tc = t0 + 1/c * (Lx*ux + Ly*uy + zc*uz - particle.pos.dot(particle.dir))
         dc = self.distance_to_line(particle, tc)
-        dgamma = n/math.sqrt(n**2 - 1) * math.sqrt(dc**2 + (z - zc)**2 * (1 - uz**2))
+        return zc, dc, tc
+
+    def cherenkov_time_for_particle(self, particle, x, y, z):
+        """The arrival time of the Cherenkov photons at z (also an array)"""
+        uz = particle.dir[2]
+        zc, dc, tc = self.closest_approach(particle)
+        dgamma = n/math.sqrt(n**2 - 1) * np.sqrt(dc**2 + (z - zc)**2 * (1 - uz**2))
         tgamma = (tc - particle.time) + 1/c*((z - zc)*uz + (n**2 - 1)/n * dgamma)
         return tgamma
 
     def point_of_closest_approach(self, particle):
-        Lx, Ly, _ = self.detector.dom_positions[0]
+        Lx, Ly = self.line_position()
         _, _, qz = particle.pos
         ux, uy, uz = particle.dir
         zc = (qz - uz*(particle.pos.dot(particle.dir)) + uz*(Lx*ux + Ly*uy)) / (1 - uz**2)
         return zc
 
     def distance_to_line(self, particle, tc):
-        Lx, Ly, _ = self.detector.dom_positions[0]
+        Lx, Ly = self.line_position()
         p_tc = particle.pos + c*(tc - particle.time)*Position(particle.dir)
         dc = math.sqrt((p_tc.x - Lx)**2 + (p_tc.y - Ly)**2)
         return dc
 
 
-class T3HitSelector(Module):
+class T3HitSelector(RoyfitModule):
     """Creates a list of hits which contribute to a T3 definition.
 
     T3 is defined by the coincidence of two hits on adjacent or
     next-to-adjacent OMs within a given time window.
-    
+
+    The neighbourhood can be extended to +-depth floors with the time
+    windows given in time_windows (one per floor distance). Floor distances
+    without an explicit window use distance * adjacent_t.
+
     """
     def __init__(self, **context):
         super(self.__class__, self).__init__(**context)
         self.adjacent_t = self.get('adjacent_t') or 200
-        self.next_to_adjacent_t = self.get('next_to_adjacent') or 400
+        self.next_to_adjacent_t = self.get('next_to_adjacent_t') or \
+            self.get('next_to_adjacent') or 400
+        self.time_windows = list(self.get('time_windows') or
+                                 [self.adjacent_t, self.next_to_adjacent_t])
+        depth = self.get('depth') or len(self.time_windows)
+        self.time_windows = self.time_windows[:depth] + \
+            [d * self.adjacent_t
+             for d in range(len(self.time_windows) + 1, depth + 1)]
         self.input_hits = self.get('input_hits') or 'FirstOMHits'
         self.candidate_hits = self.get('candidate_hits') or 'EvtRawHits'
         self.output_hits = self.get('output_hits') or 'T3Hits'
 
+    @instrumented()
     def process(self, blob):
-        om_hits = sort_hits_by_om(blob[self.input_hits], self.detector)
-        candidate_hits = blob[self.candidate_hits]
-        om_candidate_hits = sort_hits_by_om(candidate_hits, self.detector)
-        selected_hits = []
-        skip_pmtids = []
-        for om, hits in om_hits.iteritems():
-            hit = hits[0]
-
-            hits_above = om_candidate_hits.get((om[0], om[1]+1))
-            hits_below = om_candidate_hits.get((om[0], om[1]-1))
-            adjacent_hits = []
-            if hits_above: adjacent_hits += hits_above
-            if hits_below: adjacent_hits += hits_below
-
-            hits_next_to_above = om_candidate_hits.get((om[0], om[1]+2))
-            hits_next_to_below = om_candidate_hits.get((om[0], om[1]-2))
-            next_to_adjacent_hits = []
-            if hits_next_to_above: next_to_adjacent_hits += hits_next_to_above
-            if hits_next_to_below: next_to_adjacent_hits += hits_next_to_below
-
-            for adjacent_hit in adjacent_hits:
-                if 0 <= adjacent_hit.time - hit.time <= self.adjacent_t:
-                    if not adjacent_hit.pmt_id in skip_pmtids:
-                        selected_hits.append(adjacent_hit)
-                        skip_pmtids.append(adjacent_hit.pmt_id)
-                    if not hit.pmt_id in skip_pmtids:
-                        selected_hits.append(hit)
-                        skip_pmtids.append(hit.pmt_id)
-
-            for adjacent_hit in next_to_adjacent_hits:
-                if 0 <= adjacent_hit.time - hit.time <= self.next_to_adjacent_t:
-                    if not adjacent_hit.pmt_id in skip_pmtids:
-                        selected_hits.append(adjacent_hit)
-                        skip_pmtids.append(adjacent_hit.pmt_id)
-                    if not hit.pmt_id in skip_pmtids:
-                        selected_hits.append(hit)
-                        skip_pmtids.append(hit.pmt_id)
-
-
-        blob[self.output_hits] = selected_hits
+        hits = hit_series(blob, self.input_hits, self.detector)
+        candidate_hits = hit_series(blob, self.candidate_hits, self.detector)
+        neighbours = geometry_cache(self.detector).neighbour_floors(
+            len(self.time_windows))
+        blob[self.output_hits] = t3_hits(hits, candidate_hits,
+                                         self.time_windows, neighbours)
         return blob
 
 
-
-class TOTFilter(Module):
+class TOTFilter(RoyfitModule):
     """Only keeps hits with at least min_tot"""
     def __init__(self, **context):
         super(self.__class__, self).__init__(**context)
@@ -185,83 +203,110 @@ class TOTFilter(Module):
         self.input_hits = self.get('input_hits') or 'EvtRawHits'
         self.output_hits = self.get('output_hits') or 'LongToTHits'
 
+    @instrumented()
     def process(self, blob):
-        hits = blob[self.input_hits]
-        filtered_hits = [hit for hit in hits if hit.tot >= self.min_tot]
-        blob[self.output_hits] = filtered_hits
-        print("Number of long tot hits: " + str(len(filtered_hits)))
+        hits = hit_series(blob, self.input_hits, self.detector)
+        blob[self.output_hits] = hits[hits.tot >= self.min_tot]
         return blob
 
 
-class OMRawHitMerger(Module):
+class OMRawHitMerger(RoyfitModule):
     """Merges hits on the same OM within a given time window.
 
-    Each merged hit gets the id, pmt_id and time of the earliest contributed
-    hit. The time-over-threshold values are added.
-    
+    Hits on an OM belong to the same cluster as long as the time difference
+    to the previous hit is not larger than time_window. Each merged hit gets
+    the id, pmt_id and time of the earliest contributed hit. The
+    time-over-threshold values are added. Clusters with only one hit are
+    kept unless keep_singletons is set to False.
+
     """
     def __init__(self, **context):
         super(self.__class__, self).__init__(**context)
         self.time_window = self.get('time_window') or 10
+        keep_singletons = self.get('keep_singletons')
+        self.keep_singletons = True if keep_singletons is None \
+            else keep_singletons
         self.input_hits = self.get('input_hits') or 'EvtRawHits'
         self.output_hits = self.get('output_hits') or 'MergedEvtRawHits'
 
+    @instrumented()
     def process(self, blob):
-        hits = blob[self.input_hits]
-        hits.sort(key=lambda x: x.time)
+        hits = hit_series(blob, self.input_hits, self.detector)
 
-        print("Number of raw hits: " + str(len(hits)))
+        if self.verbose:
+            print("Number of raw hits: " + str(len(hits)))
 
-        om_hits = sort_hits_by_om(hits, self.detector)
-        merged_hits = self.merge_hits(om_hits)
-        print("Number of merged hits: " + str(len(merged_hits)))
+        merged_hits = merge_om_hits(hits, self.time_window,
+                                    self.keep_singletons)
+        if self.verbose:
+            print("Number of merged hits: " + str(len(merged_hits)))
 
         blob[self.output_hits] = merged_hits
         return blob
 
-    def merge_hits(self, om_hits):
-        """Merge hits on each om and return a flat list"""
-        merged_hits = []
-        for om, hits in om_hits.iteritems():
-            hits_to_merge = None
-            for hit in hits:
-                if not hits_to_merge:
-                    hits_to_merge = [hit]
-                    continue
-                else:
-                    if hit.time - hits_to_merge[-1].time <= self.time_window:
-                        hits_to_merge.append(hit)
-                    else:
-                        if len(hits_to_merge) > 1:
-                            merged_hit = reduce(operator.add, hits_to_merge)
-                            merged_hits.append(merged_hit)
-                        hits_to_merge = [hit]
-        return merged_hits
-
-
-class FirstOMHitFilter(Module):
+
+class FirstOMHitFilter(RoyfitModule):
     """Keeps only the first hit on each OM"""
     def __init__(self, **context):
         super(self.__class__, self).__init__(**context)
         self.input_hits = self.get('input_hits') or 'LongToTHits'
         self.output_hits = self.get('output_hits') or 'FirstOMHits'
 
+    @instrumented()
     def process(self, blob):
-        hits = sorted(blob[self.input_hits], key=lambda x: x.time)
-        first_hits = []
-        skip_oms = []
-        for hit in hits:
-            om = self.detector.pmtid2omkey(hit.pmt_id)[:2]
-            if om in skip_oms:
-                continue
-            first_hits.append(hit)
-            skip_oms.append(om)
-        blob[self.output_hits] = first_hits
+        hits = hit_series(blob, self.input_hits, self.detector)
+        blob[self.output_hits] = first_om_hits(hits)
         return blob
 
 
-class ROyFitter(Module):
-    """Keeps only the first hit on each OM"""
+class ROyFitter(RoyfitModule):
+    """Fits a muon track to the hits of a single line.
+
+    The fit results are collected in self.stats and pickled to stats_file
+    at the end. If output_file is given, the results (including the fits
+    which did not converge, see the valid field) are instead written to an
+    .npy file in chunks of flush_every events, see royfit.output, and only
+    the counters and fit parameters are kept in the stats. With
+    keep_fits=False, the valid fits are not collected in the stats lists
+    either.
+
+    The MC vs reco zenith histograms of the valid fits with line=-1 are
+    always filled and kept in stats['zenith_resolution'], see
+    royfit.results.ZenithResolution, so the resolution of long runs is
+    available with constant memory.
+
+    The solver is either 'minuit' (the default) or 'lm', the bounded
+    Levenberg-Marquardt solver from royfit.solvers with the same limits.
+    With batch_size, the LM solver fits batch_size events at once (the
+    option is not available for Minuit).
+
+    The fit starts at uz=-0.75, dc=20 unless seed_grid = (n_uz, n_dc) is
+    given, then it starts from the n_seeds best points of a grid scan and
+    the best fit is kept. The number of quality function calls is counted
+    in the stats.
+
+    With profile='tc', Minuit only fits (uz, zc, dc) and tc is calculated
+    analytically, with profile='zc' zc is also eliminated by a scan in
+    steps of zc_step, see royfit.minimiser.ProfiledQualityFunction. The
+    option does not affect the LM solver.
+
+    With multi_line=True, the hits are partitioned by line and each line
+    with at least min_hits hits is fitted separately, all lines of the
+    events in a batch in one call of the LM solver. The line fits are
+    combined to a zenith estimate, see royfit.fitting.combine_lines. Each
+    line fit is saved with its line number and the combined fit with
+    line=-1, which is also the line of the fits in single line mode. The
+    valid_fits and number_of_vaild_fits count the combined fits, the line
+    fits are counted as valid_line_fits. The stats lists and
+    blob['ROyFits'] hold both, select line == -1 for event quantities.
+
+    The fits which are finished while processing a blob are also put into
+    blob['ROyFits'] as a list of dicts (for the batched LM solver these
+    are fits of earlier events), e.g. for the LiveMonitor. The fits of the
+    last batch, which are done in finish(), are appended to the list of
+    the last blob.
+
+    """
     def __init__(self, **context):
         super(self.__class__, self).__init__(**context)
         self.input_hits = self.get('input_hits') or 'LongToTHits'
@@ -271,111 +316,152 @@ class ROyFitter(Module):
         self.sigma_t = self.get('sigma_t') or 8
         self.d0 = self.get('d0') or 50
         self.d1 = self.get('d1') or 5
-        self.stats = {}
+        self.batch_size = self.get('batch_size') or 0
+        self.multi_line = bool(self.get('multi_line'))
+        self.solver = self.get('solver') or \
+            ('lm' if self.batch_size or self.multi_line else 'minuit')
+        if self.solver not in ('minuit', 'lm'):
+            raise ValueError("Unknown solver: {0}".format(self.solver))
+        if self.batch_size and self.solver != 'lm':
+            raise ValueError("The batch_size option needs the 'lm' solver.")
+        if self.multi_line and self.solver != 'lm':
+            raise ValueError("The multi_line mode needs the 'lm' solver.")
+        self.hit_count_window = self.get('hit_count_window') or 15
+        self.dump_stats = self.get('dump_stats') is not False
+        self.output_file = self.get('output_file')
+        self.flush_every = self.get('flush_every') or 1000
+        self.keep_fits = self.get('keep_fits') is not False
+        self.seed_grid = self.get('seed_grid')
+        self.n_seeds = self.get('n_seeds') or 1
+        self.profile = self.get('profile')
+        if self.profile not in PROFILED_PARAMETERS:
+            raise ValueError("Unknown profile option: {0}"
+                             .format(self.profile))
+        self.zc_step = self.get('zc_step') or 1.
+        self.fit_writer = None
+        if self.output_file:
+            self.fit_writer = FitWriter(self.output_file, self.flush_every)
+        self.resolution = ZenithResolution()
+        self.stats = {'zenith_resolution': self.resolution}
         self.processed_events = 0
         self.tried_events = 0
         self.valid_fits = 0
+        self.function_calls = 0
+        self._batch = []
+        self._batched_events = 0
+        self._fits = []
 
         self.stats['fit_parameters'] = {'d0': self.d0,
                                         'd1': self.d1, 
                                         'sigma_t': self.sigma_t}
 
+    @instrumented(output_key=None)
     def process(self, blob):
         self.processed_events += 1
+        self._fits = blob['ROyFits'] = []
         mc_track = blob['TrackIns'][0]
         zenith = mc_track.dir.zenith * 180.0 / np.pi
         #zenith = np.arcsin(mc_track.dir.z) * 180 / np.pi
 
-        raw_hits = blob['EvtRawHits']
-        hits = blob[self.input_hits]
+        raw_hits = hit_series(blob, 'EvtRawHits', self.detector)
+        hits = hit_series(blob, self.input_hits, self.detector)
+        if self.multi_line:
+            self._add_lines(zenith, hits, om_sorted_times(raw_hits))
+            return blob
         if len(hits) < self.min_hits:
             return blob
         self.tried_events += 1
 
-        hit_times = [hit.time for hit in hits]
-
-        pmt_hit_counts = []
-        for hit in hits:
-            line, om, pmt = self.detector.pmtid2omkey(hit.pmt_id)
-            pmt_hit_count = 0
-            for raw_hit in raw_hits:
-                _, the_om, _ = self.detector.pmtid2omkey(raw_hit.pmt_id)
-                if the_om == om and (hit.time + 15 > raw_hit.time >= hit.time):
-                    pmt_hit_count += 1
-            pmt_hit_counts.append(pmt_hit_count)
-
-
-
-        z_coordinates = []
-        for hit in hits:
-            pmt = self.detector.pmt_with_id(hit.pmt_id)
-            z_coordinates.append(pmt.pos.z)
-
-
-        zc_ini = (min(z_coordinates) + max(z_coordinates)) / 2#sum(z_coordinates)/len(z_coordinates)
-        tc_ini = min(hit_times)#sum(hit_times)/len(hit_times)
-        dc_ini = 20.
-        uz_ini = -0.75 #np.pi - np.cos(zenith)
+        hit_times = hits.time
+        pmt_hit_counts = self._pmt_hit_counts(hits,
+                                              om_sorted_times(raw_hits))
+        z_coordinates = hits.z
+
+        if self.solver == 'lm':
+            seeds = self._seeds(hit_times, z_coordinates, pmt_hit_counts)
+            self._batch.append((self.processed_events, zenith, -1,
+                                hit_times, z_coordinates,
+                                pmt_hit_counts, seeds))
+            self._batched_events += 1
+            if self._batched_events >= max(self.batch_size, 1):
+                self._fit_batch()
+            return blob
 
         dc_lowlimit = 2.
         dc_highlimit = 100.
 
-        quality_function = QualityFunction(hit_times,
-                                           z_coordinates,
-                                           pmt_hit_counts,
-                                           sigma_t=self.sigma_t,
-                                           d0=self.d0,
-                                           d1=self.d1)
-        fitter = minuit.Minuit(quality_function,
-                               zc=zc_ini,
-                               tc=tc_ini,
-                               dc=dc_ini,
-                               uz=uz_ini,
-                               error_dc=1.0,
-                               error_uz=0.01,
-                               error_tc=1.0,
-                               error_zc=1.0,
-                               limit_zc=(min(z_coordinates),
-                                         max(z_coordinates)),
-                               limit_uz = (-1.0, 1.0),
-                               limit_dc = (dc_lowlimit,dc_highlimit))
-
-        fitter.tol = 1
-        #fitter.up = 1
-        #fitter.maxcalls = 500
-
-        #fitter.printMode = 1
-        try:
-            fitter.migrad()
-        except minuit.MinuitError:
-            print("Fitting error!!!")
-        else:
+        quality_function = self._quality_function(hit_times,
+                                                   z_coordinates,
+                                                   pmt_hit_counts)
+        seeds = self._seeds(hit_times, z_coordinates, pmt_hit_counts,
+                            quality_function)
+        fitter = None
+        n_calls = 0
+        for uz_ini, zc_ini, dc_ini, tc_ini in seeds:
+            parameters = dict(zc=zc_ini,
+                              tc=tc_ini,
+                              dc=dc_ini,
+                              uz=uz_ini,
+                              error_dc=1.0,
+                              error_uz=0.01,
+                              error_tc=1.0,
+                              error_zc=1.0,
+                              limit_zc=(min(z_coordinates),
+                                        max(z_coordinates)),
+                              limit_uz = (-1.0, 1.0),
+                              limit_dc = (dc_lowlimit,dc_highlimit))
+            for name in PROFILED_PARAMETERS[self.profile]:
+                for key in (name, 'error_' + name, 'limit_' + name):
+                    parameters.pop(key, None)
+            seed_fitter = minuit.Minuit(quality_function,
+                                        grad=quality_function.grad,
+                                        **parameters)
+
+            seed_fitter.tol = 1
+            #seed_fitter.up = 1
+            #seed_fitter.maxcalls = 500
+
+            #seed_fitter.printMode = 1
+            try:
+                seed_fitter.migrad()
+            except minuit.MinuitError:
+                if self.verbose:
+                    print("Fitting error!!!")
+                self._count('minuit_errors')
+                continue
+            self.function_calls += seed_fitter.get_fmin().nfcn
+            n_calls += seed_fitter.get_fmin().nfcn
+            self._fill('nfcn', seed_fitter.get_fmin().nfcn)
+            # valid fits first, then the lowest quality function value
+            if fitter is None or \
+                    (seed_fitter.get_fmin().is_valid, -seed_fitter.fval) > \
+                    (fitter.get_fmin().is_valid, -fitter.fval):
+                fitter = seed_fitter
+
+        if fitter is not None:
             quality_parameter = fitter.fval / 4
-            print("Q/4: {0}".format(quality_parameter))
-            print("Values:")
-            print(fitter.values)
-            print("Errors:")
-            print(fitter.errors)
-            print("MC zenith: {0}".format(zenith))
-            reco_zenith = 180 - (np.arccos(fitter.values["uz"]) / (np.pi/180.0))
-            #reco_zenith = np.arcsin(fitter.values['uz']) * 180 / np.pi
-            #reco_zenith = fitter.values["uz"]
-            print("Reconstructed zenith: {0}".format(reco_zenith))
-
-            if fitter.get_fmin().is_valid:
+            if self.verbose:
+                print("Q/4: {0}".format(quality_parameter))
+                print("Values:")
+                print(fitter.values)
+                print("Errors:")
+                print(fitter.errors)
+                print("MC zenith: {0}".format(zenith))
+                reco_zenith = 180 - (np.arccos(fitter.values["uz"])
+                                     / (np.pi/180.0))
+                #reco_zenith = np.arcsin(fitter.values['uz']) * 180 / np.pi
+                #reco_zenith = fitter.values["uz"]
+                print("Reconstructed zenith: {0}".format(reco_zenith))
+
+            values, errors = fitter.values, fitter.errors
+            if self.profile:
+                values, errors = quality_function.complete(values, errors)
+            is_valid = fitter.get_fmin().is_valid
+            if is_valid:
                 self.valid_fits += 1
-                self._save('mc_zenith', zenith)
-                self._save('reco_zenith', reco_zenith)
-                self._save('quality_parameter', quality_parameter)
-                self._save('angular_error', zenith - reco_zenith)
-                self._save('zc', fitter.values['zc'])
-                self._save('dc', fitter.values['dc'])
-                self._save('tc', fitter.values['tc'])
-                self._save('uz', fitter.values['uz'])
-                self._save('zc_err', fitter.errors['zc'])
-                self._save('dc_err', fitter.errors['dc'])
-                self._save('tc_err', fitter.errors['tc'])
-                self._save('uz_err', fitter.errors['uz'])
+            self._count('valid_fits' if is_valid else 'failed_fits')
+            self._save_fit(self.processed_events, zenith, quality_parameter,
+                           values, errors, is_valid, n_calls=n_calls)
 
 #        x, y = fitter.profile('zc', subtract_min=True)
 #        plt.plot(x, y)
@@ -383,6 +469,187 @@ class ROyFitter(Module):
 
         return blob
 
+    def _add_lines(self, zenith, hits, om_times):
+        """Add the lines with enough hits to the batch"""
+        n_lines = 0
+        for line, line_hits in split_by_line(hits):
+            if len(line_hits) < self.min_hits:
+                continue
+            hit_times, z_coordinates = line_hits.time, line_hits.z
+            pmt_hit_counts = self._pmt_hit_counts(line_hits, om_times)
+            seeds = self._seeds(hit_times, z_coordinates, pmt_hit_counts)
+            self._batch.append((self.processed_events, zenith, line,
+                                hit_times, z_coordinates,
+                                pmt_hit_counts, seeds))
+            n_lines += 1
+        self._fill('lines', n_lines)
+        if not n_lines:
+            return
+        self.tried_events += 1
+        self._batched_events += 1
+        if self._batched_events >= max(self.batch_size, 1):
+            self._fit_batch()
+
+    def _pmt_hit_counts(self, hits, om_times):
+        """The number of raw hits on the OM of each hit in the time window"""
+        return [count_hits_in_window(om_times, om_id, hit_time,
+                                     self.hit_count_window)
+                for om_id, hit_time in zip(hits.om_id.tolist(),
+                                           hits.time.tolist())]
+
+    def _quality_function(self, hit_times, z_coordinates, pmt_hit_counts):
+        """The quality function for Minuit, with the profile option."""
+        parameters = dict(sigma_t=self.sigma_t, d0=self.d0, d1=self.d1)
+        if self.profile == 'zc':
+            z_min, z_max = min(z_coordinates), max(z_coordinates)
+            zc_values = np.linspace(z_min, z_max,
+                                    int((z_max - z_min) / self.zc_step) + 2)
+            return ZcScanQualityFunction(hit_times, z_coordinates,
+                                         pmt_hit_counts, zc_values=zc_values,
+                                         **parameters)
+        if self.profile == 'tc':
+            return ProfiledQualityFunction(hit_times, z_coordinates,
+                                           pmt_hit_counts, **parameters)
+        return QualityFunction(hit_times, z_coordinates, pmt_hit_counts,
+                               **parameters)
+
+    def _seeds(self, hit_times, z_coordinates, pmt_hit_counts,
+               quality_function=None):
+        """Start values (uz, zc, dc, tc) for the fit, best first.
+
+        Without seed_grid, the fixed start values are used. Otherwise the
+        quality function is evaluated on a grid of seed_grid = (n_uz, n_dc)
+        points in one call and the n_seeds best points are returned.
+
+        """
+        if not self.seed_grid:
+            return [default_seed(hit_times, z_coordinates)]
+        zc_ini = (min(z_coordinates) + max(z_coordinates)) / 2
+        if quality_function is None:
+            quality_function = QualityFunction(hit_times,
+                                               z_coordinates,
+                                               pmt_hit_counts,
+                                               sigma_t=self.sigma_t,
+                                               d0=self.d0,
+                                               d1=self.d1)
+        n_uz, n_dc = self.seed_grid
+        return grid_seeds(quality_function, zc_ini,
+                          np.linspace(-0.95, 0.95, n_uz),
+                          np.linspace(5., 95., n_dc),
+                          self.n_seeds)
+
+    def _fit_batch(self):
+        """Fit the buffered events at once with the vectorised LM solver.
+
+        Each seed of an event (or line, in multi_line mode) is fitted as a
+        separate problem, the valid fit with the lowest quality function
+        value is kept.
+
+        """
+        events, zeniths, lines, hit_times, z_coordinates, pmt_hit_counts, \
+            seeds = zip(*self._batch)
+        self._batch = []
+        self._batched_events = 0
+        result = fit_events(hit_times, z_coordinates, pmt_hit_counts, seeds,
+                            sigma_t=self.sigma_t,
+                            d0=self.d0,
+                            d1=self.d1)
+        self.function_calls += int(np.sum(result.n_calls))
+        if not self.multi_line:
+            self.valid_fits += int(np.count_nonzero(result.converged))
+        for i, (event, zenith) in enumerate(zip(events, zeniths)):
+            self._fill('nfcn', result.n_calls[i])
+            if self.multi_line:
+                self._count('valid_line_fits' if result.converged[i]
+                            else 'failed_line_fits')
+            else:
+                self._count('valid_fits' if result.converged[i]
+                            else 'failed_fits')
+            if result.stuck[i]:
+                self._count('stuck_fits')
+            values = dict(zip(('uz', 'zc', 'dc', 'tc'), result.params[i]))
+            errors = dict(zip(('uz', 'zc', 'dc', 'tc'), result.errors[i]))
+            self._save_fit(event, zenith, result.cost[i] / 4, values, errors,
+                           result.converged[i], lines[i], result.n_calls[i])
+        if self.multi_line:
+            self._save_combined_fits(events, zeniths, result)
+
+    def _save_combined_fits(self, events, zeniths, result):
+        """Combine the line fits of each event and save them with line=-1"""
+        events = np.asarray(events)
+        unique_events, first, owner = np.unique(events, return_index=True,
+                                                return_inverse=True)
+        uz, uz_err, n_lines = combine_lines(result.params[:, 0],
+                                            result.errors[:, 0],
+                                            result.converged, owner,
+                                            len(unique_events))
+        cost = np.bincount(owner, weights=np.where(result.converged,
+                                                   result.cost, 0),
+                           minlength=len(unique_events))
+        n_calls = np.bincount(owner, weights=result.n_calls,
+                              minlength=len(unique_events)).astype(int)
+        nan = float('nan')
+        for i, event in enumerate(unique_events.tolist()):
+            is_valid = n_lines[i] > 0
+            if is_valid:
+                self.valid_fits += 1
+            self._count('valid_fits' if is_valid else 'failed_fits')
+            self._fill('combined_lines', n_lines[i])
+            values = dict(uz=uz[i], zc=nan, dc=nan, tc=nan)
+            errors = dict(uz=uz_err[i], zc=nan, dc=nan, tc=nan)
+            self._save_fit(event, zeniths[first[i]], cost[i] / 4, values,
+                           errors, is_valid, n_calls=n_calls[i])
+            if self.verbose and is_valid:
+                print("Event {0}: reconstructed zenith {1} from {2} lines"
+                      .format(event, 180 - np.degrees(np.arccos(uz[i])),
+                              n_lines[i]))
+
+    def _save_fit(self, event, zenith, quality_parameter, values, errors,
+                  is_valid, line=-1, n_calls=0):
+        """Save the results of a fit, only valid ones go to the stats."""
+        reco_zenith = 180 - (np.arccos(values["uz"]) / (np.pi/180.0))
+        self._fits.append({'event': int(event),
+                           'line': int(line),
+                           'valid': bool(is_valid),
+                           'mc_zenith': float(zenith),
+                           'reco_zenith': float(reco_zenith),
+                           'quality_parameter': float(quality_parameter),
+                           'dc': float(values['dc']),
+                           'nfcn': int(n_calls)})
+        if is_valid and line == -1:
+            self.resolution.fill(zenith, reco_zenith)
+        if self.fit_writer is not None:
+            self.fit_writer.write(event=event,
+                                  line=line,
+                                  valid=is_valid,
+                                  mc_zenith=zenith,
+                                  reco_zenith=reco_zenith,
+                                  quality_parameter=quality_parameter,
+                                  zc=values['zc'],
+                                  dc=values['dc'],
+                                  tc=values['tc'],
+                                  uz=values['uz'],
+                                  zc_err=errors['zc'],
+                                  dc_err=errors['dc'],
+                                  tc_err=errors['tc'],
+                                  uz_err=errors['uz'])
+            return
+        if not (is_valid and self.keep_fits):
+            return
+        self._save('line', line)
+        self._save('mc_zenith', zenith)
+        self._save('reco_zenith', reco_zenith)
+        self._save('quality_parameter', quality_parameter)
+        self._save('angular_error', zenith - reco_zenith)
+        self._save('zc', values['zc'])
+        self._save('dc', values['dc'])
+        self._save('tc', values['tc'])
+        self._save('uz', values['uz'])
+        self._save('zc_err', errors['zc'])
+        self._save('dc_err', errors['dc'])
+        self._save('tc_err', errors['tc'])
+        self._save('uz_err', errors['uz'])
+
     def _save(self, name, value):
         """Create a new entry in the stats file."""
         self.stats.setdefault(name, []).append(value)
@@ -391,22 +658,106 @@ class ROyFitter(Module):
         """Store statistics in a pickle dump."""
         filename = self.stats_file
         print("Saving reconstruction statistics to: {0}".format(filename))
-        with open(filename, 'w') as file:
+        with open(filename, 'wb') as file:
             pickle.dump(self.stats, file)
 
     def finish(self):
+        if self._batch:
+            self._fit_batch()
         print("Processed {0} events".format(self.processed_events))
         print("Tried fit on {0} events".format(self.tried_events))
+        if self.tried_events:
+            print("Quality function calls per event: {0:.1f}"
+                  .format(self.function_calls / self.tried_events))
+        self.stats['number_of_function_calls'] = self.function_calls
         self.stats['number_of_events'] = self.processed_events
         self.stats['number_of_vaild_fits'] = self.valid_fits
-        self._dump_stats()
+        if self.fit_writer is not None:
+            print("Wrote {0} fits to: {1}".format(len(self.fit_writer),
+                                                  self.output_file))
+            self.fit_writer.close()
+        if self.dump_stats:
+            self._dump_stats()
+        super(self.__class__, self).finish()
+
+
+class LiveMonitor(RoyfitModule):
+    """Publishes live histograms of the fits and stage latencies.
+
+    The fits of the ROyFitter (blob['ROyFits']) and the stage times of the
+    instrumented modules (blob['StageTimes']) are aggregated into rolling
+    histograms over the last n_periods intervals, which are sent as JSON
+    at most every interval seconds to host:port via protocol ('udp' or
+    'tcp'). The sending happens in a background thread, see royfit.live.
+    Needs Python 3.
+
+    The fits which the ROyFitter saves in its finish() (the last batch of
+    the LM solver) are appended to the fit list of the last blob, so they
+    are added to the feed before the last message is published. This
+    needs the LiveMonitor after the ROyFitter in the pipeline.
+
+    """
+    def __init__(self, **context):
+        super(self.__class__, self).__init__(**context)
+        from .live import AsyncPublisher, FitFeed
+        self.host = self.get('host') or 'localhost'
+        self.port = self.get('port') or 9999
+        self.protocol = self.get('protocol') or 'udp'
+        self.interval = self.get('interval') or 1.
+        self.n_periods = self.get('n_periods') or 60
+        self.feed = FitFeed(self.interval, self.n_periods)
+        self.publisher = AsyncPublisher((self.host, self.port),
+                                        self.protocol,
+                                        self.get('max_queue') or 100)
+        self._last_fits = []
+        self._n_last_fits = 0
+
+    @instrumented(input_key=None, output_key=None)
+    def process(self, blob):
+        self._last_fits = blob.get('ROyFits', [])
+        self._n_last_fits = len(self._last_fits)
+        message = self.feed.add(self._last_fits, blob.get('StageTimes'))
+        if message is not None:
+            self.publisher.publish(message)
+        return blob
+
+    def finish(self):
+        self.feed.add_fits(self._last_fits[self._n_last_fits:])
+        self.publisher.publish(self.feed.message())
+        self.publisher.close()
+        print("LiveMonitor: published {0} messages, {1} dropped, {2} failed"
+              .format(self.publisher.published, self.publisher.dropped,
+                      self.publisher.errors))
+        super(self.__class__, self).finish()
 
 
-def sort_hits_by_om(hits, detector):
-    om_hits = {}
-    for hit in hits:
-        omkey = detector.pmtid2omkey(hit.pmt_id)
-        om_hits.setdefault((omkey[0], omkey[1]), []).append(hit)
-    return om_hits
+def hit_series(blob, key, detector):
+    """Return blob[key] as HitSeries.
 
+    Lists of hit objects are converted and replaced in the blob, so the
+    conversion happens only once per event.
 
+    """
+    hits = blob[key]
+    if not isinstance(hits, HitSeries):
+        hits = HitSeries.from_hits(hits, get_pmt_table(detector))
+        blob[key] = hits
+    return hits
+
+
+def om_sorted_times(hits):
+    """Return a dict with the sorted hit times (as array) for each om_id"""
+    order = np.lexsort((hits.time, hits.om_id))
+    times, om_ids = hits.time[order], hits.om_id[order]
+    starts = np.flatnonzero(np.diff(om_ids)) + 1
+    oms = om_ids[np.r_[0, starts]].tolist() if len(hits) else []
+    return dict(zip(oms, np.split(times, starts)))
+
+
+def count_hits_in_window(om_times, om_id, time, time_window):
+    """Count the hits on an OM within [time, time + time_window)"""
+    times = om_times.get(om_id)
+    if times is None:
+        return 0
+    return int(np.searchsorted(times, time + time_window) -
+               np.searchsorted(times, time))
@@ -0,0 +1,176 @@
+# coding=utf-8
+# Filename: fitting.py
+"""
+Single line fits without km3pipe, e.g. for batch jobs on plain arrays.
+
+"""
+from __future__ import division, absolute_import, print_function
+
+import numpy as np
+
+from .minimiser import BatchQualityFunction
+from .solvers import LMResult, levenberg_marquardt
+
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+
+def default_seed(hit_times, z_coordinates):
+    """The fixed start values (uz, zc, dc, tc) of the ROyFitter"""
+    zc_ini = (min(z_coordinates) + max(z_coordinates)) / 2
+    return (-0.75, zc_ini, 20., min(hit_times))
+
+
+def fit_events(hit_times, z_coordinates, pmt_hit_counts, seeds=None,
+               sigma_t=8, d0=50, d1=5, dc_limits=(2., 100.), tol=1,
+               amplitude=True):
+    """Fit (uz, zc, dc, tc) to many events with the bounded LM solver.
+
+    hit_times, z_coordinates and pmt_hit_counts hold one array per event.
+    seeds is a list of (uz, zc, dc, tc) start values for each event, by
+    default the ones of default_seed(). Every seed is fitted and for each
+    event the converged fit with the lowest quality function value is
+    returned, as LMResult with one row per event. n_calls is summed over
+    the seeds of an event.
+
+    uz is limited to [-1, 1], zc to the z range of the hits and dc to
+    dc_limits. With amplitude=False, only the time residuals are fitted
+    (pmt_hit_counts are not used).
+
+    """
+    if seeds is None:
+        seeds = [[default_seed(t, z)]
+                 for t, z in zip(hit_times, z_coordinates)]
+    n_events = len(seeds)
+    owner = np.repeat(np.arange(n_events),
+                      [len(event_seeds) for event_seeds in seeds])
+    quality_function = BatchQualityFunction(
+        [hit_times[i] for i in owner],
+        [z_coordinates[i] for i in owner],
+        [pmt_hit_counts[i] for i in owner],
+        sigma_t=sigma_t,
+        d0=d0,
+        d1=d1,
+        amplitude=amplitude)
+    n_fits = len(owner)
+    z_min = np.array([min(z_coordinates[i]) for i in owner])
+    z_max = np.array([max(z_coordinates[i]) for i in owner])
+    p0 = np.array([seed for event_seeds in seeds for seed in event_seeds],
+                  dtype=float).reshape(n_fits, 4)
+    lower = np.column_stack((np.full(n_fits, -1.0), z_min,
+                             np.full(n_fits, dc_limits[0]),
+                             np.full(n_fits, -np.inf)))
+    upper = np.column_stack((np.full(n_fits, 1.0), z_max,
+                             np.full(n_fits, dc_limits[1]),
+                             np.full(n_fits, np.inf)))
+    result = levenberg_marquardt(quality_function.residuals_and_jacobian,
+                                 p0, lower, upper, tol=tol)
+
+    order = np.lexsort((result.cost, ~result.converged, owner))
+    _, first = np.unique(owner[order], return_index=True)
+    best = order[first]
+    n_calls = np.bincount(owner, weights=result.n_calls,
+                          minlength=n_events).astype(int)
+    return LMResult(result.params[best], result.errors[best],
+                    result.cost[best], result.converged[best],
+                    result.stuck[best], result.n_iter[best], n_calls)
+
+
+def combine_lines(uz, uz_err, converged, owner, n_events=None,
+                  min_err=0.05, limit_margin=1e-3):
+    """Combine the uz of single line fits to one estimate per event.
+
+    owner is the event index of each line fit. The combined uz is the
+    weighted median of the converged fits, with weights 1/uz_err**2 where
+    uz_err is at least min_err (fits without a usable error get the weight
+    of the others' median, or 1). Fits within limit_margin of uz=+-1 sit
+    on the limit with meaningless small errors and are only used if an
+    event has no other fits. Returns (uz, uz_err, n_lines) per event,
+    where uz_err is 1/sqrt(sum of the weights) and n_lines the number of
+    converged fits, uz and uz_err are NaN for events without them.
+
+    A single line only measures the zenith, so the combined estimate is
+    a zenith as well.
+
+    """
+    uz, uz_err = np.asarray(uz, dtype=float), np.asarray(uz_err, dtype=float)
+    converged = np.asarray(converged, dtype=bool)
+    owner = np.asarray(owner, dtype=int)
+    if n_events is None:
+        n_events = owner.max() + 1 if len(owner) else 0
+    n_lines = np.bincount(owner, weights=converged,
+                          minlength=n_events).astype(int)
+    used = converged & (np.abs(uz) < 1 - limit_margin)
+    n_used = np.bincount(owner, weights=used, minlength=n_events)
+    used |= converged & (n_used[owner] == 0)
+    usable = used & np.isfinite(uz_err) & (uz_err > 0)
+    weights = np.zeros(len(uz))
+    weights[usable] = 1 / np.maximum(uz_err[usable], min_err)**2
+    fallback = np.median(weights[usable]) if usable.any() else 1.
+    weights[used & ~usable] = fallback
+
+    fits = np.flatnonzero(used)
+    fits = fits[np.lexsort((uz[fits], owner[fits]))]
+    fit_owner, fit_weights = owner[fits], weights[fits]
+    sum_of_weights = np.bincount(fit_owner, weights=fit_weights,
+                                 minlength=n_events)
+    offsets = np.r_[0, np.cumsum(sum_of_weights)[:-1]]
+    below = np.cumsum(fit_weights) - offsets[fit_owner]
+    half = sum_of_weights[fit_owner] / 2
+    # the first fit of each event with half of the weight at or below it
+    candidates = np.flatnonzero(below >= half * (1 - 1e-12))
+    events, first = np.unique(fit_owner[candidates], return_index=True)
+    median = candidates[first]
+    combined_uz = np.full(n_events, np.nan)
+    combined_uz[events] = uz[fits[median]]
+    # with exactly half of the weight below, average with the next fit
+    between = np.isclose(below[median], half[median]) & \
+        (median + 1 < len(fits))
+    between[between] &= fit_owner[median[between] + 1] == events[between]
+    combined_uz[events[between]] = (uz[fits[median[between]]] +
+                                    uz[fits[median[between] + 1]]) / 2
+    with np.errstate(divide='ignore'):
+        combined_err = 1 / np.sqrt(sum_of_weights)
+    combined_err[n_lines == 0] = np.nan
+    return combined_uz, combined_err, n_lines
+
+
+def fit_lines(lines, oms, times, z_coordinates, min_hits=5, uz_ini=0.,
+              dc_ini=20., **fit_parameters):
+    """Fit a track to each line, using the first pulse on every OM.
+
+    lines, oms, times and z_coordinates hold one entry per pulse. Only the
+    first pulse (in the given order) of each (line, om) is used and all
+    lines with at least min_hits of them are fitted in one fit_events()
+    call, starting at (uz_ini, z, dc_ini, t) of the first used pulse of the
+    line. The fit_parameters are passed to fit_events().
+
+    Returns the fitted lines (ascending) and the LMResult with one row per
+    line, which is None if no line has enough pulses.
+
+    """
+    lines = np.asarray(lines, dtype=int)
+    oms = np.asarray(oms, dtype=int)
+    times = np.asarray(times, dtype=float)
+    z_coordinates = np.asarray(z_coordinates, dtype=float)
+    if not len(lines):
+        return np.zeros(0, dtype=int), None
+    _, first = np.unique(np.column_stack((lines, oms)), axis=0,
+                         return_index=True)
+    first = np.sort(first)
+    first = first[np.argsort(lines[first], kind='mergesort')]
+    line_numbers, starts, n_pulses = np.unique(lines[first],
+                                               return_index=True,
+                                               return_counts=True)
+    fitted = n_pulses >= min_hits
+    if not fitted.any():
+        return np.zeros(0, dtype=int), None
+    selections = [first[start:start + n]
+                  for start, n in zip(starts[fitted], n_pulses[fitted])]
+    hit_times = [times[selected] for selected in selections]
+    z = [z_coordinates[selected] for selected in selections]
+    seeds = [[(uz_ini, line_z[0], dc_ini, line_times[0])]
+             for line_times, line_z in zip(hit_times, z)]
+    counts = [np.ones(len(selected)) for selected in selections]
+    return line_numbers[fitted], fit_events(hit_times, z, counts, seeds,
+                                            **fit_parameters)
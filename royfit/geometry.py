@@ -0,0 +1,210 @@
+# coding=utf-8
+# Filename: geometry.py
+"""
+Lookup tables derived from the detector geometry.
+
+"""
+from __future__ import division, absolute_import, print_function
+from collections import OrderedDict
+import hashlib
+
+import numpy as np
+
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+
+class PMTTable(object):
+    """Dense arrays with the line, OM, PMT index and position of each PMT.
+
+    All arrays are indexed by the pmt_id, so the information for all hits
+    of an event is a single fancy-indexing operation, e.g.
+
+        >>> z = pmt_table.z[pmt_ids]
+
+    Unknown pmt_ids have -1 as line/om/pmt and NaN as position.
+
+    """
+    def __init__(self, pmt_ids, omkeys, positions):
+        pmt_ids = np.asarray(pmt_ids, dtype=int)
+        omkeys = np.asarray(omkeys, dtype=int).reshape(-1, 3)
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        size = pmt_ids.max() + 1 if len(pmt_ids) else 0
+
+        self.line = np.full(size, -1, dtype=int)
+        self.om = np.full(size, -1, dtype=int)
+        self.pmt = np.full(size, -1, dtype=int)
+        self.x = np.full(size, np.nan)
+        self.y = np.full(size, np.nan)
+        self.z = np.full(size, np.nan)
+
+        self.line[pmt_ids], self.om[pmt_ids], self.pmt[pmt_ids] = omkeys.T
+        self.x[pmt_ids], self.y[pmt_ids], self.z[pmt_ids] = positions.T
+
+        # a unique integer for each (line, om), used to group hits by OM
+        self.oms_per_line = self.om.max() + 1 if size else 0
+        self.om_id = np.where(self.line < 0, -1,
+                              self.line * self.oms_per_line + self.om)
+
+    @classmethod
+    def from_detector(cls, detector):
+        """Create the table from a km3pipe detector"""
+        pmt_ids = [pmt.id for pmt in detector.pmts]
+        omkeys = [detector.pmtid2omkey(pmt_id) for pmt_id in pmt_ids]
+        positions = [(pmt.pos.x, pmt.pos.y, pmt.pos.z)
+                     for pmt in detector.pmts]
+        return cls(pmt_ids, omkeys, positions)
+
+    def omkeys(self, pmt_ids):
+        """Return the (line, om) tuples for the given PMTs"""
+        pmt_ids = np.asarray(pmt_ids, dtype=int)
+        return list(zip(self.line[pmt_ids].tolist(),
+                        self.om[pmt_ids].tolist()))
+
+
+def line_positions(pmt_table):
+    """Return a dict with the mean (x, y) of the PMTs of each line"""
+    known = pmt_table.line >= 0
+    lines, index = np.unique(pmt_table.line[known], return_inverse=True)
+    n_pmts = np.bincount(index)
+    x = np.bincount(index, weights=pmt_table.x[known]) / n_pmts
+    y = np.bincount(index, weights=pmt_table.y[known]) / n_pmts
+    return dict(zip(lines.tolist(), zip(x.tolist(), y.tolist())))
+
+
+def floor_z(pmt_table):
+    """Return a dict with the z of each OM of a line, indexed by the OM.
+
+    The z of an OM is the mean z of its PMTs, OM numbers which do not
+    exist on the line are NaN.
+
+    """
+    known = pmt_table.line >= 0
+    om_ids, index = np.unique(pmt_table.om_id[known], return_inverse=True)
+    z = np.bincount(index, weights=pmt_table.z[known]) / np.bincount(index)
+    lines = om_ids // pmt_table.oms_per_line
+    oms = om_ids % pmt_table.oms_per_line
+    floors = {}
+    for line in np.unique(lines).tolist():
+        floors[line] = np.full(pmt_table.oms_per_line, np.nan)
+        on_line = lines == line
+        floors[line][oms[on_line]] = z[on_line]
+    return floors
+
+
+def neighbour_floors(pmt_table, depth):
+    """Return the neighbouring OMs within depth floors for each om_id.
+
+    The neighbours of an OM are a list of (distance, om_id) on the same
+    line, ordered by distance with the upper floor first, e.g. for depth=2:
+    [(1, om+1), (1, om-1), (2, om+2), (2, om-2)]. OMs which do not exist
+    are skipped.
+
+    """
+    om_ids = set(pmt_table.om_id[pmt_table.om_id >= 0].tolist())
+    oms_per_line = pmt_table.oms_per_line
+    neighbours = {}
+    for om_id in om_ids:
+        om = om_id % oms_per_line
+        neighbours[om_id] = [(distance, om_id + sign * distance)
+                             for distance in range(1, depth + 1)
+                             for sign in (1, -1)
+                             if 0 <= om + sign * distance < oms_per_line and
+                             om_id + sign * distance in om_ids]
+    return neighbours
+
+
+class GeometryCache(object):
+    """Quantities derived from a detector geometry, computed on first use.
+
+    The cache belongs to one geometry (a km3pipe Detector or an
+    I3Geometry), see geometry_cache() for the shared caches. Besides the
+    properties for a km3pipe Detector, arbitrary values can be cached with
+    get():
+
+        >>> detector = cache.get('detector', Detector)
+
+    """
+    def __init__(self, geometry=None):
+        self.geometry = geometry
+        self._values = {}
+
+    def get(self, name, factory):
+        """The value of name, created with factory(geometry) on first use"""
+        try:
+            return self._values[name]
+        except KeyError:
+            value = self._values[name] = factory(self.geometry)
+            return value
+
+    @property
+    def pmt_table(self):
+        return self.get('pmt_table', PMTTable.from_detector)
+
+    @property
+    def lines(self):
+        """The sorted line numbers"""
+        return sorted(self.line_positions)
+
+    @property
+    def line_positions(self):
+        """(Lx, Ly) of each line, see line_positions()"""
+        return self.get('line_positions',
+                        lambda _: line_positions(self.pmt_table))
+
+    @property
+    def floor_z(self):
+        """The z of the OMs of each line, see floor_z()"""
+        return self.get('floor_z', lambda _: floor_z(self.pmt_table))
+
+    def neighbour_floors(self, depth):
+        """The neighbouring OMs of each OM, see neighbour_floors()"""
+        return self.get(('neighbour_floors', depth),
+                        lambda _: neighbour_floors(self.pmt_table, depth))
+
+
+_geometry_caches = OrderedDict()
+MAX_GEOMETRIES = 8
+
+
+def geometry_cache(geometry, key=None):
+    """Return the GeometryCache of geometry, which is shared by all modules.
+
+    The caches are looked up by key, by default the identity of the
+    geometry object. For objects which are created on every access, like
+    frame['I3Geometry'] in icetray, pass a key for the content, e.g.
+    omgeo_key(geometry). The caches of the last MAX_GEOMETRIES geometries
+    are kept.
+
+    """
+    if key is None:
+        # the cache keeps a reference, so the id is not reused meanwhile
+        key = id(geometry)
+    cache = _geometry_caches.pop(key, None)
+    if cache is None:
+        cache = GeometryCache(geometry)
+    _geometry_caches[key] = cache
+    while len(_geometry_caches) > MAX_GEOMETRIES:
+        _geometry_caches.popitem(last=False)
+    return cache
+
+
+def omgeo_key(geometry):
+    """A key for the OM positions of an I3Geometry, see geometry_cache()"""
+    digest = hashlib.sha1()
+    for omkey, omgeo in sorted(geometry.omgeo.items(),
+                               key=lambda item: str(item[0])):
+        position = omgeo.position
+        digest.update(repr((str(omkey), position.x, position.y, position.z))
+                      .encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_pmt_table(detector):
+    """Return the PMTTable of the detector, which is built only once.
+
+    The table is cached in the shared GeometryCache, so all modules
+    attached to the same geometry share the same table.
+
+    """
+    return geometry_cache(detector).pmt_table
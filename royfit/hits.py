@@ -0,0 +1,280 @@
+# coding=utf-8
+# Filename: hits.py
+"""
+Columnar hit container which flows through the ROyFit modules.
+
+"""
+from __future__ import division, absolute_import, print_function
+
+import numpy as np
+
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+
+HIT_DTYPE = np.dtype([('id', int),
+                      ('pmt_id', int),
+                      ('time', float),
+                      ('tot', float),
+                      ('line', int),
+                      ('om', int),
+                      ('om_id', int),
+                      ('z', float)])
+
+
+class HitSeries(object):
+    """The hits of an event as a structured array.
+
+    Besides id, pmt_id, time and tot, the line, om, a unique om_id and the
+    z-coordinate of each hit are looked up once from the PMTTable, so no
+    module has to touch the detector per hit.
+
+    Selecting with a boolean mask or an index array returns a new HitSeries
+    which shares the underlying array and only stores the indices, so the
+    different stages of the pipeline do not copy the hits around.
+
+    Iterating yields numpy records, which support attribute access like
+    the hit objects (hit.time, hit.pmt_id, ...).
+
+    """
+    def __init__(self, data, index=None):
+        self.data = data
+        if index is None:
+            index = np.arange(len(data))
+        self.index = index
+
+    @classmethod
+    def from_arrays(cls, ids, pmt_ids, times, tots, pmt_table):
+        """Create a HitSeries and look up the OM information of each hit"""
+        pmt_ids = np.asarray(pmt_ids, dtype=int)
+        data = np.recarray(len(pmt_ids), dtype=HIT_DTYPE)
+        data.id = ids
+        data.pmt_id = pmt_ids
+        data.time = times
+        data.tot = tots
+        data.line = pmt_table.line[pmt_ids]
+        data.om = pmt_table.om[pmt_ids]
+        data.om_id = pmt_table.om_id[pmt_ids]
+        data.z = pmt_table.z[pmt_ids]
+        return cls(data)
+
+    @classmethod
+    def from_hits(cls, hits, pmt_table):
+        """Convert a list of hit objects (with id, pmt_id, time and tot)"""
+        n_hits = len(hits)
+        ids = np.fromiter((hit.id for hit in hits), int, n_hits)
+        pmt_ids = np.fromiter((hit.pmt_id for hit in hits), int, n_hits)
+        times = np.fromiter((hit.time for hit in hits), float, n_hits)
+        tots = np.fromiter((hit.tot for hit in hits), float, n_hits)
+        return cls.from_arrays(ids, pmt_ids, times, tots, pmt_table)
+
+    @classmethod
+    def from_records(cls, records):
+        """Create a new HitSeries from a list of hit records"""
+        data = np.recarray(len(records), dtype=HIT_DTYPE)
+        if records:
+            data[:] = records
+        return cls(data)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return self.data[self.index[item]]
+        return self.__class__(self.data, self.index[item])
+
+    def __iter__(self):
+        for i in self.index:
+            yield self.data[i]
+
+    def __repr__(self):
+        return "{0} with {1} hits".format(self.__class__.__name__, len(self))
+
+    def column(self, name):
+        """Return the values of the given field for the selected hits"""
+        return self.data[name][self.index]
+
+    @property
+    def id(self):
+        return self.column('id')
+
+    @property
+    def pmt_id(self):
+        return self.column('pmt_id')
+
+    @property
+    def time(self):
+        return self.column('time')
+
+    @property
+    def tot(self):
+        return self.column('tot')
+
+    @property
+    def line(self):
+        return self.column('line')
+
+    @property
+    def om(self):
+        return self.column('om')
+
+    @property
+    def om_id(self):
+        return self.column('om_id')
+
+    @property
+    def z(self):
+        return self.column('z')
+
+    def to_records(self):
+        """Return a contiguous copy of the selected hits"""
+        return self.data[self.index]
+
+
+def as_hit_series(hits, pmt_table):
+    """Return the hits as HitSeries, converting hit objects if needed"""
+    if isinstance(hits, HitSeries):
+        return hits
+    return HitSeries.from_hits(hits, pmt_table)
+
+
+def first_om_hits(hits):
+    """Return the earliest hit on each OM, ordered by time.
+
+    Hits with the same time keep their original order, so the result is
+    the same as walking the time sorted hits and skipping known OMs.
+
+    """
+    order = np.lexsort((hits.time, hits.om_id))
+    _, first = np.unique(hits.om_id[order], return_index=True)
+    selected = order[first]
+    selected = selected[np.lexsort((selected, hits.time[selected]))]
+    return hits[selected]
+
+
+def t3_hits(hits, candidates, time_windows, neighbours=None):
+    """Select the hits which contribute to a T3 coincidence.
+
+    The first hit of each OM in `hits` is combined with the `candidates` on
+    the OMs d floors above and below, which arrived within
+    [t, t + time_windows[d-1]], for d = 1, ..., len(time_windows). Each
+    coincidence selects the candidate and the hit, but every PMT is only
+    selected once.
+
+    The candidates are sorted by (OM, time) once, the time window on each
+    neighbouring OM is found with a binary search. neighbours maps each
+    om_id to its (distance, om_id) neighbours, as returned by
+    royfit.geometry.neighbour_floors() with depth=len(time_windows). It
+    is derived from the hits if not given.
+
+    """
+    candidates = candidates[np.lexsort((candidates.time, candidates.om_id))]
+    candidate_times = candidates.time
+    candidate_pmt_ids = candidates.pmt_id.tolist()
+    om_ids = candidates.om_id
+    starts = np.flatnonzero(np.r_[True, om_ids[1:] != om_ids[:-1]]) \
+        if len(candidates) else np.array([], dtype=int)
+    stops = np.r_[starts[1:], len(candidates)]
+    om_blocks = dict(zip(om_ids[starts].tolist(),
+                         zip(starts.tolist(), stops.tolist())))
+    if neighbours is None:
+        neighbours = _neighbour_floors(hits, candidates, len(time_windows))
+
+    _, first = np.unique(hits.om_id, return_index=True)
+    first = np.sort(first)
+    times = hits.time
+    pmt_ids = hits.pmt_id.tolist()
+    hit_om_ids = hits.om_id.tolist()
+
+    selected = []  # (is_candidate, index) in the order of selection
+    skip_pmtids = set()
+    for i in first.tolist():
+        t = times[i]
+        for distance, neighbour in neighbours.get(hit_om_ids[i], ()):
+            if distance > len(time_windows):
+                break
+            window = time_windows[distance - 1]
+            block = om_blocks.get(neighbour)
+            if block is None:
+                continue
+            lo, hi = block
+            block_times = candidate_times[lo:hi]
+            start = lo + np.searchsorted(block_times, t, 'left')
+            stop = lo + np.searchsorted(block_times, t + window, 'right')
+            # t + window may round differently than the time difference
+            while stop < hi and candidate_times[stop] - t <= window:
+                stop += 1
+            while stop > start and candidate_times[stop-1] - t > window:
+                stop -= 1
+            for j in range(start, stop):
+                if candidate_pmt_ids[j] not in skip_pmtids:
+                    selected.append((True, j))
+                    skip_pmtids.add(candidate_pmt_ids[j])
+                if pmt_ids[i] not in skip_pmtids:
+                    selected.append((False, i))
+                    skip_pmtids.add(pmt_ids[i])
+
+    is_candidate = np.array([s[0] for s in selected], dtype=bool)
+    index = np.array([s[1] for s in selected], dtype=int)
+    data = np.recarray(len(selected), dtype=HIT_DTYPE)
+    data[is_candidate] = candidates.to_records()[index[is_candidate]]
+    data[~is_candidate] = hits.to_records()[index[~is_candidate]]
+    return HitSeries(data)
+
+
+def _neighbour_floors(hits, candidates, depth):
+    """neighbour_floors() for the OMs of the hits and candidates"""
+    lines = np.r_[hits.line, candidates.line]
+    oms = np.r_[hits.om, candidates.om]
+    om_id_of = dict(zip(zip(lines.tolist(), oms.tolist()),
+                        np.r_[hits.om_id, candidates.om_id].tolist()))
+    neighbours = {}
+    for (line, om), om_id in om_id_of.items():
+        neighbours[om_id] = [(distance, om_id_of[(line, om + sign * distance)])
+                             for distance in range(1, depth + 1)
+                             for sign in (1, -1)
+                             if (line, om + sign * distance) in om_id_of]
+    return neighbours
+
+
+def merge_om_hits(hits, time_window, keep_singletons=True):
+    """Merge the hits of each OM into clusters.
+
+    The hits are sorted by (OM, time) and a new cluster starts on each OM
+    change or when the time difference to the previous hit is larger than
+    time_window. A merged hit has the id, pmt_id and time of the earliest
+    hit and the summed ToT of the cluster. The result is a new HitSeries
+    ordered by (OM, time).
+
+    """
+    hits = hits[np.lexsort((hits.time, hits.om_id))]
+    if not len(hits):
+        return HitSeries(hits.to_records())
+    times, om_ids = hits.time, hits.om_id
+    new_cluster = np.r_[True, (np.diff(times) > time_window) |
+                              (om_ids[1:] != om_ids[:-1])]
+    starts = np.flatnonzero(new_cluster)
+    merged_hits = hits[starts].to_records()
+    merged_hits.tot = np.add.reduceat(hits.tot, starts)
+    if not keep_singletons:
+        sizes = np.diff(np.r_[starts, len(hits)])
+        merged_hits = merged_hits[sizes > 1]
+    return HitSeries(merged_hits)
+
+
+def split_by_line(hits):
+    """Partition the hits by line.
+
+    Returns a list of (line, HitSeries) ordered by line, the hits of each
+    line keep their order. The partitions are copies (fancy indexing).
+
+    """
+    order = np.argsort(hits.line, kind='mergesort')
+    lines = hits.line[order]
+    starts = np.flatnonzero(np.r_[True, lines[1:] != lines[:-1]]) \
+        if len(hits) else np.array([], dtype=int)
+    stops = np.r_[starts[1:], len(hits)]
+    return [(line, hits[order[start:stop]])
+            for line, start, stop in zip(lines[starts].tolist(),
+                                         starts.tolist(), stops.tolist())]
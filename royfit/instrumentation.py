@@ -0,0 +1,305 @@
+# coding=utf-8
+# Filename: instrumentation.py
+"""
+Low overhead timing and counters for the pipeline modules.
+
+Each module gets a StageStats, which keeps logarithmic histograms of the
+wall time and the hit counts of process() and of any other quantity (e.g.
+the number of function calls of a fit), plus simple counters. The
+FrameProfile does the same for the frames of an icetray, by frame type.
+
+"""
+from __future__ import division, absolute_import, print_function
+import functools
+import math
+import time
+
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+
+timer = getattr(time, 'perf_counter', time.time)
+timer_ns = getattr(time, 'perf_counter_ns', None) or \
+    (lambda: int(timer() * 1e9))
+
+
+class LogHistogram(object):
+    """Counts of values in logarithmic bins between low and high.
+
+    Filling a value costs a log10 and a list increment. Values below low
+    (including zero and negative values) go to an underflow bin, values
+    above high to an overflow bin. Quantiles are estimated from the bin
+    edges, with bins_per_decade=10 they are accurate to about 12%.
+
+    """
+    def __init__(self, low=1e-7, high=1e7, bins_per_decade=10):
+        self.low = low
+        self.high = high
+        self.bins_per_decade = bins_per_decade
+        self._log_low = math.log10(low)
+        n_bins = int(math.ceil((math.log10(high) - self._log_low)
+                               * bins_per_decade))
+        self.counts = [0] * (n_bins + 2)  # underflow, bins, overflow
+        self.n = 0
+        self.total = 0.
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def fill(self, value):
+        self.n += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value < self.low:
+            self.counts[0] += 1
+        elif value >= self.high:
+            self.counts[-1] += 1
+        else:
+            self.counts[1 + int((math.log10(value) - self._log_low)
+                                * self.bins_per_decade)] += 1
+
+    def merge(self, other):
+        """Add the counts of a histogram with the same binning"""
+        if len(other.counts) != len(self.counts) or other.low != self.low:
+            raise ValueError("Cannot merge histograms with different bins.")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.n += other.n
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self):
+        return self.total / self.n if self.n else float('nan')
+
+    def quantile(self, q):
+        """Estimate the q-quantile (0 <= q <= 1) from the histogram"""
+        if not self.n:
+            return float('nan')
+        rank = q * self.n
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if count and cumulative >= rank:
+                break
+        if i == 0:
+            return self.min
+        if i == len(self.counts) - 1:
+            return self.max
+        # geometric centre of the bin, clipped to the observed range
+        centre = 10**(self._log_low + (i - 0.5) / self.bins_per_decade)
+        return min(max(centre, self.min), self.max)
+
+
+class StageStats(object):
+    """Timing, hit counts and counters of one pipeline module"""
+    def __init__(self, name):
+        self.name = name
+        self.time = LogHistogram(low=1e-7, high=1e3)
+        self.hits_in = LogHistogram(low=1, high=1e7)
+        self.hits_out = LogHistogram(low=1, high=1e7)
+        self.histograms = {}
+        self.counters = {}
+
+    def record(self, elapsed, hits_in=None, hits_out=None):
+        """Record one call of process()"""
+        self.time.fill(elapsed)
+        if hits_in is not None:
+            self.hits_in.fill(hits_in)
+        if hits_out is not None:
+            self.hits_out.fill(hits_out)
+
+    def fill(self, name, value):
+        """Fill value into the histogram name, which is created on demand"""
+        try:
+            histogram = self.histograms[name]
+        except KeyError:
+            histogram = self.histograms[name] = LogHistogram(low=1, high=1e7)
+        histogram.fill(value)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other):
+        """Add the statistics of the same stage, e.g. from another worker"""
+        self.time.merge(other.time)
+        self.hits_in.merge(other.hits_in)
+        self.hits_out.merge(other.hits_out)
+        for name, histogram in other.histograms.items():
+            if name in self.histograms:
+                self.histograms[name].merge(histogram)
+            else:
+                self.histograms[name] = histogram
+        for name, n in other.counters.items():
+            self.count(name, n)
+
+    def summary(self):
+        """A human readable summary"""
+        lines = ["{0}: {1} calls, {2:.3f} s in total"
+                 .format(self.name, self.time.n, self.time.total)]
+        if self.time.n:
+            lines.append("  time/call [ms]: mean {0:.3f}, p50 {1:.3f}, "
+                         "p95 {2:.3f}, max {3:.3f}"
+                         .format(self.time.mean * 1e3,
+                                 self.time.quantile(0.5) * 1e3,
+                                 self.time.quantile(0.95) * 1e3,
+                                 self.time.max * 1e3))
+        histograms = [('hits in', self.hits_in), ('hits out', self.hits_out)]
+        histograms += sorted(self.histograms.items())
+        for name, histogram in histograms:
+            if not histogram.n:
+                continue
+            lines.append("  {0}: mean {1:.1f}, p50 {2:.0f}, p95 {3:.0f}, "
+                         "max {4:.0f}".format(name, histogram.mean,
+                                              histogram.quantile(0.5),
+                                              histogram.quantile(0.95),
+                                              histogram.max))
+        for name, n in sorted(self.counters.items()):
+            lines.append("  {0}: {1}".format(name, n))
+        return '\n'.join(lines)
+
+
+class FrameProfile(object):
+    """Latencies of the frames of an icetray by frame type (P, Q, G, ...).
+
+    start(frame_type) is called when a frame arrives at the top of the
+    tray, the frame ends with stop() or mark(stage, last=True) at the end
+    of the tray. Otherwise it ends with the next start(), then its latency
+    also includes the upstream time of the next frame (e.g. the reader).
+    With mark(stage) after a module, the time since the previous mark (or
+    the start) is attributed to that stage and the rest of the frame to
+    'other'. The times are kept in LogHistograms in ms.
+
+    """
+    def __init__(self):
+        self.frames = {}
+        self.stages = {}
+        self.stage_names = []
+        self._frame_type = None
+        self._start = self._last = 0
+        self._marked = False
+
+    def start(self, frame_type):
+        now = timer_ns()
+        self.stop(now)
+        self._frame_type = frame_type
+        self._start = self._last = now
+        self._marked = False
+
+    def mark(self, stage, last=False):
+        """Attribute the time since the last mark to stage"""
+        if self._frame_type is None:
+            return
+        now = timer_ns()
+        self._stage_histogram(stage).fill((now - self._last) / 1e6)
+        self._last = now
+        self._marked = True
+        if last:
+            self._end(now)
+
+    def stop(self, now=None):
+        """End the current frame"""
+        if self._frame_type is None:
+            return
+        if now is None:
+            now = timer_ns()
+        if self._marked:
+            self._stage_histogram('other').fill((now - self._last) / 1e6)
+        self._end(now)
+
+    def _end(self, now):
+        try:
+            histogram = self.frames[self._frame_type]
+        except KeyError:
+            histogram = self.frames[self._frame_type] = \
+                LogHistogram(low=1e-4, high=1e6)
+        histogram.fill((now - self._start) / 1e6)
+        self._frame_type = None
+
+    def _stage_histogram(self, stage):
+        stages = self.stages.setdefault(self._frame_type, {})
+        try:
+            return stages[stage]
+        except KeyError:
+            if stage not in self.stage_names and stage != 'other':
+                self.stage_names.append(stage)
+            histogram = stages[stage] = LogHistogram(low=1e-4, high=1e6)
+            return histogram
+
+    def summary(self):
+        """A human readable summary, stages in the order of the tray"""
+        lines = ["Frame latencies [ms]:"]
+        for frame_type, frames in sorted(self.frames.items()):
+            lines.append("  {0}: {1} frames, {2:.3f} s in total, {3}"
+                         .format(frame_type, frames.n, frames.total / 1e3,
+                                 _latency_quantiles(frames)))
+            stages = self.stages.get(frame_type, {})
+            for stage in self.stage_names + ['other']:
+                if stage not in stages:
+                    continue
+                histogram = stages[stage]
+                share = histogram.total / frames.total if frames.total else 0
+                lines.append("    {0}: {1:.1f}% of the time, {2}"
+                             .format(stage, 100 * share,
+                                     _latency_quantiles(histogram)))
+        return '\n'.join(lines)
+
+
+_frame_profiles = {}
+
+
+def frame_profile(name):
+    """The FrameProfile with the given name, shared by the tray modules"""
+    try:
+        return _frame_profiles[name]
+    except KeyError:
+        profile = _frame_profiles[name] = FrameProfile()
+        return profile
+
+
+def _latency_quantiles(histogram):
+    return "p50 {0:.3f}, p95 {1:.3f}, p99 {2:.3f}, max {3:.3f}".format(
+        histogram.quantile(0.5), histogram.quantile(0.95),
+        histogram.quantile(0.99), histogram.max)
+
+
+def instrumented(input_key='input_hits', output_key='output_hits'):
+    """Decorator for process(self, blob) of a module with a stage attribute.
+
+    The wall time and the lengths of the hits in the blob under the keys
+    given by the module attributes input_key and output_key (None to skip)
+    are recorded in self.stage, unless it is None. The wall time is also
+    put into blob['StageTimes'][stage.name], for monitoring downstream.
+
+        >>> @instrumented()
+        ... def process(self, blob):
+
+    """
+    def decorator(process):
+        @functools.wraps(process)
+        def wrapper(self, blob):
+            stage = self.stage
+            if stage is None:
+                return process(self, blob)
+            start = timer()
+            blob = process(self, blob)
+            elapsed = timer() - start
+            stage.record(elapsed,
+                         _hit_count(self, blob, input_key),
+                         _hit_count(self, blob, output_key))
+            if blob is not None:
+                blob.setdefault('StageTimes', {})[stage.name] = elapsed
+            return blob
+        return wrapper
+    return decorator
+
+
+def _hit_count(module, blob, attribute):
+    """The number of hits in the blob under the key module.<attribute>"""
+    key = getattr(module, attribute, None) if attribute else None
+    if key is None or blob is None:
+        return None
+    hits = blob.get(key)
+    return None if hits is None else len(hits)
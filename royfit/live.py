@@ -0,0 +1,247 @@
+# coding=utf-8
+# Filename: live.py
+"""
+Live monitoring feed of the reconstruction, e.g. for ROyWeb.
+
+The fit results and stage latencies of each event are aggregated into
+rolling histograms (FitFeed), which are published as JSON at most once
+per interval by an asyncio publisher in a background thread
+(AsyncPublisher), so the pipeline never waits on the network.
+
+Requires Python 3 (asyncio).
+
+"""
+from __future__ import division, absolute_import, print_function
+import asyncio
+import json
+import threading
+
+import numpy as np
+
+from .instrumentation import timer
+
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+
+class RollingHistogram(object):
+    """A histogram of the values of the last n_periods periods.
+
+    The counts of each period are kept in a ring buffer, roll() starts a
+    new period and forgets the oldest one. Values outside the bins are
+    counted in the first/last bin.
+
+    """
+    def __init__(self, bins, n_periods=60):
+        self.bins = np.asarray(bins, dtype=float)
+        self._counts = np.zeros((n_periods, len(self.bins) - 1), dtype=int)
+        self._period = 0
+
+    def fill(self, values):
+        values = np.atleast_1d(np.asarray(values, dtype=float))
+        values = values[~np.isnan(values)]
+        index = np.clip(np.searchsorted(self.bins, values, 'right') - 1,
+                        0, len(self.bins) - 2)
+        self._counts[self._period] += np.bincount(
+            index, minlength=len(self.bins) - 1)
+
+    def roll(self):
+        """Start a new period"""
+        self._period = (self._period + 1) % len(self._counts)
+        self._counts[self._period] = 0
+
+    @property
+    def counts(self):
+        """The counts of the last n_periods periods"""
+        return self._counts.sum(axis=0)
+
+    def to_dict(self):
+        return {'bins': self.bins.tolist(), 'counts': self.counts.tolist()}
+
+
+FIT_HISTOGRAMS = {'reco_zenith': np.linspace(0, 180, 37),
+                  'quality_parameter': np.r_[0, np.logspace(-1, 3, 41)],
+                  'dc': np.linspace(0, 100, 51),
+                  'nfcn': np.r_[0, np.logspace(0, 4, 41)]}
+LATENCY_BINS = np.r_[0, np.logspace(-3, 4, 71)]  # ms
+
+
+class FitFeed(object):
+    """Aggregates the fits and stage times of the events for publishing.
+
+    add() is called for each event with the fit dicts of the ROyFitter
+    (see ROyFitter, blob['ROyFits']) and the stage latencies in seconds.
+    Every interval seconds, add() returns a message with the rolling
+    histograms (over the last n_periods intervals), the counters and the
+    latest valid fit, otherwise None. Only the event fits (line=-1) are
+    histogrammed, the line fits of the multi_line mode are just counted.
+
+    """
+    def __init__(self, interval=1., n_periods=60):
+        self.interval = interval
+        self.histograms = dict((name, RollingHistogram(bins, n_periods))
+                               for name, bins in FIT_HISTOGRAMS.items())
+        self.latencies = {}
+        self.n_periods = n_periods
+        self.counters = {'events': 0, 'fits': 0, 'valid_fits': 0}
+        self.latest_fit = None
+        self._next_message = timer() + interval
+
+    def add(self, fits=(), stage_times=None):
+        self.counters['events'] += 1
+        self.add_fits(fits)
+        for stage, elapsed in (stage_times or {}).items():
+            try:
+                histogram = self.latencies[stage]
+            except KeyError:
+                histogram = self.latencies[stage] = \
+                    RollingHistogram(LATENCY_BINS, self.n_periods)
+            histogram.fill(elapsed * 1e3)
+        now = timer()
+        if now < self._next_message:
+            return None
+        self._next_message = now + self.interval
+        return self.message()
+
+    def add_fits(self, fits):
+        """Add fits without counting an event"""
+        for fit in fits:
+            self.counters['fits'] += 1
+            if not fit.get('valid', True):
+                continue
+            self.counters['valid_fits'] += 1
+            if fit.get('line', -1) != -1:
+                continue
+            for name, histogram in self.histograms.items():
+                if name in fit:
+                    histogram.fill(fit[name])
+            self.latest_fit = fit
+
+    def message(self):
+        """The current state as JSON serialisable dict, starts a new period"""
+        message = {'kind': 'royfit_histograms',
+                   'counters': dict(self.counters),
+                   'latest_fit': self.latest_fit,
+                   'histograms': dict((name, histogram.to_dict())
+                                      for name, histogram
+                                      in self.histograms.items()),
+                   'latency_ms': dict((name, histogram.to_dict())
+                                      for name, histogram
+                                      in self.latencies.items())}
+        for histogram in list(self.histograms.values()) + \
+                list(self.latencies.values()):
+            histogram.roll()
+        return message
+
+
+def json_safe(value):
+    """value with the non-finite floats (NaN, inf) replaced by None"""
+    if isinstance(value, dict):
+        return dict((key, json_safe(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+class AsyncPublisher(object):
+    """Publishes JSON messages via UDP or TCP from an asyncio event loop.
+
+    The loop runs in a daemon thread. publish() only hands the message to
+    the loop and returns immediately; if max_queue messages are waiting,
+    the message is dropped and counted in self.dropped. UDP messages are
+    single datagrams, TCP messages are newline delimited and the
+    connection is reopened after an error. NaN and inf are sent as null,
+    so the messages are valid JSON.
+
+    """
+    def __init__(self, address, protocol='udp', max_queue=100):
+        if protocol not in ('udp', 'tcp'):
+            raise ValueError("Unknown protocol: {0}".format(protocol))
+        self.address = tuple(address)
+        self.protocol = protocol
+        self.max_queue = max_queue
+        self.published = 0
+        self.dropped = 0
+        self.errors = 0
+        self._closing = False
+        self._transport = None
+        self._writer = None
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name='AsyncPublisher')
+        self._thread.daemon = True
+        self._thread.start()
+        self._ready.wait()
+
+    def publish(self, message):
+        """Queue a message for sending, never blocks"""
+        if self._closing:
+            return False
+        self._loop.call_soon_threadsafe(self._enqueue, message)
+        return True
+
+    def close(self, timeout=1.):
+        """Send the queued messages (waiting at most timeout seconds)"""
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.call_soon_threadsafe(self._enqueue, None)
+        self._thread.join(timeout)
+
+    def _enqueue(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            if message is None:
+                self._queue.get_nowait()
+                self._queue.put_nowait(None)
+            self.dropped += 1
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._loop.close()
+
+    async def _serve(self):
+        self._queue = asyncio.Queue(self.max_queue)
+        self._ready.set()
+        while True:
+            message = await self._queue.get()
+            if message is None:
+                break
+            try:
+                data = json.dumps(json_safe(message), allow_nan=False)
+                await self._send(data.encode('utf-8'))
+            except (OSError, TypeError, ValueError):
+                self.errors += 1
+                self._disconnect()
+            else:
+                self.published += 1
+        self._disconnect()
+
+    async def _send(self, data):
+        if self.protocol == 'udp':
+            if self._transport is None:
+                self._transport, _ = \
+                    await self._loop.create_datagram_endpoint(
+                        asyncio.DatagramProtocol, remote_addr=self.address)
+            self._transport.sendto(data)
+        else:
+            if self._writer is None:
+                _, self._writer = await asyncio.open_connection(
+                    *self.address)
+            self._writer.write(data + b'\n')
+            await self._writer.drain()
+
+    def _disconnect(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
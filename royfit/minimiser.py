@@ -10,34 +10,56 @@ __author__ = 'Tamas Gal'
 __email__ = 'tamas.gal@physik.uni-erlangen.de'
 
 import numpy as np
-from km3pipe import constants
 
 
 n = 1.3797
-c = constants.c / 1e9
+c = 0.299792458 # speed of light in vacuum [m/ns], km3pipe's constants.c / 1e9
 
 class SingleStringParameters(object):
     def __init__(self, t, z, c, sigma_t=10, d0=50, d1=5):
         self.t = np.array(t) # measured hit times
         self.z = np.array(z) # z-component of hit PMT
         self.c = np.array(c) # charges or pmt_hit_counts (within a given deltat)
-        self.c_mean = sum(self.c) / len(self.c)
+        self.n_hits = len(self.t)
+        self.c_mean = np.sum(self.c) / self.n_hits
         self.sigma_t = sigma_t # time error in ns
         self.d0 = d0 # distance to photon which induces 1pe
         self.d1 = d1 # minimum distance
 
+        # constants which do not depend on the track parameters
+        self.n2_1 = n**2 - 1
+        self.sqrt_n2_1 = np.sqrt(self.n2_1)
+        self.k = n / self.sqrt_n2_1 # D_gamma = k * (perpendicular distance)
+        self.inv_sigma_t2 = 1. / sigma_t**2
+        self.d1_2 = d1**2
+
     def D_gamma(self, uz, zc, dc):
         """Travel path"""
-        return (n/np.sqrt(n**2 - 1))*np.sqrt(dc**2 + ((self.z-zc)**2)*(1-uz**2))
+        return self.k*np.sqrt(dc**2 + ((self.z-zc)**2)*(1-uz**2))
 
     def T_gamma(self, uz, zc, dc, tc):
         """Arrival time of a Cherenkov photon"""
-        return tc+((self.z-zc)*uz+(n**2-1)*self.D_gamma(uz,zc,dc)/n)/c
+        return tc+((self.z-zc)*uz+self.n2_1*self.D_gamma(uz,zc,dc)/n)/c
 
     def Cos_theta(self, uz, zc, dc):
         """Inclination with respect to (0, 0, 1)"""
         return (1-uz**2)*(self.z-zc)/self.D_gamma(uz, zc, dc) + uz/n
 
+    def evaluate(self, uz, zc, dc, tc):
+        """Calculate all the intermediate arrays in a single pass.
+
+        Returns a tuple (w, R, D_gamma, residual, cos_theta), where
+        w = z - zc, R is the perpendicular photon path, D_gamma = k*R and
+        residual = T_gamma - t. Each array is computed exactly once.
+
+        """
+        w = self.z - zc
+        R = np.sqrt(dc**2 + w*w*(1 - uz**2))
+        D_gamma = self.k * R
+        residual = (w*uz + self.sqrt_n2_1*R) / c + (tc - self.t)
+        cos_theta = (1 - uz**2) * w / D_gamma + uz/n
+        return w, R, D_gamma, residual, cos_theta
+
 
 class QualityFunction(SingleStringParameters):
     """Creates the quality function for the minimiser.
@@ -49,7 +71,281 @@ class QualityFunction(SingleStringParameters):
         # first weighting
         #return sum((self.T_gamma(uz, zc, dc, tc) - self.t)**2 / self.sigma_t**2 + (self.c * np.sqrt(self.d1**2 + self.D_gamma(uz, zc, dc)**2))/(self.c_mean * self.d0))
 
-        aip = 2.*self.c/(self.Cos_theta(uz, zc, dc) + 1.)
-        avg_aip = sum(aip)/len(aip)
-        D  = np.sqrt(self.d1**2 + self.D_gamma(uz, zc, dc)**2)
-        return sum((self.T_gamma( uz, zc, dc, tc) - self.t)**2 / self.sigma_t**2 + aip*D/(avg_aip*self.d0))
+        _, _, D_gamma, residual, cos_theta = self.evaluate(uz, zc, dc, tc)
+        return self._quality(D_gamma, residual, cos_theta)
+
+    def _quality(self, D_gamma, residual, cos_theta):
+        aip = 2.*self.c/(cos_theta + 1.)
+        D = np.sqrt(self.d1_2 + D_gamma*D_gamma)
+        chi2 = np.dot(residual, residual) * self.inv_sigma_t2
+        return chi2 + self.n_hits*np.dot(aip, D) / (np.sum(aip)*self.d0)
+
+    def grad(self, uz, zc, dc, tc):
+        """Analytic gradient of the quality function.
+
+        Returns the partial derivatives with respect to (uz, zc, dc, tc),
+        in the same order as the arguments of __call__, so it can be
+        passed to the minimiser directly.
+
+        """
+        w, R, D_gamma, residual, cos_theta = self.evaluate(uz, zc, dc, tc)
+        aip = 2.*self.c/(cos_theta + 1.)
+        D = np.sqrt(self.d1_2 + D_gamma*D_gamma)
+
+        # partial derivatives of R with respect to uz, zc and dc
+        dR = (-uz * w*w / R, -(1 - uz**2) * w / R, dc / R)
+        dT = ((w + self.sqrt_n2_1 * dR[0]) / c,
+              (-uz + self.sqrt_n2_1 * dR[1]) / c,
+              self.sqrt_n2_1 * dR[2] / c)
+        dcos_dR = -(1 - uz**2) * w / (D_gamma * R)
+        dcos = (-2 * uz * w / D_gamma + dcos_dR * dR[0] + 1/n,
+                -(1 - uz**2) / D_gamma + dcos_dR * dR[1],
+                dcos_dR * dR[2])
+
+        sum_aip = np.sum(aip)
+        sum_aip_D = np.dot(aip, D)
+        daip_dcos = -aip / (cos_theta + 1.)
+        dD_dR = D_gamma * self.k / D
+
+        gradient = []
+        for dR_i, dT_i, dcos_i in zip(dR, dT, dcos):
+            daip = daip_dcos * dcos_i
+            dD = dD_dR * dR_i
+            d_chi2 = 2 * np.dot(residual, dT_i) * self.inv_sigma_t2
+            d_amplitude = self.n_hits * (
+                (np.dot(daip, D) + np.dot(aip, dD)) * sum_aip
+                - sum_aip_D * np.sum(daip)) / (sum_aip**2 * self.d0)
+            gradient.append(d_chi2 + d_amplitude)
+        gradient.append(2 * np.sum(residual) * self.inv_sigma_t2)
+        return gradient
+
+    def scan(self, uz, zc, dc, tc=None):
+        """Evaluate the quality function for many parameter sets at once.
+
+        The (broadcastable) parameter arrays are evaluated in one call.
+        Without tc, the tc which minimises the time residuals is used for
+        each set. Returns the quality values and the tc values.
+
+        """
+        uz, zc, dc = [p[..., np.newaxis]
+                      for p in np.broadcast_arrays(*[np.asarray(p, float)
+                                                     for p in (uz, zc, dc)])]
+        w = self.z - zc
+        R = np.sqrt(dc**2 + w*w*(1 - uz**2))
+        D_gamma = self.k * R
+        residual = (w*uz + self.sqrt_n2_1*R) / c - self.t
+        if tc is None:
+            tc = -np.mean(residual, axis=-1)
+        tc = np.broadcast_to(tc, residual.shape[:-1])
+        residual = residual + tc[..., np.newaxis]
+        cos_theta = (1 - uz**2) * w / D_gamma + uz/n
+        aip = 2.*self.c/(cos_theta + 1.)
+        D = np.sqrt(self.d1_2 + D_gamma*D_gamma)
+        chi2 = np.sum(residual*residual, axis=-1) * self.inv_sigma_t2
+        amplitude = self.n_hits * np.sum(aip*D, axis=-1) \
+            / (np.sum(aip, axis=-1)*self.d0)
+        return chi2 + amplitude, tc
+
+
+class ProfiledQualityFunction(QualityFunction):
+    """The quality function with tc eliminated analytically.
+
+    T_gamma is linear in tc and the amplitude term does not depend on it,
+    so for given (uz, zc, dc) the minimum in tc is at the mean of
+    t - T_gamma(tc=0). The minimiser only has to find uz, zc and dc.
+
+    """
+    def __call__(self, uz, zc, dc):
+        _, _, D_gamma, residual, cos_theta = self.evaluate(uz, zc, dc, 0.)
+        residual -= np.mean(residual)
+        return self._quality(D_gamma, residual, cos_theta)
+
+    def grad(self, uz, zc, dc):
+        """The gradient, which is the one of QualityFunction at best tc"""
+        tc = self.best_tc(uz, zc, dc)
+        return QualityFunction.grad(self, uz, zc, dc, tc)[:3]
+
+    def best_tc(self, uz, zc, dc):
+        """The tc which minimises the quality function"""
+        return -np.mean(self.evaluate(uz, zc, dc, 0.)[3])
+
+    def complete(self, values, errors):
+        """Add the profiled parameters to the fit values and errors.
+
+        The error of tc is the one for fixed (uz, zc, dc).
+
+        """
+        values, errors = dict(values), dict(errors)
+        values['tc'] = self.best_tc(values['uz'], values['zc'], values['dc'])
+        errors['tc'] = self.sigma_t / np.sqrt(self.n_hits)
+        return values, errors
+
+
+class ZcScanQualityFunction(ProfiledQualityFunction):
+    """The quality function with tc and zc eliminated.
+
+    tc is eliminated analytically, zc by scanning zc_values (e.g. the
+    range of the hit z-coordinates in small steps) in one vectorised call,
+    so the minimiser only has to find uz and dc.
+
+    """
+    def __init__(self, t, z, c, sigma_t=10, d0=50, d1=5, zc_values=None):
+        super(ZcScanQualityFunction, self).__init__(t, z, c, sigma_t=sigma_t,
+                                                    d0=d0, d1=d1)
+        if zc_values is None:
+            zc_values = np.arange(self.z.min(), self.z.max() + 1.)
+        self.zc_values = np.asarray(zc_values, dtype=float)
+
+    def __call__(self, uz, dc):
+        return np.min(self.scan(uz, self.zc_values, dc)[0])
+
+    def grad(self, uz, dc):
+        zc = self.best_zc(uz, dc)
+        gradient = ProfiledQualityFunction.grad(self, uz, zc, dc)
+        return [gradient[0], gradient[2]]
+
+    def best_zc(self, uz, dc):
+        """The scanned zc value with the lowest quality function value"""
+        return self.zc_values[np.argmin(self.scan(uz, self.zc_values, dc)[0])]
+
+    def complete(self, values, errors):
+        """Add the profiled parameters, the error of zc is unknown (NaN)"""
+        values, errors = dict(values), dict(errors)
+        values['zc'] = self.best_zc(values['uz'], values['dc'])
+        errors['zc'] = np.nan
+        return super(ZcScanQualityFunction, self).complete(values, errors)
+
+
+def grid_seeds(quality_function, zc, uz_values, dc_values, n_seeds=1):
+    """Start values from a scan of the quality function on a (uz, dc) grid.
+
+    zc is kept fixed and tc is calculated for each grid point (see
+    QualityFunction.scan). Returns the n_seeds best grid points as
+    (uz, zc, dc, tc) tuples, best first.
+
+    """
+    uz, dc = np.meshgrid(uz_values, dc_values, indexing='ij')
+    uz, dc = uz.ravel(), dc.ravel()
+    quality, tc = quality_function.scan(uz, zc, dc)
+    best = np.argsort(quality, kind='mergesort')[:n_seeds]
+    return [(uz[i], zc, dc[i], tc[i]) for i in best]
+
+
+class BatchQualityFunction(object):
+    """The quality function for many single string events at once.
+
+    The hits of each event are padded to a common length and the padded
+    entries are masked out, so all events are evaluated in one vectorised
+    call. The track parameters are arrays with one entry per event.
+
+    The quality function is expressed as the sum of squares of a residual
+    vector (time residuals and the square roots of the amplitude terms),
+    which is what least squares solvers like Levenberg-Marquardt work on.
+    With amplitude=False, only the time residuals are used.
+
+    """
+    def __init__(self, t, z, c, sigma_t=10, d0=50, d1=5, amplitude=True):
+        self.n_hits = np.array([len(hits) for hits in t], dtype=int)
+        self.n_events = len(self.n_hits)
+        max_hits = self.n_hits.max() if self.n_events else 0
+        self.mask = np.arange(max_hits) < self.n_hits[:, np.newaxis]
+        self.t = self._pad(t) # measured hit times
+        self.z = self._pad(z) # z-component of hit PMT
+        self.c = self._pad(c) # charges or pmt_hit_counts
+        self.sigma_t = sigma_t
+        self.d0 = d0
+        self.d1 = d1
+        self.amplitude = amplitude
+
+        self.sqrt_n2_1 = np.sqrt(n**2 - 1)
+        self.k = n / self.sqrt_n2_1
+
+    def _pad(self, values):
+        """Put the ragged per event values into a zero padded 2D array"""
+        padded = np.zeros(self.mask.shape)
+        if self.n_events:
+            padded[self.mask] = np.concatenate([np.asarray(v, dtype=float)
+                                                for v in values])
+        return padded
+
+    def __call__(self, uz, zc, dc, tc):
+        params = np.column_stack((uz, zc, dc, tc))
+        residuals = self.residuals(params)
+        return np.sum(residuals**2, axis=1)
+
+    def residuals(self, params, index=None):
+        """Residual vectors for the parameters of shape (n_events, 4)"""
+        return self._terms(params, index, jacobian=False)[0]
+
+    def residuals_and_jacobian(self, params, index=None):
+        """Residual vectors and their Jacobians with respect to the params.
+
+        params holds (uz, zc, dc, tc) for each event, index optionally
+        selects a subset of the events. The residuals have the shape
+        (n_events, 2*max_hits), the Jacobians (n_events, 2*max_hits, 4).
+
+        """
+        return self._terms(params, index, jacobian=True)
+
+    def _terms(self, params, index, jacobian):
+        if index is None:
+            index = slice(None)
+        t, z, counts = self.t[index], self.z[index], self.c[index]
+        mask, n_hits = self.mask[index], self.n_hits[index]
+        params = np.asarray(params, dtype=float)
+        uz, zc, dc, tc = [p[:, np.newaxis] for p in params.T]
+
+        w = z - zc
+        R = np.sqrt(dc**2 + w*w*(1 - uz**2))
+        D_gamma = self.k * R
+        residual = ((w*uz + self.sqrt_n2_1*R) / c + (tc - t)) * mask
+        if not self.amplitude:
+            return self._time_terms(residual, mask, uz, w, R, dc, jacobian)
+        cos_theta = (1 - uz**2) * w / D_gamma + uz/n
+        aip = 2.*counts/(cos_theta + 1.)
+        D = np.sqrt(self.d1**2 + D_gamma*D_gamma)
+        sum_aip = np.sum(aip, axis=1)[:, np.newaxis]
+        norm = n_hits[:, np.newaxis] / (sum_aip * self.d0)
+        amplitude = np.sqrt(norm * aip * D)
+        residuals = np.hstack((residual / self.sigma_t, amplitude))
+        if not jacobian:
+            return residuals, None
+
+        dR = (-uz * w*w / R, -(1 - uz**2) * w / R, dc / R)
+        dT = ((w + self.sqrt_n2_1 * dR[0]) / c,
+              (-uz + self.sqrt_n2_1 * dR[1]) / c,
+              self.sqrt_n2_1 * dR[2] / c)
+        dcos_dR = -(1 - uz**2) * w / (D_gamma * R)
+        dcos = (-2 * uz * w / D_gamma + dcos_dR * dR[0] + 1/n,
+                -(1 - uz**2) / D_gamma + dcos_dR * dR[1],
+                dcos_dR * dR[2])
+        daip_dcos = -aip / (cos_theta + 1.)
+        dD_dR = D_gamma * self.k / D
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_amplitude = np.where(mask, 0.5 / amplitude, 0.)
+
+        jac = np.zeros(residuals.shape + (4,))
+        n_max = t.shape[1]
+        for i in range(3):
+            daip = daip_dcos * dcos[i]
+            dD = dD_dR * dR[i]
+            d_sum_aip = np.sum(daip, axis=1)[:, np.newaxis]
+            d_term = norm * (daip*D + aip*dD - aip*D*d_sum_aip/sum_aip)
+            jac[:, :n_max, i] = dT[i] * mask / self.sigma_t
+            jac[:, n_max:, i] = d_term * inv_amplitude
+        jac[:, :n_max, 3] = mask / self.sigma_t
+        return residuals, jac
+
+    def _time_terms(self, residual, mask, uz, w, R, dc, jacobian):
+        """Residuals and Jacobians without the amplitude terms"""
+        residuals = residual / self.sigma_t
+        if not jacobian:
+            return residuals, None
+        dR = (-uz * w*w / R, -(1 - uz**2) * w / R, dc / R)
+        jac = np.empty(residuals.shape + (4,))
+        jac[..., 0] = (w + self.sqrt_n2_1 * dR[0]) / c
+        jac[..., 1] = (-uz + self.sqrt_n2_1 * dR[1]) / c
+        jac[..., 2] = self.sqrt_n2_1 * dR[2] / c
+        jac[..., 3] = 1
+        jac *= (mask / self.sigma_t)[..., np.newaxis]
+        return residuals, jac
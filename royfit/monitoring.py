@@ -0,0 +1,118 @@
+# coding=utf-8
+# Filename: monitoring.py
+"""
+Non-blocking UDP feed of reconstruction parameters for ROyWeb.
+
+The messages are JSON objects. They are queued by the pipeline and sent
+from a background thread, several messages in one datagram as a JSON list.
+
+"""
+from __future__ import division, absolute_import, print_function
+import json
+import socket
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+
+class DatagramSender(object):
+    """Sends messages as batched UDP datagrams from a background thread.
+
+    send() never blocks: the messages go into a queue of at most
+    max_queue entries and are dropped (and counted in self.dropped) when
+    it is full. The thread collects the queued messages for batch_interval
+    seconds (or only the ones which are already waiting, if it is 0) and
+    packs them into datagrams of at most max_datagram_size bytes. A single
+    socket is used for all datagrams, messages which could not be sent
+    are counted in self.errors.
+
+        >>> sender = DatagramSender(('localhost', 9999))
+        >>> sender.send([{'kind': 'parameter', 'type': 'Zenith', ...}])
+        >>> sender.close()
+
+    """
+    def __init__(self, address, max_queue=1000, batch_interval=0,
+                 max_datagram_size=8192):
+        self.address = address
+        self.batch_interval = batch_interval
+        self.max_datagram_size = max_datagram_size
+        self.sent = 0
+        self.datagrams = 0
+        self.dropped = 0
+        self.errors = 0
+        self._queue = queue.Queue(max_queue)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name='DatagramSender')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, messages):
+        """Queue a list of messages, returns False if they were dropped"""
+        try:
+            self._queue.put_nowait(messages)
+        except queue.Full:
+            self.dropped += len(messages)
+            return False
+        return True
+
+    def close(self, timeout=1.):
+        """Send the queued messages (waiting at most timeout seconds)"""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._thread.join(timeout)
+        self._socket.close()
+
+    def _run(self):
+        while not (self._closed.is_set() and self._queue.empty()):
+            try:
+                messages = list(self._queue.get(timeout=0.1))
+            except queue.Empty:
+                continue
+            deadline = time.time() + self.batch_interval
+            n_batched = 1
+            while n_batched < self._queue.maxsize:
+                timeout = min(deadline - time.time(), 0.1)
+                waiting = timeout > 0 and not self._closed.is_set()
+                try:
+                    messages.extend(self._queue.get(timeout=timeout)
+                                    if waiting else self._queue.get_nowait())
+                except queue.Empty:
+                    if waiting:
+                        continue
+                    break
+                n_batched += 1
+            for datagram, n_messages in self._datagrams(messages):
+                try:
+                    self._socket.sendto(datagram, self.address)
+                except (socket.error, OSError):
+                    self.errors += n_messages
+                else:
+                    self.datagrams += 1
+                    self.sent += n_messages
+
+    def _datagrams(self, messages):
+        """Pack the encoded messages into JSON lists of limited size"""
+        batch, size = [], 2
+        for message in messages:
+            try:
+                message = json.dumps(message).encode('utf-8')
+            except (TypeError, ValueError):
+                self.errors += 1
+                continue
+            if batch and size + len(message) + 1 > self.max_datagram_size:
+                yield b'[' + b','.join(batch) + b']', len(batch)
+                batch, size = [], 2
+            batch.append(message)
+            size += len(message) + 1
+        if batch:
+            yield b'[' + b','.join(batch) + b']', len(batch)
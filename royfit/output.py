@@ -0,0 +1,150 @@
+# coding=utf-8
+# Filename: output.py
+"""
+Append-only fit result files, written in chunks during the run.
+
+The files are plain .npy files with a 1D structured array of FIT_DTYPE,
+so they can be opened with numpy.load(filename, mmap_mode='r'). The header
+is reserved with a fixed size and rewritten after each chunk, so a file
+is always readable up to the last flushed chunk, even after a crash.
+
+"""
+from __future__ import division, absolute_import, print_function
+import os
+import struct
+
+import numpy as np
+
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+
+FIT_DTYPE = np.dtype([('event', '<i8'),
+                      ('line', '<i8'),
+                      ('valid', '?'),
+                      ('mc_zenith', '<f8'),
+                      ('reco_zenith', '<f8'),
+                      ('quality_parameter', '<f8'),
+                      ('zc', '<f8'),
+                      ('dc', '<f8'),
+                      ('tc', '<f8'),
+                      ('uz', '<f8'),
+                      ('zc_err', '<f8'),
+                      ('dc_err', '<f8'),
+                      ('tc_err', '<f8'),
+                      ('uz_err', '<f8')])
+
+MAGIC = b'\x93NUMPY\x01\x00'
+HEADER_SIZE = 512
+
+
+def _header(dtype, n_rows):
+    """The .npy (version 1.0) header, padded to HEADER_SIZE bytes"""
+    header = "{{'descr': {0!r}, 'fortran_order': False, 'shape': ({1},), }}" \
+        .format(np.lib.format.dtype_to_descr(dtype), n_rows)
+    header_length = HEADER_SIZE - len(MAGIC) - 2
+    if len(header) >= header_length:
+        raise ValueError("The dtype is too large for the .npy header.")
+    header = header.ljust(header_length - 1) + '\n'
+    return MAGIC + struct.pack('<H', header_length) + header.encode('latin1')
+
+
+def _read_header(file):
+    """Return (dtype, n_rows) of an .npy file, leaves file at the data"""
+    version = np.lib.format.read_magic(file)
+    if version != (1, 0):
+        raise ValueError("Unsupported .npy version: {0}".format(version))
+    shape, _, dtype = np.lib.format.read_array_header_1_0(file)
+    return dtype, shape[0]
+
+
+class FitWriter(object):
+    """Writes fit results to an .npy file in chunks of flush_every rows.
+
+    Rows are collected in a preallocated buffer and appended to the file
+    when it is full, on flush() and on close(). With append=True the rows
+    of an existing file (with the same dtype) are kept.
+
+        >>> with FitWriter('fits.npy') as writer:
+        ...     writer.write(event=1, reco_zenith=42.0)
+
+    Fields which are not given are set to NaN (0 or False for the others).
+
+    """
+    def __init__(self, filename, flush_every=1000, append=False,
+                 dtype=FIT_DTYPE):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.flush_every = flush_every
+        self._buffer = np.zeros(flush_every, dtype=self.dtype)
+        self._empty_row = np.zeros(1, dtype=self.dtype)[0]
+        for name in self.dtype.names:
+            if self.dtype[name].kind == 'f':
+                self._empty_row[name] = np.nan
+        self._n_buffered = 0
+        if append and os.path.exists(filename):
+            self._file = open(filename, 'r+b')
+            dtype, self.n_rows = _read_header(self._file)
+            if dtype != self.dtype or self._file.tell() != HEADER_SIZE:
+                self._file.close()
+                raise ValueError("Cannot append to {0}, it was not written "
+                                 "by a FitWriter with the same dtype."
+                                 .format(filename))
+            # drop anything behind the last complete chunk
+            self._file.truncate(HEADER_SIZE + self.n_rows * dtype.itemsize)
+        else:
+            self._file = open(filename, 'w+b')
+            self.n_rows = 0
+            self._file.write(_header(self.dtype, 0))
+        self._file.seek(0, os.SEEK_END)
+
+    def write(self, **values):
+        """Add a row, the buffer is flushed when it is full"""
+        self._buffer[self._n_buffered] = self._empty_row
+        row = self._buffer[self._n_buffered]
+        for name, value in values.items():
+            row[name] = value
+        self._n_buffered += 1
+        if self._n_buffered == self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered rows and update the row count in the header"""
+        if not self._n_buffered:
+            return
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(self._buffer[:self._n_buffered].tobytes())
+        self.n_rows += self._n_buffered
+        self._n_buffered = 0
+        self._file.flush()
+        self._file.seek(0)
+        self._file.write(_header(self.dtype, self.n_rows))
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __len__(self):
+        return self.n_rows + self._n_buffered
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_fits(filename, mmap=True):
+    """Return the fit results of a file as (memory-mapped) structured array"""
+    with open(filename, 'rb') as file:
+        dtype, n_rows = _read_header(file)
+        offset = file.tell()
+    if not n_rows:
+        return np.zeros(0, dtype=dtype)
+    if not mmap:
+        return np.fromfile(filename, dtype=dtype, count=n_rows, offset=offset)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset,
+                     shape=(n_rows,))
@@ -0,0 +1,149 @@
+# coding=utf-8
+# Filename: parallel.py
+"""
+Event parallel processing of the ROyFit chain with a process pool.
+
+The event index range is split into contiguous shards, each shard is
+processed by a complete pipeline in a worker process and the statistics
+of the ROyFitter are merged in event order afterwards.
+
+"""
+from __future__ import division, absolute_import, print_function
+from functools import partial
+import multiprocessing
+import os
+import pickle
+
+import numpy as np
+
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+
+def shard_ranges(index_start, index_stop, n_shards):
+    """Split [index_start, index_stop) into n_shards contiguous ranges"""
+    n_shards = max(1, min(n_shards, index_stop - index_start))
+    bounds = np.linspace(index_start, index_stop, n_shards + 1).astype(int)
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def merge_stats(shard_stats):
+    """Merge the ROyFitter stats of consecutive shards.
+
+    The per event lists are concatenated in the order of the shards, the
+    counters and histograms (e.g. the ZenithResolution) are added up and
+    the fit parameters are taken from the first shard.
+
+    """
+    stats = {}
+    for shard in shard_stats:
+        for name, value in shard.items():
+            if isinstance(value, list):
+                stats.setdefault(name, []).extend(value)
+            elif hasattr(value, 'merge'):
+                if name in stats:
+                    stats[name].merge(value)
+                else:
+                    stats[name] = value.copy()
+            elif name.startswith('number_of_'):
+                stats[name] = stats.get(name, 0) + value
+            else:
+                stats.setdefault(name, value)
+    return stats
+
+
+def run_shards(worker, index_start, index_stop, n_workers=None,
+               n_shards=None):
+    """Process the shards of the index range with worker and merge the stats.
+
+    worker((start, stop)) must return the stats of its shard and has to be
+    picklable, i.e. a module level function or a partial of one. The
+    results are collected in shard order, so the merged stats do not
+    depend on the scheduling of the workers.
+
+    """
+    n_workers = n_workers or multiprocessing.cpu_count()
+    shards = shard_ranges(index_start, index_stop, n_shards or n_workers)
+    if n_workers == 1:
+        return merge_stats(worker(shard) for shard in shards)
+    pool = multiprocessing.Pool(n_workers)
+    try:
+        shard_stats = pool.map(worker, shards, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return merge_stats(shard_stats)
+
+
+def default_chain(**fit_parameters):
+    """The modules of examples/run_royfit.py as (module_class, kwargs)"""
+    from royfit.core import (OMRawHitMerger, TOTFilter, FirstOMHitFilter,
+                             T3HitSelector, ROyFitter)
+    fit_parameters.setdefault('input_hits', 'FirstT3Hits')
+    return [(OMRawHitMerger, dict(time_window=30)),
+            (TOTFilter, dict(input_hits='MergedEvtRawHits',
+                             output_hits='LongToTHits',
+                             min_tot=45)),
+            (FirstOMHitFilter, dict(input_hits='LongToTHits',
+                                    output_hits='FirstOMHits')),
+            (T3HitSelector, dict(adjacent_t=200, next_to_adjacent_t=400,
+                                 input_hits='FirstOMHits',
+                                 candidate_hits='EvtRawHits',
+                                 output_hits='T3Hits')),
+            (FirstOMHitFilter, dict(input_hits='T3Hits',
+                                    output_hits='FirstT3Hits')),
+            (ROyFitter, fit_parameters)]
+
+
+def process_shard(shard, pump_parameters, geometry_file, chain):
+    """Run EvtPump, Geometry and the chain on one shard, return the stats.
+
+    An output_file of the ROyFitter gets the shard as suffix, e.g.
+    fits_1-50.npy, so the workers do not write to the same file.
+
+    """
+    from km3pipe import Pipeline, Geometry
+    from km3pipe.pumps import EvtPump
+    from royfit.core import ROyFitter
+
+    index_start, index_stop = shard
+    pipe = Pipeline()
+    pipe.attach(EvtPump, index_start=index_start, index_stop=index_stop,
+                **pump_parameters)
+    pipe.attach(Geometry, filename=geometry_file)
+    for module_class, parameters in chain:
+        if module_class is ROyFitter and parameters.get('output_file'):
+            root, ext = os.path.splitext(parameters['output_file'])
+            parameters = dict(parameters, output_file='{0}_{1}-{2}{3}'
+                              .format(root, index_start, index_stop, ext))
+        pipe.attach(module_class, **parameters)
+    pipe.drain()
+    fitters = [module for module in pipe.modules
+               if isinstance(module, ROyFitter)]
+    return fitters[-1].stats
+
+
+def run_royfit(pump_parameters, geometry_file, index_start, index_stop,
+               n_workers=None, chain=None, stats_file=None):
+    """Fit the events [index_start, index_stop) with n_workers processes.
+
+    pump_parameters are passed to the EvtPump (e.g. basename or filename),
+    chain defaults to default_chain(). The ROyFitters in the workers do not
+    write their own stats, the merged stats are returned and saved to
+    stats_file if given.
+
+    """
+    if chain is None:
+        chain = default_chain()
+    chain = [(module_class, dict(parameters, dump_stats=False))
+             if module_class.__name__ == 'ROyFitter'
+             else (module_class, parameters)
+             for module_class, parameters in chain]
+    worker = partial(process_shard, pump_parameters=pump_parameters,
+                     geometry_file=geometry_file, chain=chain)
+    stats = run_shards(worker, index_start, index_stop, n_workers)
+    if stats_file:
+        print("Saving reconstruction statistics to: {0}".format(stats_file))
+        with open(stats_file, 'wb') as file:
+            pickle.dump(stats, file)
+    return stats
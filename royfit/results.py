@@ -0,0 +1,335 @@
+# coding=utf-8
+# Filename: results.py
+"""
+Analysis of ROyFitter results, written by royfit.output.FitWriter.
+
+The files are memory-mapped and cuts only store boolean masks, so the fit
+results are read from disk when a column is actually needed.
+
+    >>> results = Results.open(glob.glob('run_*.npy'))
+    >>> good = results.cut(max_quality=4, max_dc=80)
+    >>> counts, resolution = good.zenith_resolution(np.linspace(0, 180, 19))
+
+"""
+from __future__ import division, absolute_import, print_function
+import bisect
+
+import numpy as np
+
+from .output import FIT_DTYPE, read_fits
+
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+
+class Results(object):
+    """Fit results of many runs, one (memory-mapped) array per run.
+
+    Each chunk has an optional boolean mask with the selected rows. Cuts
+    create a new Results with the combined masks and share the chunks.
+
+    """
+    def __init__(self, chunks, masks=None):
+        self.chunks = list(chunks)
+        if masks is None:
+            masks = [None] * len(self.chunks)
+        self.masks = list(masks)
+
+    @classmethod
+    def open(cls, filenames, mmap=True):
+        """Open one or more result files"""
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        return cls([read_fits(filename, mmap) for filename in filenames])
+
+    @classmethod
+    def from_stats(cls, stats):
+        """Convert the stats dict of the ROyFitter (e.g. from a pickle)"""
+        n_fits = len(stats.get('reco_zenith', []))
+        fits = np.zeros(n_fits, dtype=FIT_DTYPE)
+        fits['event'] = -1
+        fits['line'] = -1
+        fits['valid'] = True
+        for name in FIT_DTYPE.names:
+            if name in stats:
+                fits[name] = stats[name]
+        return cls([fits])
+
+    def __len__(self):
+        return sum(len(chunk) if mask is None else np.count_nonzero(mask)
+                   for chunk, mask in zip(self.chunks, self.masks))
+
+    def __add__(self, other):
+        return self.__class__(self.chunks + other.chunks,
+                              self.masks + other.masks)
+
+    def __repr__(self):
+        return "{0} with {1} fits in {2} chunks".format(
+            self.__class__.__name__, len(self), len(self.chunks))
+
+    def column(self, name):
+        """The values of the selected rows for a field of FIT_DTYPE.
+
+        angular_error (mc_zenith - reco_zenith) is also available.
+
+        """
+        values = [self._chunk_column(chunk, name, mask)
+                  for chunk, mask in zip(self.chunks, self.masks)]
+        if not values:
+            return np.zeros(0)
+        return np.concatenate(values)
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def select(self, function):
+        """Keep the rows where function(chunk) is True, chunk by chunk"""
+        masks = []
+        for chunk, mask in zip(self.chunks, self.masks):
+            selected = np.asarray(function(chunk), dtype=bool)
+            masks.append(selected if mask is None else mask & selected)
+        return self.__class__(self.chunks, masks)
+
+    def cut(self, valid=True, max_quality=None, min_dc=None, max_dc=None,
+            line=None):
+        """Apply the common quality cuts, None means no cut.
+
+        line selects the fits of one line, -1 are the combined fits of the
+        multi_line mode (and all fits of the single line mode).
+
+        """
+        def selection(chunk):
+            selected = np.ones(len(chunk), dtype=bool)
+            if line is not None:
+                selected &= chunk['line'] == line
+            if valid is not None:
+                selected &= chunk['valid'] == valid
+            if max_quality is not None:
+                selected &= chunk['quality_parameter'] < max_quality
+            if min_dc is not None:
+                selected &= chunk['dc'] >= min_dc
+            if max_dc is not None:
+                selected &= chunk['dc'] <= max_dc
+            return selected
+        return self.select(selection)
+
+    def zenith_resolution(self, bins=18, percentiles=(50, 16, 84),
+                          absolute=False, error_bins=None):
+        """Percentiles of the angular error in bins of the MC zenith.
+
+        Returns the number of fits (n_bins,) and the percentiles
+        (n_bins, len(percentiles)), which are NaN for empty bins. With
+        absolute=True, the percentiles of |mc_zenith - reco_zenith| are
+        calculated.
+
+        The exact percentiles need the selected MC zeniths and angular
+        errors in memory and sort them. With error_bins (a number of bins
+        in [-180, 180] or the bin edges), the errors are histogrammed
+        chunk by chunk instead, see histogram(), and the percentiles are
+        interpolated within the error bins.
+
+        """
+        if error_bins is not None:
+            return self.histogram(bins, error_bins).percentiles(percentiles,
+                                                                absolute)
+        zenith = self.column('mc_zenith')
+        error = self.column('angular_error')
+        if absolute:
+            error = np.abs(error)
+        if np.ndim(bins) == 0:
+            bins = np.linspace(0, 180, bins + 1)
+        bins = np.asarray(bins, dtype=float)
+        n_bins = len(bins) - 1
+        bin_index = np.searchsorted(bins, zenith, 'right') - 1
+        bin_index[zenith == bins[-1]] = n_bins - 1
+        in_range = (bin_index >= 0) & (bin_index < n_bins)
+        bin_index, error = bin_index[in_range], error[in_range]
+        return binned_percentiles(bin_index, error, n_bins, percentiles)
+
+    def histogram(self, zenith_bins=90, error_bins=720, block_size=1000000):
+        """Fill the selected fits into a ZenithResolution.
+
+        The chunks are read in blocks of block_size rows, so the memory
+        does not depend on the number of fits.
+
+        """
+        resolution = ZenithResolution(zenith_bins, error_bins)
+        for chunk, mask in zip(self.chunks, self.masks):
+            for start in range(0, len(chunk), block_size):
+                block = slice(start, start + block_size)
+                fits = chunk[block]
+                if mask is not None:
+                    fits = fits[mask[block]]
+                resolution.fill(fits['mc_zenith'], fits['reco_zenith'])
+        return resolution
+
+    def _chunk_column(self, chunk, name, mask):
+        if name == 'angular_error':
+            values = chunk['mc_zenith'] - chunk['reco_zenith']
+        else:
+            values = chunk[name]
+        if mask is not None:
+            return values[mask]
+        return np.array(values)
+
+
+def binned_percentiles(bin_index, values, n_bins, percentiles):
+    """Linear interpolated percentiles (like np.percentile) for each bin"""
+    order = np.lexsort((values, bin_index))
+    values = values[order]
+    counts = np.bincount(bin_index, minlength=n_bins)
+    offsets = np.r_[0, np.cumsum(counts)[:-1]]
+    positions = (counts[:, np.newaxis] - 1) \
+        * np.asarray(percentiles, dtype=float)[np.newaxis, :] / 100
+    lower = np.floor(positions).astype(int)
+    upper = np.minimum(lower + 1, counts[:, np.newaxis] - 1)
+    fraction = positions - lower
+    result = np.full(positions.shape, np.nan)
+    filled = counts > 0
+    lower_values = values[(offsets[:, np.newaxis] + lower)[filled]]
+    upper_values = values[(offsets[:, np.newaxis] + upper)[filled]]
+    result[filled] = lower_values + fraction[filled] \
+        * (upper_values - lower_values)
+    return counts, result
+
+
+class ZenithResolution(object):
+    """Online MC vs reco zenith histograms with fixed bins.
+
+    For each MC zenith bin, the reco zenith and the angular error
+    (mc_zenith - reco_zenith) are counted in fixed bins, so the memory does
+    not grow with the number of fits. Histograms with the same bins can be
+    merged (e.g. from several workers) and saved at any time.
+
+        >>> resolution = ZenithResolution()
+        >>> resolution.fill(mc_zenith, reco_zenith)
+        >>> counts, percentiles = resolution.percentiles((50, 16, 84))
+
+    """
+    def __init__(self, zenith_bins=90, error_bins=720):
+        if np.ndim(zenith_bins) == 0:
+            zenith_bins = np.linspace(0, 180, zenith_bins + 1)
+        if np.ndim(error_bins) == 0:
+            error_bins = np.linspace(-180, 180, error_bins + 1)
+        self.zenith_bins = np.asarray(zenith_bins, dtype=float)
+        self.error_bins = np.asarray(error_bins, dtype=float)
+        self._zenith_edges = self.zenith_bins.tolist()
+        self._error_edges = self.error_bins.tolist()
+        n_zenith, n_error = len(self.zenith_bins) - 1, len(self.error_bins) - 1
+        self.counts = np.zeros((n_zenith, n_zenith), dtype=np.int64)
+        self.error_counts = np.zeros((n_zenith, n_error), dtype=np.int64)
+
+    def fill(self, mc_zenith, reco_zenith):
+        """Add one or more fits, values outside the bins are ignored"""
+        if np.ndim(mc_zenith) == 0 and np.ndim(reco_zenith) == 0:
+            self._fill_one(float(mc_zenith), float(reco_zenith))
+            return
+        mc_zenith = np.atleast_1d(np.asarray(mc_zenith, dtype=float))
+        reco_zenith = np.atleast_1d(np.asarray(reco_zenith, dtype=float))
+        mc_bin = _bin_index(self.zenith_bins, mc_zenith)
+        reco_bin = _bin_index(self.zenith_bins, reco_zenith)
+        error_bin = _bin_index(self.error_bins, mc_zenith - reco_zenith)
+        both = (mc_bin >= 0) & (reco_bin >= 0)
+        np.add.at(self.counts, (mc_bin[both], reco_bin[both]), 1)
+        in_range = (mc_bin >= 0) & (error_bin >= 0)
+        np.add.at(self.error_counts, (mc_bin[in_range], error_bin[in_range]),
+                  1)
+
+    def _fill_one(self, mc_zenith, reco_zenith):
+        """fill() for a single fit, without array operations"""
+        mc_bin = _scalar_bin_index(self._zenith_edges, mc_zenith)
+        if mc_bin < 0:
+            return
+        reco_bin = _scalar_bin_index(self._zenith_edges, reco_zenith)
+        if reco_bin >= 0:
+            self.counts[mc_bin, reco_bin] += 1
+        error_bin = _scalar_bin_index(self._error_edges,
+                                      mc_zenith - reco_zenith)
+        if error_bin >= 0:
+            self.error_counts[mc_bin, error_bin] += 1
+
+    def __len__(self):
+        return int(self.error_counts.sum())
+
+    def merge(self, other):
+        """Add the counts of a ZenithResolution with the same bins"""
+        if not (np.array_equal(self.zenith_bins, other.zenith_bins) and
+                np.array_equal(self.error_bins, other.error_bins)):
+            raise ValueError("Cannot merge histograms with different bins.")
+        self.counts += other.counts
+        self.error_counts += other.error_counts
+        return self
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def copy(self):
+        resolution = self.__class__(self.zenith_bins, self.error_bins)
+        return resolution.merge(self)
+
+    def percentiles(self, percentiles=(50, 16, 84), absolute=False):
+        """Percentiles of the angular error in each MC zenith bin.
+
+        Returns the number of fits (n_bins,) and the percentiles
+        (n_bins, len(percentiles)), interpolated linearly within the error
+        bins and NaN for empty MC zenith bins. With absolute=True, the
+        percentiles of |mc_zenith - reco_zenith| are calculated.
+
+        """
+        bins, counts = self.error_bins, self.error_counts
+        if absolute:
+            bins, counts = _fold(bins, counts)
+        n_fits = counts.sum(axis=1)
+        cumulative = np.cumsum(counts, axis=1)
+        result = np.full((len(n_fits), len(percentiles)), np.nan)
+        for i in np.flatnonzero(n_fits):
+            cdf = np.r_[0, cumulative[i]] / n_fits[i]
+            result[i] = _inverse_cdf(bins, cdf,
+                                     np.asarray(percentiles) / 100.)
+        return n_fits, result
+
+    def save(self, filename):
+        """Write the histograms to an .npz file"""
+        np.savez(filename, zenith_bins=self.zenith_bins,
+                 error_bins=self.error_bins, counts=self.counts,
+                 error_counts=self.error_counts)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            resolution = cls(data['zenith_bins'], data['error_bins'])
+            resolution.counts += data['counts']
+            resolution.error_counts += data['error_counts']
+        return resolution
+
+
+def _bin_index(bins, values):
+    """The bin of each value, -1 for values outside of the bins"""
+    index = np.searchsorted(bins, values, 'right') - 1
+    index[values == bins[-1]] = len(bins) - 2
+    index[(index < 0) | (index >= len(bins) - 1) | np.isnan(values)] = -1
+    return index
+
+
+def _scalar_bin_index(edges, value):
+    """The bin of a single value in the list edges, -1 if outside"""
+    if not edges[0] <= value <= edges[-1]:
+        return -1
+    return min(bisect.bisect_right(edges, value) - 1, len(edges) - 2)
+
+
+def _inverse_cdf(bins, cdf, quantiles):
+    """Quantiles from a histogram CDF, linear within the bins"""
+    rising = np.diff(cdf) > 0
+    edges = np.r_[False, rising] | np.r_[rising, False]
+    return np.interp(quantiles, cdf[edges], bins[edges])
+
+
+def _fold(bins, counts):
+    """Histogram of the absolute values, for bins symmetric around 0"""
+    if not np.allclose(bins, -bins[::-1]):
+        raise ValueError("The error bins are not symmetric around 0.")
+    centre = len(counts[0]) // 2
+    if len(counts[0]) % 2:
+        raise ValueError("The error bins need an edge at 0.")
+    return bins[centre:], counts[:, centre:] + counts[:, :centre][:, ::-1]
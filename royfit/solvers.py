@@ -0,0 +1,110 @@
+# coding=utf-8
+# Filename: solvers.py
+"""
+Least squares solvers working on many events at once.
+
+"""
+from __future__ import division, absolute_import, print_function
+from collections import namedtuple
+
+import numpy as np
+
+__author__ = 'Tamas Gal'
+__email__ = 'tgal@km3net.de'
+
+
+LMResult = namedtuple('LMResult',
+                      'params errors cost converged stuck n_iter n_calls')
+
+
+def levenberg_marquardt(func, p0, lower=None, upper=None, tol=1,
+                        max_iter=100, lambda_ini=1e-3):
+    """Minimise sum(r**2) for a batch of independent problems.
+
+    func(params, index) must return the residuals (n, m) and their
+    Jacobians (n, m, k) for the parameters (n, k) of the events selected
+    by index. p0 holds the start values for all events, lower and upper
+    the (broadcastable) parameter limits. Parameters on a limit are kept
+    fixed while the gradient points out of the allowed range, the other
+    steps are projected back into it.
+
+    Every event has its own damping factor and convergence flag, only
+    events which are still active are evaluated in each iteration. Like
+    MIGRAD, an event has converged when the estimated distance to the
+    minimum drops below 0.002 * tol. Events which cannot improve any
+    further before that (the damping exceeds 1e10) are stopped and flagged
+    as stuck, they are not converged, like an invalid MIGRAD minimum.
+
+    """
+    p = np.array(p0, dtype=float, ndmin=2)
+    n_events, n_params = p.shape
+    lower = np.broadcast_to(-np.inf if lower is None else lower, p.shape)
+    upper = np.broadcast_to(np.inf if upper is None else upper, p.shape)
+    p = np.clip(p, lower, upper)
+
+    all_events = np.arange(n_events)
+    r, jac = func(p, all_events)
+    cost = np.sum(r**2, axis=1)
+    damping = np.full(n_events, lambda_ini)
+    converged = np.zeros(n_events, dtype=bool)
+    stuck = np.zeros(n_events, dtype=bool)
+    n_iter = np.zeros(n_events, dtype=int)
+    n_calls = np.ones(n_events, dtype=int)
+    active = all_events
+
+    for _ in range(max_iter):
+        if not len(active):
+            break
+        n_iter[active] += 1
+        J, residuals = jac[active], r[active]
+        JTJ = np.einsum('nmi,nmj->nij', J, J)
+        JTr = np.einsum('nmi,nm->ni', J, residuals)
+        # parameters sitting on a limit and pulling outwards are frozen
+        frozen = ((p[active] <= lower[active]) & (JTr > 0)) | \
+                 ((p[active] >= upper[active]) & (JTr < 0))
+        free = ~frozen
+        JTJ = JTJ * free[:, :, np.newaxis] * free[:, np.newaxis, :] \
+            + np.einsum('ni,ij->nij', frozen, np.eye(n_params))
+        JTr = JTr * free
+        edm = np.einsum('ni,ni->n', JTr, _solve(JTJ, JTr))
+        done = edm < 0.002 * tol
+        if np.any(done):
+            converged[active[done]] = True
+            active, JTJ, JTr = active[~done], JTJ[~done], JTr[~done]
+            if not len(active):
+                break
+        diagonal = np.maximum(np.einsum('nii->ni', JTJ), 1e-12)
+        A = JTJ + damping[active, np.newaxis, np.newaxis] \
+            * np.einsum('ni,ij->nij', diagonal, np.eye(n_params))
+        step = -_solve(A, JTr)
+        p_trial = np.clip(p[active] + step, lower[active], upper[active])
+
+        r_trial, jac_trial = func(p_trial, active)
+        n_calls[active] += 1
+        cost_trial = np.sum(r_trial**2, axis=1)
+        improved = cost_trial < cost[active]
+
+        accepted = active[improved]
+        p[accepted] = p_trial[improved]
+        r[accepted] = r_trial[improved]
+        jac[accepted] = jac_trial[improved]
+        cost[accepted] = cost_trial[improved]
+        damping[accepted] /= 10
+        damping[active[~improved]] *= 10
+
+        stuck[active[damping[active] > 1e10]] = True
+        active = active[~stuck[active]]
+
+    JTJ = np.einsum('nmi,nmj->nij', jac, jac)
+    with np.errstate(invalid='ignore'):
+        errors = np.sqrt(np.einsum('nii->ni', np.linalg.pinv(JTJ)))
+    return LMResult(p, errors, cost, converged, stuck, n_iter, n_calls)
+
+
+def _solve(A, b):
+    """Solve the stacked linear systems A x = b, singular ones via lstsq"""
+    try:
+        return np.linalg.solve(A, b[..., np.newaxis])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.array([np.linalg.lstsq(a, y, rcond=None)[0]
+                         for a, y in zip(A, b)]).reshape(b.shape)
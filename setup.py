@@ -14,7 +14,7 @@ setup(name='royfit',
       install_requires=[
           'numpy',
           'km3pipe',
-          'iminuit',
+          'iminuit<2',
           'matplotlib',
       ],
       classifiers=[